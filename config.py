@@ -1,11 +1,24 @@
 import os
 from dotenv import load_dotenv
 
-load_dotenv()
+ENV_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".env")
+PROCESS_ENV = dict(os.environ)  # Taken before .env is loaded, so a key removed from .env can be told apart
+load_dotenv(ENV_PATH)
 
 TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
 GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
-ALLOWED_USERS = os.getenv("ALLOWED_USERS", "").split(",")
+
+# Update delivery: "polling" or "webhook"
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")  # Public HTTPS base URL Telegram sends updates to
+WEBHOOK_PATH = "/telegram"
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")  # Checked against the X-Telegram-Bot-Api-Secret-Token header
+
+# Metrics endpoint (http://METRICS_LISTEN:METRICS_PORT/metrics), 0 disables it
+METRICS_LISTEN = os.getenv("METRICS_LISTEN", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9090"))  # Worker N of a multi-process bot uses METRICS_PORT + 1 + N
 
 # Gemini model settings
 MODEL_NAME = "gemini-1.5-flash-8b-exp-0924"
@@ -13,10 +26,29 @@ TEMPERATURE = 0.7
 TOP_P = 0.95
 TOP_K = 34
 MAX_TOKENS = 8024
+FALLBACK_MODEL_NAME = "gemini-1.5-flash"  # Used when the main model fails or is slow to answer
+VISION_MODEL_NAME = "gemini-1.5-flash"
+VISION_FALLBACK_MODEL_NAME = "gemini-1.5-flash-8b"
+
+# Per-chat text generation profiles. Each setting can be changed in .env as
+# <PROFILE>_<SETTING>, e.g. GROUP_MODEL_NAME or PRIVATE_MAX_TOKENS
+CHAT_PROFILES = {
+    "private": {"model_name": MODEL_NAME, "temperature": TEMPERATURE, "top_p": TOP_P, "top_k": TOP_K,
+                "max_tokens": MAX_TOKENS},
+    "group": {"model_name": "gemini-1.5-flash-8b", "temperature": TEMPERATURE, "top_p": TOP_P, "top_k": TOP_K,
+              "max_tokens": 1024},
+}
+CHAT_TYPE_PROFILES = {"private": "private", "group": "group", "supergroup": "group"}  # Other chats use "private"
+
+# Changes to .env (ALLOWED_USERS and profile settings) and system_instruction.txt apply without a restart
+CONFIG_RELOAD_INTERVAL = 2.0  # Seconds between checks for changed files
 
 
+# Read next to this file, so the bot can be started from any directory
+SYSTEM_INSTRUCTION_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'system_instruction.txt')
+
 try:
-    with open('system_instruction.txt', 'r', encoding='utf-8') as file:
+    with open(SYSTEM_INSTRUCTION_PATH, 'r', encoding='utf-8') as file:
         SYSTEM_INSTRUCTION = file.read().strip()
 except FileNotFoundError:
     print("Warning: system_instruction.txt not found. Using default instruction.")
@@ -24,6 +56,92 @@ except FileNotFoundError:
 
 # Conversation settings
 MAX_HISTORY = 25
+CONVERSATION_BACKEND = "memory"  # "memory", "sqlite", or "shared" when several workers run
+CONVERSATION_DB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "conversations.db")
+CONVERSATION_MAX_USERS = 10000  # Users kept in memory before the least recently active one is dropped
+CONVERSATION_FLUSH_INTERVAL = 0.5  # Seconds the SQLite writer waits to batch messages
+
+# Worker processes sharing one bot token (webhook mode only)
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", "1"))  # Updates of a chat always go to the same worker
+STATE_BACKEND = "local"  # Per-chat locks: "local" for one process, "file" for workers on one machine
+STATE_LOCK_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "locks")
+
+# Context window settings
+CONTEXT_TOKEN_BUDGET = 12000  # Maximum tokens sent to Gemini for one text request
+TOKEN_COUNTER = "local"  # "local" estimates tokens, "sdk" asks the API (cached per message)
+CHARS_PER_TOKEN = 3  # Used by the local estimator
+CONTEXT_SUMMARY_MODE = False  # Replace dropped turns with a rolling summary
+CONTEXT_SUMMARY_TOKENS = 512  # Part of the budget set aside for the summary
+
+# Gemini context caching of large, repeated prefixes. Only two prefixes can
+# reach the minimum size: a PDF read in map-reduce mode, which is then
+# uploaded once and answered directly, and a system instruction file of that
+# size. Chat history is never cached: it stays under CONTEXT_TOKEN_BUDGET and
+# shifts every turn once it is trimmed, so no prefix would be reused.
+CONTEXT_CACHE_ENABLED = False
+CONTEXT_CACHE_MIN_TOKENS = 32768  # Gemini does not cache smaller prefixes
+CONTEXT_CACHE_TTL = 3600  # Seconds a cached prefix lives without being reused
+CONTEXT_CACHE_MAX_ENTRIES = 32
+
+# PDF settings
+PDF_MAX_CHARS = 10000  # Characters of PDF text sent to Gemini
+PDF_WORKERS = min(4, os.cpu_count() or 1)  # Processes extracting pages of large PDFs
+PDF_PAGES_PER_TASK = 8
+PDF_PARALLEL_MIN_PAGES = 16  # Smaller PDFs are extracted without the process pool
+PDF_MAP_REDUCE = False  # Summarize long PDFs chunk by chunk instead of truncating them
+PDF_MAP_REDUCE_MAX_CHARS = 400000  # Characters of PDF text read in map-reduce mode
+PDF_CHUNK_TOKENS = 6000  # Size of each chunk summarized in the map stage
+PDF_CHUNK_SUMMARY_TOKENS = 512
+PDF_MAP_CONCURRENCY = 4  # Chunks summarized at the same time
+PDF_SUMMARY_CACHE_SIZE = 1024  # Chunk summaries kept for follow-up questions
+DOCUMENT_MEMORY_MAX_BYTES = 20 * 1024 * 1024  # Larger uploads are downloaded to a temporary file
+
+# Image settings
+IMAGE_MAX_SIDE = 1024  # Photos are downscaled so their longer side fits this
+IMAGE_FORMAT = "JPEG"  # JPEG, WEBP or PNG
+IMAGE_QUALITY = 85
+MEDIA_GROUP_WAIT = 1.0  # Seconds without a new photo that close an album
+MEDIA_GROUP_MAX_WAIT = 5.0
+
+# Response cache for repeated prompts (replies are replayed instead of regenerated)
+RESPONSE_CACHE_ENABLED = False
+RESPONSE_CACHE_WITH_HISTORY = False  # Also cache turns with history, keyed by its hash
+RESPONSE_CACHE_TTL = 3600  # Seconds
+RESPONSE_CACHE_MAX_ENTRIES = 1024
+RESPONSE_CACHE_REPLAY_CHARS = 200  # Chunk size used when a cached reply is replayed
+
+# Disk cache of downloaded photos and extracted PDF text, keyed by Telegram's file_unique_id
+FILE_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache")
+FILE_CACHE_MAX_BYTES = 256 * 1024 * 1024
+
+# Streaming settings
+GEMINI_MAX_WORKERS = 16  # Maximum number of Gemini streams running in parallel
+GEMINI_SPARE_WORKERS = 8  # Separate threads for fallback and hedged streams
+STREAM_QUEUE_SIZE = 32  # Chunks buffered per stream before the worker waits
+
+# Gemini resilience settings
+GEMINI_MAX_RETRIES = 3
+GEMINI_RETRY_BASE_DELAY = 0.5  # Seconds, doubled on every retry and jittered
+GEMINI_RETRY_MAX_DELAY = 8.0
+GEMINI_RETRY_BUDGET_RATIO = 0.2  # Retries allowed per request over the last 10 seconds
+GEMINI_CIRCUIT_FAILURES = 5  # Consecutive failures that stop requests to a model
+GEMINI_CIRCUIT_RESET = 30.0  # Seconds before a stopped model is tried again
+GEMINI_FIRST_TOKEN_TIMEOUT = 10.0  # Seconds before the request is also sent to the fallback model
+GEMINI_HEDGE_MAX = 4  # Hedged requests allowed per GEMINI_HEDGE_WINDOW, later ones wait for the primary
+GEMINI_HEDGE_WINDOW = 10.0  # Seconds
+GEMINI_STALL_TIMEOUT = 30.0  # Longest wait for the next chunk of a stream
+
+# Request queue settings
+REQUEST_POLICY = "queue"  # "queue" answers every message in order, "cancel" only the newest one
+REQUEST_MAX_ACTIVE = GEMINI_MAX_WORKERS  # Requests processed at the same time
+REQUEST_MAX_WAITING = 64  # More waiting requests get a "busy" reply
+REQUEST_MAX_PENDING_PER_CHAT = 3
+
+# Telegram edit rate limits
+EDIT_CHAT_RATE = 1.0  # Edits per second allowed in one chat
+EDIT_CHAT_BURST = 3
+EDIT_GLOBAL_RATE = 25.0  # Edits per second allowed across all chats
+EDIT_GLOBAL_BURST = 30
 
 SAFETY_SETTINGS = [
     {
@@ -0,0 +1,156 @@
+import logging
+import os
+import threading
+import time
+from dotenv import dotenv_values
+from config import (ENV_PATH, PROCESS_ENV, SYSTEM_INSTRUCTION_PATH, SYSTEM_INSTRUCTION, CHAT_PROFILES, CHAT_TYPE_PROFILES,
+                    CONFIG_RELOAD_INTERVAL)
+
+logger = logging.getLogger(__name__)
+
+class ChatProfile:
+    """Model and generation settings used to answer one kind of chat."""
+
+    FIELDS = {"model_name": str, "temperature": float, "top_p": float, "top_k": int, "max_tokens": int}
+
+    def __init__(self, name, model_name, temperature, top_p, top_k, max_tokens):
+        self.name = name
+        self.model_name = model_name
+        self.temperature = temperature
+        self.top_p = top_p
+        self.top_k = top_k
+        self.max_tokens = max_tokens
+
+    def settings(self):
+        return (self.temperature, self.top_p, self.top_k, self.max_tokens)
+
+ALLOW_ALL = "*"  # ALLOWED_USERS value that lets every user in
+
+def parse_allowed_users(value):
+    return frozenset(name.strip() for name in value.split(",") if name.strip())
+
+def _mtime(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+class ConfigService:
+    """Settings that can be changed without restarting the bot.
+
+    The allow-list and the chat profiles are read from the .env file, the
+    system instruction from its own file. Both files are read again when
+    their modification time changes. The check runs when a setting is
+    read, at most every ``check_interval`` seconds, so there is no
+    background thread and every worker process picks up changes on its
+    own. A file that cannot be read or has been removed keeps the
+    previous settings, and an invalid profile setting keeps its current
+    value, so a bad edit never widens access or resets a profile.
+
+    Values in .env take precedence over the environment the bot was
+    started with, so editing or removing a key always takes effect.
+
+    Args:
+        env_path (str): Path of the .env file.
+        instruction_path (str): Path of system_instruction.txt.
+        check_interval (float): Seconds between checks for changed files.
+    """
+
+    def __init__(self, env_path=ENV_PATH, instruction_path=SYSTEM_INSTRUCTION_PATH,
+                 check_interval=CONFIG_RELOAD_INTERVAL):
+        self.env_path = env_path
+        self.instruction_path = instruction_path
+        self.check_interval = check_interval
+        self.reloads = 0
+        self._lock = threading.Lock()
+        self._checked_at = None
+        self._env_mtime = None
+        self._instruction_mtime = None
+        self._allowed_users = frozenset()
+        self._system_instruction = SYSTEM_INSTRUCTION
+        self._profiles = {}
+        self._refresh()
+
+    @property
+    def allowed_users(self):
+        self._refresh()
+        return self._allowed_users
+
+    @property
+    def system_instruction(self):
+        self._refresh()
+        return self._system_instruction
+
+    def is_user_allowed(self, username):
+        """Return True if ``username`` may use the bot.
+
+        An empty allow-list lets nobody in; ``ALLOWED_USERS=*`` lets everyone in.
+        """
+        allowed_users = self.allowed_users
+        return ALLOW_ALL in allowed_users or username in allowed_users
+
+    def profile(self, chat_type):
+        """Return the ChatProfile for a Telegram chat type such as "private" or "group"."""
+        self._refresh()
+        return self._profiles[CHAT_TYPE_PROFILES.get(chat_type, "private")]
+
+    def _refresh(self):
+        now = time.monotonic()
+        if self._checked_at is not None and now - self._checked_at < self.check_interval:
+            return
+        with self._lock:
+            if self._checked_at is not None and now - self._checked_at < self.check_interval:
+                return
+            reloading = self._checked_at is not None
+            self._checked_at = now
+
+            changed = []
+            env_mtime = _mtime(self.env_path)
+            if reloading and env_mtime is None and self._env_mtime is not None:
+                self._env_mtime = None
+                logger.warning(f"{self.env_path} is missing, keeping the previous allow-list and profiles")
+            elif not reloading or env_mtime != self._env_mtime:
+                self._env_mtime = env_mtime
+                self._load_env()
+                changed.append(".env")
+            instruction_mtime = _mtime(self.instruction_path)
+            if instruction_mtime != self._instruction_mtime:
+                self._instruction_mtime = instruction_mtime
+                self._load_instruction()
+                changed.append("system instruction")
+            if reloading and changed:
+                self.reloads += 1
+                logger.info(f"Reloaded configuration: {', '.join(changed)}")
+
+    def _load_env(self):
+        values = dict(PROCESS_ENV)
+        try:
+            values.update((key, value) for key, value in dotenv_values(self.env_path).items() if value is not None)
+        except OSError as e:
+            logger.warning(f"Failed to read {self.env_path}: {e}")
+            if self._profiles:
+                return
+
+        profiles = {}
+        for name, defaults in CHAT_PROFILES.items():
+            current = self._profiles.get(name)
+            settings = {}
+            for field, cast in ChatProfile.FIELDS.items():
+                key = f"{name.upper()}_{field.upper()}"
+                try:
+                    settings[field] = cast(values[key]) if key in values else defaults[field]
+                except ValueError:
+                    settings[field] = getattr(current, field) if current else defaults[field]
+                    logger.warning(f"Ignoring invalid {key}={values[key]!r}, keeping {settings[field]!r}")
+            profiles[name] = ChatProfile(name, **settings)
+        self._profiles = profiles
+        self._allowed_users = parse_allowed_users(values.get("ALLOWED_USERS", ""))
+
+    def _load_instruction(self):
+        try:
+            with open(self.instruction_path, 'r', encoding='utf-8') as file:
+                self._system_instruction = file.read().strip()
+        except OSError as e:
+            logger.warning(f"Failed to read {self.instruction_path}, keeping the previous instruction: {e}")
+
+config_service = ConfigService()
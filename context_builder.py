@@ -0,0 +1,117 @@
+import hashlib
+import math
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from config import CONTEXT_TOKEN_BUDGET, CONTEXT_SUMMARY_TOKENS, CHARS_PER_TOKEN
+
+# Rough per-message cost of the role and part wrappers.
+MESSAGE_OVERHEAD_TOKENS = 4
+
+def estimate_tokens(text):
+    """Estimate the number of tokens in ``text`` without calling the API."""
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+def to_content(role, text):
+    return {"role": role, "parts": [{"text": text}]}
+
+class ContextBuilder:
+    """Fit the conversation history into a token budget.
+
+    The newest turns are kept until the budget is used up and older turns
+    are dropped. With a ``summarize`` callable the dropped turns are
+    replaced by a rolling summary instead; summaries are cached, so a
+    summary is only requested when the set of dropped turns changes.
+
+    Token counts are cached per message text, so a counter that calls the
+    API (``model.count_tokens``) is only used once for each message.
+
+    Args:
+        budget (int): Maximum number of tokens of the whole request.
+        count_tokens: Callable returning the token count of a string.
+        summarize: Optional callable ``summarize(previous_summary, messages)``
+            returning a summary of the messages, continuing the previous
+            summary when one is given.
+        summary_tokens (int): Part of the budget set aside for the summary.
+    """
+
+    def __init__(self, budget=CONTEXT_TOKEN_BUDGET, count_tokens=estimate_tokens, summarize=None,
+                 summary_tokens=CONTEXT_SUMMARY_TOKENS, cache_size=4096):
+        self.budget = budget
+        self.summarize = summarize
+        self.summary_tokens = summary_tokens
+        self.cache_size = cache_size
+        self._count_tokens = lru_cache(maxsize=cache_size)(count_tokens)
+        self._summaries = OrderedDict()
+        self._summaries_lock = threading.Lock()
+
+    def count(self, text):
+        """Token count of a single message, including its overhead."""
+        return self._count_tokens(text) + MESSAGE_OVERHEAD_TOKENS
+
+    def build(self, history, prompt, reserved_tokens=0):
+        """Return the Gemini contents for ``history`` followed by ``prompt``.
+
+        Args:
+            history (list): Conversation messages, oldest first.
+            prompt (str): The new user message, which is always included.
+            reserved_tokens (int): Tokens already used by the caller, for
+                example by the system instruction.
+
+        Returns:
+            list: Contents whose estimated size fits the budget whenever
+            the reserved tokens and the prompt do.
+        """
+        remaining = self.budget - reserved_tokens - self.count(prompt)
+        if self.summarize is not None:
+            remaining -= self.summary_tokens
+
+        start = len(history)
+        while start > 0:
+            cost = self.count(history[start - 1]["content"])
+            if cost > remaining:
+                break
+            remaining -= cost
+            start -= 1
+        # Gemini expects the history to open with a user turn.
+        while start < len(history) and history[start]["role"] != "user":
+            start += 1
+
+        contents = []
+        if start and self.summarize is not None:
+            summary = self._summary(history[:start])
+            summary_text = f"Summary of the earlier conversation:\n{summary}"
+            if summary and self.count(summary_text) + self.count("Understood.") <= self.summary_tokens:
+                contents.append(to_content("user", summary_text))
+                contents.append(to_content("model", "Understood."))
+        for msg in history[start:]:
+            role = "user" if msg["role"] == "user" else "model"
+            contents.append(to_content(role, msg["content"]))
+        contents.append(to_content("user", prompt))
+        return contents
+
+    def _summary(self, messages):
+        # digests[i] identifies messages[:i + 1], so a cached summary of a
+        # shorter prefix can be extended with just the newly dropped turns.
+        digest = hashlib.sha256()
+        digests = []
+        for msg in messages:
+            digest.update(f"{msg['role']}\0{msg['content']}\0".encode("utf-8"))
+            digests.append(digest.hexdigest())
+
+        previous, done = None, 0
+        with self._summaries_lock:
+            for i in range(len(digests) - 1, -1, -1):
+                if digests[i] in self._summaries:
+                    self._summaries.move_to_end(digests[i])
+                    previous, done = self._summaries[digests[i]], i + 1
+                    break
+        if done == len(messages):
+            return previous
+
+        summary = self.summarize(previous, messages[done:])
+        with self._summaries_lock:
+            self._summaries[digests[-1]] = summary
+            if len(self._summaries) > self.cache_size:
+                self._summaries.popitem(last=False)
+        return summary
@@ -0,0 +1,145 @@
+import datetime
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+from config import CONTEXT_CACHE_TTL, CONTEXT_CACHE_MIN_TOKENS, CONTEXT_CACHE_MAX_ENTRIES
+
+logger = logging.getLogger(__name__)
+
+class GeminiCacheClient:
+    """Thin wrapper over the SDK's cached content API."""
+
+    def create(self, model_name, system_instruction, contents, ttl):
+        from google.generativeai import caching
+        return caching.CachedContent.create(
+            model=model_name,
+            system_instruction=system_instruction,
+            contents=contents,
+            ttl=datetime.timedelta(seconds=ttl),
+        )
+
+    def refresh(self, handle, ttl):
+        handle.update(ttl=datetime.timedelta(seconds=ttl))
+
+    def delete(self, handle):
+        handle.delete()
+
+    def model_for(self, handle):
+        import google.generativeai as genai
+        return genai.GenerativeModel.from_cached_content(cached_content=handle)
+
+class _Entry:
+    def __init__(self, handle, model, tokens, expires_at):
+        self.handle = handle
+        self.model = model
+        self.tokens = tokens
+        self.expires_at = expires_at
+
+class ContextCache:
+    """Reuse Gemini cached content for large request prefixes that repeat.
+
+    A prefix (system instruction plus leading contents, such as an uploaded
+    PDF) is uploaded once and later requests only send what follows it.
+    Handles whose TTL is more than half used are renewed when reused; the
+    least recently used handle is deleted once ``max_entries`` are cached.
+    Prefixes smaller than ``min_tokens`` are not cached, since Gemini
+    rejects them.
+
+    Args:
+        client: Object with ``create``, ``refresh``, ``delete`` and
+            ``model_for`` methods; defaults to the Gemini SDK.
+        ttl (int): Lifetime of a cached prefix in seconds.
+        min_tokens (int): Smallest prefix worth caching.
+        max_entries (int): Maximum number of live cached prefixes.
+    """
+
+    def __init__(self, client=None, ttl=CONTEXT_CACHE_TTL, min_tokens=CONTEXT_CACHE_MIN_TOKENS,
+                 max_entries=CONTEXT_CACHE_MAX_ENTRIES):
+        self.client = client if client is not None else GeminiCacheClient()
+        self.ttl = ttl
+        self.min_tokens = min_tokens
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.tokens_reused = 0
+
+    @staticmethod
+    def key(model_name, system_instruction, contents):
+        digest = hashlib.sha256(f"{model_name}\0{system_instruction}\0".encode("utf-8"))
+        for content in contents:
+            for part in content["parts"]:
+                digest.update(f"{content['role']}\0{part['text']}\0".encode("utf-8"))
+        return digest.hexdigest()
+
+    def get_model(self, model_name, system_instruction, contents, tokens):
+        """Return a model bound to the cached prefix, or None to send it in full.
+
+        Args:
+            model_name (str): Model the prefix is cached for.
+            system_instruction (str): System instruction of the prefix.
+            contents (list): Leading contents of the prefix.
+            tokens (int): Estimated size of the prefix.
+        """
+        if tokens < self.min_tokens:
+            return None
+        key = self.key(model_name, system_instruction, contents)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.expires_at <= now:
+                del self._entries[key]
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                self.tokens_reused += entry.tokens
+                renew = entry.expires_at - now < self.ttl / 2
+                if renew:
+                    entry.expires_at = now + self.ttl
+            else:
+                self.misses += 1
+        if entry is not None:
+            if renew:
+                try:
+                    self.client.refresh(entry.handle, self.ttl)
+                except Exception as e:
+                    logger.warning(f"Failed to renew cached context: {e}")
+            return entry.model
+
+        try:
+            handle = self.client.create(model_name, system_instruction, contents, self.ttl)
+            model = self.client.model_for(handle)
+        except Exception as e:
+            logger.warning(f"Failed to cache context, sending it in full: {e}")
+            return None
+
+        evicted = []
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                evicted.append(previous)
+            self._entries[key] = _Entry(handle, model, tokens, time.monotonic() + self.ttl)
+            while len(self._entries) > self.max_entries:
+                evicted.append(self._entries.popitem(last=False)[1])
+        for entry in evicted:
+            self._delete(entry)
+        return model
+
+    def clear(self):
+        with self._lock:
+            entries = list(self._entries.values())
+            self._entries.clear()
+        for entry in entries:
+            self._delete(entry)
+
+    def _delete(self, entry):
+        if entry.expires_at <= time.monotonic():
+            return
+        try:
+            self.client.delete(entry.handle)
+        except Exception as e:
+            logger.warning(f"Failed to delete cached context: {e}")
@@ -1,18 +1,357 @@
-from config import MAX_HISTORY
+import asyncio
+import logging
+import queue
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, deque
+from config import (MAX_HISTORY, CONVERSATION_BACKEND, CONVERSATION_DB_PATH, CONVERSATION_MAX_USERS,
+                    CONVERSATION_FLUSH_INTERVAL)
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS messages (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        role TEXT NOT NULL,
+        content TEXT NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_messages_user ON messages (user_id, id);
+    CREATE TABLE IF NOT EXISTS settings (
+        user_id INTEGER NOT NULL,
+        name TEXT NOT NULL,
+        value TEXT NOT NULL,
+        PRIMARY KEY (user_id, name)
+    );
+"""
+
+class MemoryConversationStore:
+    """In-memory conversation store bounded in users and messages.
+
+    Each user's history is a deque holding at most ``max_messages`` entries,
+    and only the ``max_users`` most recently active users are kept. User
+    settings, such as the /nocache choice, are kept apart from the history
+    and are not dropped with it.
+    """
+
+    def __init__(self, max_users=CONVERSATION_MAX_USERS, max_messages=MAX_HISTORY * 2):
+        self.max_users = max_users
+        self.max_messages = max_messages
+        self._conversations = OrderedDict()
+        self._settings = {}
+
+    def _messages(self, user_id, loaded=None):
+        messages = self._conversations.get(user_id)
+        if messages is None:
+            messages = deque(self._load(user_id) if loaded is None else loaded, maxlen=self.max_messages)
+            self._conversations[user_id] = messages
+            if len(self._conversations) > self.max_users:
+                self._conversations.popitem(last=False)
+        else:
+            self._conversations.move_to_end(user_id)
+        return messages
+
+    def _load(self, user_id):
+        return ()
+
+    def append(self, user_id, message):
+        self._messages(user_id).append(message)
+
+    def get(self, user_id):
+        return list(self._messages(user_id))
+
+    def clear(self, user_id):
+        self._conversations.pop(user_id, None)
+
+    async def append_async(self, user_id, message):
+        self.append(user_id, message)
+
+    async def get_async(self, user_id):
+        return self.get(user_id)
+
+    async def clear_async(self, user_id):
+        self.clear(user_id)
+
+    def get_setting(self, user_id, name):
+        return self._settings.get((user_id, name))
+
+    def set_setting(self, user_id, name, value):
+        """Store a user setting as a string; None removes it."""
+        if value is None:
+            self._settings.pop((user_id, name), None)
+        else:
+            self._settings[(user_id, name)] = value
+
+    async def get_setting_async(self, user_id, name):
+        return self.get_setting(user_id, name)
+
+    async def set_setting_async(self, user_id, name, value):
+        self.set_setting(user_id, name, value)
+
+    def close(self):
+        pass
+
+class SQLiteConversationStore(MemoryConversationStore):
+    """Conversation store persisted to SQLite, with the memory store as cache.
+
+    A user's history is read from the database the first time it is needed
+    after a restart or after being evicted from the cache; ``get_async``
+    does that read on a worker thread. Writes are queued and committed in
+    batches by a background thread, so handlers never wait on the disk. The
+    database runs in WAL mode so reads are not blocked by the writer. User
+    settings are few and rarely change: they are all read at startup and
+    written straight away.
+    """
+
+    def __init__(self, path=CONVERSATION_DB_PATH, max_users=CONVERSATION_MAX_USERS,
+                 max_messages=MAX_HISTORY * 2, flush_interval=CONVERSATION_FLUSH_INTERVAL):
+        super().__init__(max_users, max_messages)
+        self.path = path
+        self.flush_interval = flush_interval
+        self._connection = self._connect()
+        self._connection.executescript(SCHEMA)
+        self._connection_lock = threading.Lock()
+        for user_id, name, value in self._connection.execute("SELECT user_id, name, value FROM settings"):
+            self._settings[(user_id, name)] = value
+        self._writes = queue.Queue()
+        # Writes queued per user; the condition is notified as they are committed.
+        self._unflushed = {}
+        self._flushed = threading.Condition()
+        self._writer = threading.Thread(target=self._write_loop, name="conversation-writer", daemon=True)
+        self._writer.start()
+
+    def _connect(self):
+        connection = sqlite3.connect(self.path, check_same_thread=False)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        return connection
+
+    def _load(self, user_id):
+        with self._flushed:
+            # The user was evicted before their last messages reached the
+            # disk: wait for those writes only, not for the whole queue.
+            self._flushed.wait_for(lambda: user_id not in self._unflushed)
+        with self._connection_lock:
+            rows = self._connection.execute(
+                "SELECT role, content FROM (SELECT id, role, content FROM messages WHERE user_id = ? "
+                "ORDER BY id DESC LIMIT ?) ORDER BY id",
+                (user_id, self.max_messages),
+            ).fetchall()
+        return [{"role": role, "content": content} for role, content in rows]
+
+    async def get_async(self, user_id):
+        if user_id in self._conversations:
+            return self.get(user_id)
+        loaded = await asyncio.to_thread(self._load, user_id)
+        # Another call may have loaded the history in the meantime; that copy wins.
+        return list(self._messages(user_id, loaded))
+
+    async def append_async(self, user_id, message):
+        await self.get_async(user_id)
+        self.append(user_id, message)
+
+    def set_setting(self, user_id, name, value):
+        super().set_setting(user_id, name, value)
+        with self._connection_lock, self._connection:
+            _save_setting(self._connection, user_id, name, value)
+
+    async def set_setting_async(self, user_id, name, value):
+        await asyncio.to_thread(self.set_setting, user_id, name, value)
+
+    def _enqueue(self, user_id, operation):
+        with self._flushed:
+            self._unflushed[user_id] = self._unflushed.get(user_id, 0) + 1
+        self._writes.put((user_id, operation))
+
+    def append(self, user_id, message):
+        super().append(user_id, message)
+        self._enqueue(user_id, (message["role"], message["content"]))
+
+    def clear(self, user_id):
+        super().clear(user_id)
+        # Keep an empty entry so the cleared history is not read back from disk.
+        self._conversations[user_id] = deque(maxlen=self.max_messages)
+        self._enqueue(user_id, None)
+
+    def close(self):
+        self._writes.put(None)
+        self._writer.join()
+        with self._connection_lock:
+            self._connection.close()
+
+    def _next_batch(self):
+        batch = [self._writes.get()]
+        deadline = time.monotonic() + self.flush_interval
+        while batch[-1] is not None:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._writes.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _write_loop(self):
+        connection = self._connect()
+        while True:
+            batch = self._next_batch()
+            writes = [item for item in batch if item is not None]
+            try:
+                with connection:
+                    for user_id, operation in writes:
+                        if operation is None:
+                            connection.execute("DELETE FROM messages WHERE user_id = ?", (user_id,))
+                        else:
+                            connection.execute(
+                                "INSERT INTO messages (user_id, role, content) VALUES (?, ?, ?)",
+                                (user_id, *operation),
+                            )
+                    for user_id in {user_id for user_id, _ in writes}:
+                        connection.execute(
+                            "DELETE FROM messages WHERE user_id = ? AND id <= (SELECT id FROM messages "
+                            "WHERE user_id = ? ORDER BY id DESC LIMIT 1 OFFSET ?)",
+                            (user_id, user_id, self.max_messages),
+                        )
+            except sqlite3.Error as e:
+                logger.error(f"Failed to save {len(writes)} conversation messages: {e}")
+            with self._flushed:
+                for user_id, _ in writes:
+                    self._unflushed[user_id] -= 1
+                    if not self._unflushed[user_id]:
+                        del self._unflushed[user_id]
+                self._flushed.notify_all()
+            for _ in batch:
+                self._writes.task_done()
+            if len(writes) < len(batch):
+                connection.close()
+                return
+
+class SharedSQLiteConversationStore:
+    """Conversation store read and written straight from SQLite.
+
+    Unlike SQLiteConversationStore nothing is cached or written behind, so
+    several worker processes can use the same database and always see each
+    other's messages. The async methods run the queries on a worker thread,
+    since a write may wait for another process to release the database.
+
+    History is kept per user while the router and the request queue order
+    requests per chat. In private chats the two are the same; a user who
+    writes in several chats at once, served by different workers, can have
+    turns from those chats interleaved in their history.
+    """
+
+    def __init__(self, path=CONVERSATION_DB_PATH, max_messages=MAX_HISTORY * 2):
+        self.path = path
+        self.max_messages = max_messages
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.executescript(SCHEMA)
+
+    def append(self, user_id, message):
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT INTO messages (user_id, role, content) VALUES (?, ?, ?)",
+                (user_id, message["role"], message["content"]),
+            )
+            self._connection.execute(
+                "DELETE FROM messages WHERE user_id = ? AND id <= (SELECT id FROM messages "
+                "WHERE user_id = ? ORDER BY id DESC LIMIT 1 OFFSET ?)",
+                (user_id, user_id, self.max_messages),
+            )
+
+    def get(self, user_id):
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT role, content FROM (SELECT id, role, content FROM messages WHERE user_id = ? "
+                "ORDER BY id DESC LIMIT ?) ORDER BY id",
+                (user_id, self.max_messages),
+            ).fetchall()
+        return [{"role": role, "content": content} for role, content in rows]
+
+    def clear(self, user_id):
+        with self._lock, self._connection:
+            self._connection.execute("DELETE FROM messages WHERE user_id = ?", (user_id,))
+
+    async def append_async(self, user_id, message):
+        await asyncio.to_thread(self.append, user_id, message)
+
+    async def get_async(self, user_id):
+        return await asyncio.to_thread(self.get, user_id)
+
+    async def clear_async(self, user_id):
+        await asyncio.to_thread(self.clear, user_id)
+
+    def get_setting(self, user_id, name):
+        with self._lock:
+            row = self._connection.execute("SELECT value FROM settings WHERE user_id = ? AND name = ?",
+                                           (user_id, name)).fetchone()
+        return row[0] if row else None
+
+    def set_setting(self, user_id, name, value):
+        with self._lock, self._connection:
+            _save_setting(self._connection, user_id, name, value)
+
+    async def get_setting_async(self, user_id, name):
+        return await asyncio.to_thread(self.get_setting, user_id, name)
+
+    async def set_setting_async(self, user_id, name, value):
+        await asyncio.to_thread(self.set_setting, user_id, name, value)
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+def _save_setting(connection, user_id, name, value):
+    if value is None:
+        connection.execute("DELETE FROM settings WHERE user_id = ? AND name = ?", (user_id, name))
+    else:
+        connection.execute("INSERT OR REPLACE INTO settings (user_id, name, value) VALUES (?, ?, ?)",
+                           (user_id, name, value))
+
+def create_store(backend=CONVERSATION_BACKEND):
+    if backend == "sqlite":
+        return SQLiteConversationStore()
+    if backend == "shared":
+        return SharedSQLiteConversationStore()
+    return MemoryConversationStore()
 
 class ConversationManager:
-    def __init__(self):
-        self.conversations = {}
+    def __init__(self, store=None):
+        self.store = store if store is not None else create_store()
 
     def add_message(self, user_id, role, content):
-        if user_id not in self.conversations:
-            self.conversations[user_id] = []
-        self.conversations[user_id].append({"role": role, "content": content})
-        if len(self.conversations[user_id]) > MAX_HISTORY * 2:
-            self.conversations[user_id] = self.conversations[user_id][-MAX_HISTORY * 2:]
+        self.store.append(user_id, {"role": role, "content": content})
 
     def get_history(self, user_id):
-        return self.conversations.get(user_id, [])
+        return self.store.get(user_id)
 
     def clear_history(self, user_id):
-        self.conversations[user_id] = []
\ No newline at end of file
+        self.store.clear(user_id)
+
+    # Async versions for the event loop: stores that have to wait on the
+    # disk do it on a worker thread.
+
+    async def add_message_async(self, user_id, role, content):
+        await self.store.append_async(user_id, {"role": role, "content": content})
+
+    async def get_history_async(self, user_id):
+        return await self.store.get_async(user_id)
+
+    async def clear_history_async(self, user_id):
+        await self.store.clear_async(user_id)
+
+    # Per-user settings live in the same store, so they survive restarts
+    # and are shared by the webhook workers when the store is.
+
+    async def get_setting_async(self, user_id, name):
+        return await self.store.get_setting_async(user_id, name)
+
+    async def set_setting_async(self, user_id, name, value):
+        await self.store.set_setting_async(user_id, name, value)
+
+    def close(self):
+        self.store.close()
\ No newline at end of file
@@ -0,0 +1,237 @@
+import asyncio
+import hashlib
+import logging
+import time
+
+from telegram.error import BadRequest, RetryAfter, TimedOut
+
+from config import EDIT_CHAT_RATE, EDIT_CHAT_BURST, EDIT_GLOBAL_RATE, EDIT_GLOBAL_BURST
+
+logger = logging.getLogger(__name__)
+
+
+def _digest(text, parse_mode):
+    return hashlib.blake2b(f"{parse_mode}\0{text}".encode("utf-8"), digest_size=16).digest()
+
+
+def _seconds(retry_after):
+    # Newer python-telegram-bot versions report a timedelta instead of seconds.
+    if hasattr(retry_after, "total_seconds"):
+        return retry_after.total_seconds()
+    return float(retry_after)
+
+
+class TokenBucket:
+    """Token bucket rate limiter for coroutines.
+
+    Args:
+        rate (float): Tokens added per second.
+        capacity (int): Maximum number of tokens, i.e. the allowed burst.
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    @property
+    def full(self):
+        self._refill()
+        return self._tokens >= self.capacity
+
+    async def acquire(self):
+        """Wait until a token is available and take it."""
+        while True:
+            self._refill()
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return
+            await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    def pause(self, seconds):
+        """Hand out no tokens for the given number of seconds."""
+        self._refill()
+        self._tokens = min(self._tokens, 0) - seconds * self.rate
+
+
+class _EditState:
+    def __init__(self, message):
+        self.message = message
+        self.pending = None
+        self.last_digest = None
+        self.task = None
+        self.error = None
+
+
+class EditScheduler:
+    """Coalesce and rate limit edits of streamed Telegram messages.
+
+    ``update`` only records the newest text of a message; a background task
+    per message sends it as soon as the per-chat and global token buckets
+    allow, so intermediate texts that arrive in the meantime are never
+    sent. Edits whose content equals the last text sent are skipped, and
+    ``RetryAfter`` responses pause the chat instead of failing the reply.
+    ``flush`` waits until the final text has been delivered.
+    """
+
+    def __init__(self, chat_rate=EDIT_CHAT_RATE, chat_burst=EDIT_CHAT_BURST,
+                 global_rate=EDIT_GLOBAL_RATE, global_burst=EDIT_GLOBAL_BURST, max_retries=3):
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self._global_bucket = TokenBucket(global_rate, global_burst)
+        self._chat_buckets = {}
+        self._swept_size = 0  # Number of chat buckets left by the last sweep
+        self._states = {}
+        self.requested = 0
+        self.sent = 0
+        self.skipped = 0
+        self.retries = 0
+
+    def stats(self):
+        """Return counters describing how many edits were saved."""
+        return {
+            "requested": self.requested,
+            "sent": self.sent,
+            "skipped_unchanged": self.skipped,
+            "coalesced": self.requested - self.sent - self.skipped,
+            "saved": self.requested - self.sent,
+            "retries": self.retries,
+        }
+
+    async def update(self, message, text, parse_mode=None, on_sent=None):
+        """Schedule an edit of ``message`` to ``text`` without waiting for it.
+
+        Raises the error of a previous background edit of the same message,
+        if there was one, so callers can fall back as they would for a
+        direct ``edit_text`` call. ``on_sent`` is called once this text, or
+        a newer one that replaced it, is shown in the chat.
+        """
+        state = self._state(message)
+        if state.error is not None:
+            error, state.error = state.error, None
+            raise error
+        self.requested += 1
+        if on_sent is None and state.pending is not None:
+            on_sent = state.pending[2]
+        state.pending = (text, parse_mode, on_sent)
+        if state.task is None or state.task.done():
+            state.task = asyncio.create_task(self._drain(state))
+
+    async def flush(self, message, text=None, parse_mode=None, on_sent=None):
+        """Send the newest text of ``message`` and wait until it is delivered."""
+        if text is not None:
+            await self.update(message, text, parse_mode=parse_mode, on_sent=on_sent)
+        state = self._states.pop(self._key(message), None)
+        if state is None:
+            return
+        if state.task is not None:
+            await state.task
+        self._release_chat(message.chat_id)
+        logger.debug(f"Edit scheduler stats: {self.stats()}")
+        if state.error is not None:
+            raise state.error
+
+    def discard(self, message):
+        """Drop pending edits of a message that is about to be deleted."""
+        state = self._states.pop(self._key(message), None)
+        if state is not None and state.task is not None:
+            state.task.cancel()
+        self._release_chat(message.chat_id)
+
+    def _key(self, message):
+        return (message.chat_id, message.message_id)
+
+    def _state(self, message):
+        key = self._key(message)
+        state = self._states.get(key)
+        if state is None:
+            state = self._states[key] = _EditState(message)
+        return state
+
+    def _chat_bucket(self, chat_id):
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self._chat_buckets) >= max(64, 2 * self._swept_size):
+                self._sweep()
+            bucket = self._chat_buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return bucket
+
+    def _sweep(self):
+        # Buckets of chats that were still being throttled when their
+        # message finished; sweeping only when the number has doubled keeps
+        # the cost per new chat constant.
+        busy = {key[0] for key in self._states}
+        for chat_id in [chat_id for chat_id, bucket in self._chat_buckets.items()
+                        if chat_id not in busy and bucket.full]:
+            del self._chat_buckets[chat_id]
+        self._swept_size = len(self._chat_buckets)
+
+    def _release_chat(self, chat_id):
+        # A full bucket holds no information, so idle chats do not pile up.
+        if any(key[0] == chat_id for key in self._states):
+            return
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is not None and bucket.full:
+            del self._chat_buckets[chat_id]
+
+    def _is_unchanged(self, state):
+        text, parse_mode, _ = state.pending
+        if _digest(text, parse_mode) != state.last_digest:
+            return False
+        state.pending = None
+        self.skipped += 1
+        return True
+
+    async def _drain(self, state):
+        chat_id = state.message.chat_id
+        attempts = 0
+        try:
+            while state.pending is not None:
+                if self._is_unchanged(state):
+                    continue
+                await self._chat_bucket(chat_id).acquire()
+                await self._global_bucket.acquire()
+                # Newer text may have arrived while waiting; send only that.
+                if self._is_unchanged(state):
+                    continue
+                text, parse_mode, on_sent = state.pending
+                state.pending = None
+                digest = _digest(text, parse_mode)
+                try:
+                    await state.message.edit_text(text, parse_mode=parse_mode)
+                except RetryAfter as e:
+                    self.retries += 1
+                    delay = _seconds(e.retry_after)
+                    logger.warning(f"Flood control on chat {chat_id}, pausing edits for {delay} seconds")
+                    self._chat_bucket(chat_id).pause(delay)
+                    if state.pending is None:
+                        state.pending = (text, parse_mode, on_sent)
+                    continue
+                except TimedOut:
+                    self.retries += 1
+                    attempts += 1
+                    if attempts >= self.max_retries:
+                        raise
+                    logger.warning("Edit timed out. Retrying...")
+                    if state.pending is None:
+                        state.pending = (text, parse_mode, on_sent)
+                    continue
+                except BadRequest as e:
+                    if "Message is not modified" not in str(e):
+                        raise
+                    self.skipped += 1
+                else:
+                    self.sent += 1
+                state.last_digest = digest
+                attempts = 0
+                if on_sent is not None:
+                    on_sent()
+        except Exception as e:
+            state.error = e
@@ -0,0 +1,118 @@
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from config import FILE_CACHE_DIR, FILE_CACHE_MAX_BYTES
+
+logger = logging.getLogger(__name__)
+
+class FileCache:
+    """Disk-backed LRU cache of byte strings.
+
+    Entries live in one file each, named after the SHA-256 of the key, so
+    the cache survives restarts. When the total size goes over
+    ``max_bytes`` the least recently used entries are deleted. Keys are
+    meant to be stable identifiers such as Telegram's ``file_unique_id``
+    or a hash of the content.
+
+    Several processes, such as the webhook workers, may share the
+    directory: lookups read the file directly, recency is the file's
+    modification time, and every ``put`` scans the directory again before
+    evicting, so ``max_bytes`` bounds the total of all of them.
+
+    Args:
+        directory (str): Where the entries are stored.
+        max_bytes (int): Maximum total size of all entries.
+    """
+
+    def __init__(self, directory=FILE_CACHE_DIR, max_bytes=FILE_CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._sizes = OrderedDict()
+        self._total = 0
+        os.makedirs(directory, exist_ok=True)
+        self._scan()
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self._sizes), "bytes": self._total}
+
+    def _scan(self):
+        """Rebuild the index from the directory, least recently used first."""
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and not entry.name.startswith("."):
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue  # Evicted by another process meanwhile
+                entries.append((stat.st_mtime_ns, entry.name, stat.st_size))
+        self._sizes = OrderedDict((name, size) for _, name, size in sorted(entries))
+        self._total = sum(self._sizes.values())
+
+    def _name(self, key):
+        return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        """Return the bytes stored under ``key``, or None."""
+        name = self._name(key)
+        path = os.path.join(self.directory, name)
+        # The file is read even when the index does not know it, since
+        # another process may have written it.
+        try:
+            with open(path, "rb") as file:
+                data = file.read()
+            os.utime(path)
+        except OSError:
+            with self._lock:
+                self._total -= self._sizes.pop(name, 0)
+                self.misses += 1
+            return None
+        with self._lock:
+            self._total += len(data) - self._sizes.pop(name, 0)
+            self._sizes[name] = len(data)
+            self.hits += 1
+        return data
+
+    def put(self, key, data):
+        """Store ``data`` under ``key``, evicting old entries if needed."""
+        if len(data) > self.max_bytes:
+            return
+        name = self._name(key)
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as file:
+                file.write(data)
+            os.replace(temp_path, os.path.join(self.directory, name))
+        except OSError as e:
+            logger.warning(f"Failed to write cache entry: {e}")
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            return
+
+        evicted = []
+        with self._lock:
+            # Entries written by other processes count too.
+            self._scan()
+            if name in self._sizes:
+                self._sizes.move_to_end(name)
+            while self._total > self.max_bytes:
+                old_name, size = self._sizes.popitem(last=False)
+                self._total -= size
+                evicted.append(old_name)
+        for old_name in evicted:
+            try:
+                os.remove(os.path.join(self.directory, old_name))
+            except OSError:
+                pass
+
+    def get_text(self, key):
+        data = self.get(key)
+        return None if data is None else data.decode("utf-8")
+
+    def put_text(self, key, text):
+        self.put(key, text.encode("utf-8"))
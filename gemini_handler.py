@@ -1,44 +1,44 @@
-import google.generativeai as genai
-from config import GOOGLE_API_KEY, MODEL_NAME, TEMPERATURE, TOP_P, TOP_K, MAX_TOKENS, SAFETY_SETTINGS
-from PIL import Image
-import pdfplumber
-
-genai.configure(api_key=GOOGLE_API_KEY)
-text_model = genai.GenerativeModel(MODEL_NAME)
-vision_model = genai.GenerativeModel('gemini-1.5-flash')
-
-def generate_text(prompt, system_instruction, history):
-    messages = [
-        {"role": "user", "parts": [{"text": system_instruction}]},
-        {"role": "model", "parts": [{"text": "Understood. I will act as a helpful AI assistant."}]}
-    ]
-    for msg in history:
-        role = "user" if msg["role"] == "user" else "model"
-        messages.append({"role": role, "parts": [{"text": msg["content"]}]})
-    messages.append({"role": "user", "parts": [{"text": prompt}]})
-    
-    response = text_model.generate_content(
-        messages,
-        generation_config=genai.types.GenerationConfig(
-            temperature=TEMPERATURE,
-            top_p=TOP_P,
-            top_k=TOP_K,
-            max_output_tokens=MAX_TOKENS,
-        ),
-        safety_settings=SAFETY_SETTINGS,
-        stream=True
-    )
-    
-    for chunk in response:
-        if hasattr(chunk, 'text'):
-            yield chunk.text
-        elif hasattr(chunk, 'parts'):
-            for part in chunk.parts:
-                if hasattr(part, 'text'):
-                    yield part.text
+import asyncio
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from config import (GOOGLE_API_KEY, MODEL_NAME, FALLBACK_MODEL_NAME, VISION_MODEL_NAME, VISION_FALLBACK_MODEL_NAME,
+                    TEMPERATURE, TOP_P, TOP_K, MAX_TOKENS, SAFETY_SETTINGS,
+                    TOKEN_COUNTER, CONTEXT_SUMMARY_MODE, CONTEXT_SUMMARY_TOKENS, CONTEXT_CACHE_ENABLED,
+                    CHARS_PER_TOKEN, PDF_MAX_CHARS, PDF_MAP_REDUCE, PDF_MAP_REDUCE_MAX_CHARS, PDF_CHUNK_TOKENS,
+                    PDF_CHUNK_SUMMARY_TOKENS, PDF_MAP_CONCURRENCY, PDF_SUMMARY_CACHE_SIZE, RESPONSE_CACHE_ENABLED,
+                    RESPONSE_CACHE_WITH_HISTORY)
+from config_service import config_service
+from utils import iterate_in_thread, split_text
+from context_builder import ContextBuilder, estimate_tokens
+from context_cache import ContextCache
+from pdf_extractor import extract_pdf_text
+from response_cache import ResponseCache, replay_chunks
+from gemini_resilience import ResilientStreamer
+from metrics import registry
+
+logger = logging.getLogger(__name__)
+
+# Importing the Gemini SDK takes seconds, so it is loaded on first use
+# instead of when the bot starts.
+_genai = None
+_genai_lock = threading.Lock()
 
-def analyze_image(image: Image, prompt: str):
-    response = vision_model.generate_content([prompt, image], safety_settings=SAFETY_SETTINGS, stream=True)
+def get_genai():
+    """Return the configured ``google.generativeai`` module, importing it if needed."""
+    global _genai
+    if _genai is not None:
+        return _genai
+    with _genai_lock:
+        if _genai is None:
+            import google.generativeai as genai
+            genai.configure(api_key=GOOGLE_API_KEY)
+            _genai = genai
+    return _genai
+
+def _iter_text(response):
     for chunk in response:
         if hasattr(chunk, 'text'):
             yield chunk.text
@@ -47,39 +47,299 @@ def analyze_image(image: Image, prompt: str):
                 if hasattr(part, 'text'):
                     yield part.text
 
-def process_pdf(file_path, prompt):
+def summarize_history(previous_summary, messages):
+    transcript = "\n".join(f"{msg['role']}: {msg['content']}" for msg in messages)
+    request = f"Summarize the following conversation concisely, keeping facts, names and decisions:\n\n{transcript}"
+    if previous_summary:
+        request = f"Summary so far:\n{previous_summary}\n\n{request}"
+    response = get_text_model(None).generate_content(
+        request,
+        generation_config=get_genai().types.GenerationConfig(temperature=0.2, max_output_tokens=CONTEXT_SUMMARY_TOKENS // 2),
+        safety_settings=SAFETY_SETTINGS,
+    )
+    return response.text.strip()
+
+def count_tokens_sdk(text):
+    return get_text_model(None).count_tokens(text).total_tokens
+
+context_cache = ContextCache()
+context_builder = ContextBuilder(
+    count_tokens=count_tokens_sdk if TOKEN_COUNTER == "sdk" else estimate_tokens,
+    summarize=summarize_history if CONTEXT_SUMMARY_MODE else None,
+)
+
+@lru_cache(maxsize=16)
+def get_text_model(system_instruction, model_name=MODEL_NAME):
+    return get_genai().GenerativeModel(model_name, system_instruction=system_instruction)
+
+@lru_cache(maxsize=4)
+def get_vision_model(model_name=VISION_MODEL_NAME):
+    return get_genai().GenerativeModel(model_name)
+
+def _generation_config(profile=None):
+    if profile is not None:
+        temperature, top_p, top_k, max_tokens = profile.settings()
+    else:
+        temperature, top_p, top_k, max_tokens = TEMPERATURE, TOP_P, TOP_K, MAX_TOKENS
+    return get_genai().types.GenerationConfig(
+        temperature=temperature,
+        top_p=top_p,
+        top_k=top_k,
+        max_output_tokens=max_tokens,
+    )
+
+def _model_for_prefix(system_instruction, prefix, prefix_tokens, model_name=MODEL_NAME):
+    """Return a model bound to a cached copy of the prefix, if caching applies."""
+    if not CONTEXT_CACHE_ENABLED:
+        return None
+    # The cache client uses the SDK directly, which must be configured first.
+    get_genai()
+    return context_cache.get_model(model_name, system_instruction, prefix, prefix_tokens)
+
+def generate_text(prompt, system_instruction, history, model_name=MODEL_NAME, profile=None):
+    system_tokens = context_builder.count(system_instruction)
+    messages = context_builder.build(history, prompt, system_tokens)
+    model = (_model_for_prefix(system_instruction, [], system_tokens, model_name)
+             or get_text_model(system_instruction, model_name))
+
+    response = model.generate_content(
+        messages,
+        generation_config=_generation_config(profile),
+        safety_settings=SAFETY_SETTINGS,
+        stream=True
+    )
+    
+    yield from _iter_text(response)
+
+def analyze_image(image, prompt: str, model_name=VISION_MODEL_NAME, profile=None):
+    # image is a PIL image, an already encoded {"mime_type", "data"} blob,
+    # or a list of those for an album analyzed in one request
+    images = image if isinstance(image, list) else [image]
+    response = get_vision_model(model_name).generate_content(
+        [prompt, *images],
+        generation_config=_generation_config(profile),
+        safety_settings=SAFETY_SETTINGS,
+        stream=True
+    )
+    yield from _iter_text(response)
+
+def _pdf_document(text):
+    return f"Analyze the following PDF content:\n\n{text}"
+
+def cached_pdf_model(text, model_name=MODEL_NAME):
+    """Return a model bound to a cached copy of the PDF text, if caching applies."""
+    document = _pdf_document(text)
+    prefix = [
+        {"role": "user", "parts": [{"text": document}]},
+        {"role": "model", "parts": [{"text": "I have read the PDF content."}]},
+    ]
+    return _model_for_prefix(None, prefix, context_builder.count(document), model_name)
+
+def analyze_pdf_text(text, prompt, model=None, profile=None):
     try:
-        with pdfplumber.open(file_path) as pdf:
-            text = ""
-            for page in pdf.pages:
-                text += page.extract_text() + "\n"
+        document = _pdf_document(text)
+        model_name = profile.model_name if profile is not None else MODEL_NAME
+        if model is None:
+            model = cached_pdf_model(text, model_name)
+        if model is not None:
+            # The PDF content is already cached, only the request is sent.
+            messages = [{"role": "user", "parts": [{"text": f"User's request: {prompt}"}]}]
+        else:
+            model = get_text_model(None, model_name)
+            messages = [{"role": "user", "parts": [{"text": f"{document}\n\nUser's request: {prompt}"}]}]
+
+        response = model.generate_content(
+            messages,
+            generation_config=_generation_config(profile),
+            safety_settings=SAFETY_SETTINGS,
+            stream=True
+        )
         
-        max_chars = 10000
-        if len(text) > max_chars:
-            text = text[:max_chars] + "...(truncated)"
+        yield from _iter_text(response)
+    except Exception as e:
+        raise Exception(f"Error processing PDF: {str(e)}")
+
+def process_pdf(file_path, prompt):
+    try:
+        text = extract_pdf_text(file_path)
+    except Exception as e:
+        raise Exception(f"Error processing PDF: {str(e)}")
+    yield from analyze_pdf_text(text, prompt)
+
+# Map-reduce analysis of PDFs too long to send in full: every chunk is
+# summarized on its own, then the summaries answer the user's request.
 
+_chunk_summaries = OrderedDict()
+_chunk_summaries_lock = threading.Lock()
+
+def summarize_pdf_chunk(chunk):
+    key = hashlib.sha256(chunk.encode("utf-8")).hexdigest()
+    with _chunk_summaries_lock:
+        if key in _chunk_summaries:
+            _chunk_summaries.move_to_end(key)
+            return _chunk_summaries[key]
+
+    response = get_text_model(None).generate_content(
+        f"Summarize this part of a PDF document. Keep every important fact, number and name:\n\n{chunk}",
+        generation_config=get_genai().types.GenerationConfig(temperature=0.2, max_output_tokens=PDF_CHUNK_SUMMARY_TOKENS),
+        safety_settings=SAFETY_SETTINGS,
+    )
+    summary = response.text.strip()
+
+    with _chunk_summaries_lock:
+        _chunk_summaries[key] = summary
+        if len(_chunk_summaries) > PDF_SUMMARY_CACHE_SIZE:
+            _chunk_summaries.popitem(last=False)
+    return summary
+
+def reduce_pdf_summaries(summaries, prompt, profile=None):
+    try:
+        parts = "\n\n".join(f"Part {i}:\n{summary}" for i, summary in enumerate(summaries, 1))
         messages = [
-            {"role": "user", "parts": [{"text": f"Analyze the following PDF content:\n\n{text}\n\nUser's request: {prompt}"}]},
+            {"role": "user", "parts": [{"text": f"The following are summaries of consecutive parts of a PDF document:\n\n{parts}\n\nUser's request: {prompt}"}]},
         ]
-
-        response = text_model.generate_content(
+        model_name = profile.model_name if profile is not None else MODEL_NAME
+        response = get_text_model(None, model_name).generate_content(
             messages,
-            generation_config=genai.types.GenerationConfig(
-                temperature=TEMPERATURE,
-                top_p=TOP_P,
-                top_k=TOP_K,
-                max_output_tokens=MAX_TOKENS,
-            ),
+            generation_config=_generation_config(profile),
             safety_settings=SAFETY_SETTINGS,
             stream=True
         )
-        
-        for chunk in response:
-            if hasattr(chunk, 'text'):
-                yield chunk.text
-            elif hasattr(chunk, 'parts'):
-                for part in chunk.parts:
-                    if hasattr(part, 'text'):
-                        yield part.text
+        yield from _iter_text(response)
+    except Exception as e:
+        raise Exception(f"Error processing PDF: {str(e)}")
+
+# Async versions: the blocking SDK streams run on the worker pool so the
+# Telegram event loop keeps serving other chats while Gemini is generating.
+
+response_cache = ResponseCache()
+resilience = ResilientStreamer()
+
+registry.callback("bot_response_cache_hits_total", "Replies served from the response cache",
+                  lambda: response_cache.hits, type="counter")
+registry.callback("bot_response_cache_misses_total", "Response cache lookups that missed",
+                  lambda: response_cache.misses, type="counter")
+registry.callback("bot_gemini_retries_total", "Gemini requests retried after a transient error",
+                  lambda: resilience.retries, type="counter")
+registry.callback("bot_gemini_hedges_total", "Gemini requests also sent to the fallback model",
+                  lambda: resilience.hedges, type="counter")
+registry.callback("bot_gemini_hedges_skipped_total", "Slow Gemini requests not hedged because of the hedge limit",
+                  lambda: resilience.hedges_skipped, type="counter")
+registry.callback("bot_gemini_fallbacks_total", "Gemini requests moved to the fallback model after an error",
+                  lambda: resilience.fallbacks, type="counter")
+
+async def generate_text_async(prompt, system_instruction, history, use_cache=True, profile=None):
+    """Stream the reply to ``prompt``, replaying it from the response cache when possible.
+
+    ``profile`` is the ChatProfile giving the model and generation settings;
+    the private chat profile is used when it is None.
+    """
+    if profile is None:
+        profile = config_service.profile("private")
+    history = list(history)
+    cache_key = None
+    if use_cache and RESPONSE_CACHE_ENABLED and (RESPONSE_CACHE_WITH_HISTORY or not history):
+        cache_key = response_cache.key(prompt, system_instruction, profile.model_name, profile.settings(), history)
+        cached = response_cache.get(cache_key)
+        if cached is not None:
+            logger.info(f"Response cache hit, hit rate {response_cache.hit_rate():.1%}")
+            for chunk in replay_chunks(cached):
+                yield chunk
+            return
+
+    parts = []
+    answered_by = []
+    candidates = [(profile.model_name, lambda: iterate_in_thread(
+        lambda: generate_text(prompt, system_instruction, history, profile.model_name, profile)))]
+    if FALLBACK_MODEL_NAME != profile.model_name:
+        candidates.append((FALLBACK_MODEL_NAME, lambda: iterate_in_thread(
+            lambda: generate_text(prompt, system_instruction, history, FALLBACK_MODEL_NAME, profile), spare=True)))
+    stream = resilience.stream(*candidates, on_model=answered_by.append)
+    async for chunk in stream:
+        parts.append(chunk)
+        yield chunk
+    # Only complete replies are cached; an interrupted stream never gets here.
+    # A reply of the fallback model is not stored under the profile's model.
+    if cache_key is not None and parts and answered_by == [profile.model_name]:
+        response_cache.put(cache_key, "".join(parts))
+
+def analyze_image_async(image, prompt: str, profile=None):
+    """Stream the answer to ``prompt`` about one image or an album.
+
+    Photos always go to the vision models; ``profile`` only supplies the
+    generation settings, those of the private chat profile when it is None.
+    """
+    if profile is None:
+        profile = config_service.profile("private")
+    return resilience.stream(
+        (VISION_MODEL_NAME, lambda: iterate_in_thread(lambda: analyze_image(image, prompt, profile=profile))),
+        (VISION_FALLBACK_MODEL_NAME,
+         lambda: iterate_in_thread(lambda: analyze_image(image, prompt, VISION_FALLBACK_MODEL_NAME, profile),
+                                   spare=True)),
+    )
+
+def pdf_text_limit():
+    """Characters of PDF text needed by the current analysis mode."""
+    return PDF_MAP_REDUCE_MAX_CHARS if PDF_MAP_REDUCE else PDF_MAX_CHARS
+
+async def extract_pdf_text_async(source):
+    loop = asyncio.get_running_loop()
+    try:
+        return await loop.run_in_executor(None, extract_pdf_text, source, pdf_text_limit())
+    except Exception as e:
+        raise Exception(f"Error processing PDF: {str(e)}")
+
+async def analyze_pdf_async(text, prompt, on_progress=None, profile=None):
+    """Stream the answer to ``prompt`` about the extracted text of a PDF.
+
+    In map-reduce mode a document longer than PDF_MAX_CHARS is split into
+    chunks that are summarized concurrently, reporting progress through
+    ``await on_progress(done, total)``, before the reduce pass is streamed.
+    With context caching enabled, a document large enough to be cached is
+    uploaded once and answered directly instead, so later questions about
+    it only send the question.
+
+    The answer uses the model and generation settings of ``profile``, the
+    private chat profile when it is None; chunk summaries always use the
+    default model with settings of their own.
+    """
+    if profile is None:
+        profile = config_service.profile("private")
+    model_name = profile.model_name
+    if not PDF_MAP_REDUCE or len(text) <= PDF_MAX_CHARS:
+        stream = resilience.stream(
+            (model_name, lambda: iterate_in_thread(lambda: analyze_pdf_text(text, prompt, profile=profile))))
+        async for chunk in stream:
+            yield chunk
+        return
+
+    loop = asyncio.get_running_loop()
+    model = await loop.run_in_executor(None, cached_pdf_model, text, model_name)
+    if model is not None:
+        stream = resilience.stream(
+            (model_name, lambda: iterate_in_thread(lambda: analyze_pdf_text(text, prompt, model, profile))))
+        async for chunk in stream:
+            yield chunk
+        return
+
+    chunks = split_text(text, PDF_CHUNK_TOKENS * CHARS_PER_TOKEN)
+    semaphore = asyncio.Semaphore(PDF_MAP_CONCURRENCY)
+    done = 0
+
+    async def summarize(chunk):
+        nonlocal done
+        async with semaphore:
+            summary = await loop.run_in_executor(None, summarize_pdf_chunk, chunk)
+        done += 1
+        if on_progress is not None:
+            await on_progress(done, len(chunks))
+        return summary
+
+    try:
+        summaries = await asyncio.gather(*(summarize(chunk) for chunk in chunks))
     except Exception as e:
-        raise Exception(f"Error processing PDF: {str(e)}")
\ No newline at end of file
+        raise Exception(f"Error processing PDF: {str(e)}")
+    stream = resilience.stream(
+        (model_name, lambda: iterate_in_thread(lambda: reduce_pdf_summaries(summaries, prompt, profile))))
+    async for chunk in stream:
+        yield chunk
\ No newline at end of file
@@ -0,0 +1,311 @@
+import asyncio
+import logging
+import random
+import time
+from collections import deque
+from config import (GEMINI_MAX_RETRIES, GEMINI_RETRY_BASE_DELAY, GEMINI_RETRY_MAX_DELAY, GEMINI_RETRY_BUDGET_RATIO,
+                    GEMINI_CIRCUIT_FAILURES, GEMINI_CIRCUIT_RESET, GEMINI_FIRST_TOKEN_TIMEOUT, GEMINI_STALL_TIMEOUT,
+                    GEMINI_HEDGE_MAX, GEMINI_HEDGE_WINDOW)
+
+logger = logging.getLogger(__name__)
+
+# HTTP statuses of Gemini errors worth retrying: rate limited, overloaded, timed out.
+RETRYABLE_CODES = {429, 500, 502, 503, 504}
+
+class CircuitOpen(Exception):
+    """Raised when every model of a request has an open circuit."""
+
+class StreamStalled(Exception):
+    """Raised when a model stops sending chunks."""
+
+def is_retryable(error):
+    """Whether ``error``, or an exception it was raised from, is transient."""
+    while error is not None:
+        if isinstance(error, (StreamStalled, asyncio.TimeoutError, ConnectionError)):
+            return True
+        if getattr(error, "code", None) in RETRYABLE_CODES:
+            return True
+        error = error.__cause__ or error.__context__
+    return False
+
+class CircuitBreaker:
+    """Stop calling a model after ``failures`` consecutive transient errors.
+
+    While open, requests skip the model. After ``reset_timeout`` seconds a
+    single trial request is let through: success closes the circuit again,
+    failure keeps it open for another period. A trial that ends with
+    neither, because it was cancelled or never needed, is released so the
+    next request can try again.
+    """
+
+    def __init__(self, failures=GEMINI_CIRCUIT_FAILURES, reset_timeout=GEMINI_CIRCUIT_RESET):
+        self.failures = failures
+        self.reset_timeout = reset_timeout
+        self._consecutive = 0
+        self._opened_at = None
+        self._trial = False
+
+    @property
+    def open(self):
+        return self._opened_at is not None
+
+    def available(self):
+        """Whether a request could use the model now, without claiming the trial."""
+        return self._opened_at is None or (
+            not self._trial and time.monotonic() - self._opened_at >= self.reset_timeout)
+
+    def allow(self):
+        """Claim the model for a request; on an open circuit this claims the trial."""
+        if self._opened_at is None:
+            return True
+        if self.available():
+            self._trial = True
+            return True
+        return False
+
+    def release(self):
+        """Give back a trial that ended without a success or a failure."""
+        if self._opened_at is not None:
+            self._trial = False
+
+    def record_success(self):
+        self._consecutive = 0
+        self._opened_at = None
+        self._trial = False
+
+    def record_failure(self):
+        self._consecutive += 1
+        if self._trial or self._consecutive >= self.failures:
+            if self._opened_at is None:
+                logger.warning(f"Circuit opened after {self._consecutive} consecutive failures")
+            self._opened_at = time.monotonic()
+            self._trial = False
+
+class RetryBudget:
+    """Allow retries only up to ``ratio`` times the recent request rate.
+
+    Keeps retries from multiplying the load on Gemini while it is already
+    failing. ``min_retries`` are always allowed per window, so a quiet bot
+    still retries its occasional error.
+    """
+
+    def __init__(self, ratio=GEMINI_RETRY_BUDGET_RATIO, window=10.0, min_retries=3):
+        self.ratio = ratio
+        self.window = window
+        self.min_retries = min_retries
+        self._requests = deque()
+        self._retries = deque()
+
+    def _trim(self, events, now):
+        while events and events[0] <= now - self.window:
+            events.popleft()
+
+    def record_request(self):
+        self._requests.append(time.monotonic())
+
+    def try_retry(self):
+        now = time.monotonic()
+        self._trim(self._requests, now)
+        self._trim(self._retries, now)
+        if len(self._retries) >= self.min_retries + self.ratio * len(self._requests):
+            return False
+        self._retries.append(now)
+        return True
+
+class HedgeLimiter:
+    """Allow at most ``max_hedges`` hedged requests per ``window`` seconds.
+
+    When the primary model is slow for everyone, hedging every request
+    would double the load on the fallback model and on the spare threads;
+    past the limit slow requests keep waiting for the primary instead.
+    """
+
+    def __init__(self, max_hedges=GEMINI_HEDGE_MAX, window=GEMINI_HEDGE_WINDOW):
+        self.max_hedges = max_hedges
+        self.window = window
+        self._hedges = deque()
+
+    def try_hedge(self):
+        now = time.monotonic()
+        while self._hedges and self._hedges[0] <= now - self.window:
+            self._hedges.popleft()
+        if len(self._hedges) >= self.max_hedges:
+            return False
+        self._hedges.append(now)
+        return True
+
+class ResilientStreamer:
+    """Run Gemini streams with retries, hedging, model fallback and timeouts.
+
+    A request is given as candidates ``(model_name, make_stream)``, the
+    primary model first, where ``make_stream()`` starts a new async
+    iterator of text chunks. Until the first chunk arrives:
+
+    * if the primary sends nothing for ``first_token_timeout`` seconds the
+      request is hedged onto the fallback and the first model to answer
+      wins, the other stream is cancelled; over the hedge limit the request
+      waits up to ``stall_timeout`` more for the primary instead;
+    * a transient error moves the request to the next candidate, and once
+      all have failed it is retried with jittered exponential backoff,
+      within ``max_retries`` and the shared retry budget;
+    * models whose circuit is open are skipped.
+
+    After the first chunk the stream is never restarted, since the user
+    already sees its text, but a gap of more than ``stall_timeout``
+    seconds between chunks raises StreamStalled.
+    """
+
+    def __init__(self, max_retries=GEMINI_MAX_RETRIES, base_delay=GEMINI_RETRY_BASE_DELAY,
+                 max_delay=GEMINI_RETRY_MAX_DELAY, first_token_timeout=GEMINI_FIRST_TOKEN_TIMEOUT,
+                 stall_timeout=GEMINI_STALL_TIMEOUT, budget=None, hedge_limiter=None):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.first_token_timeout = first_token_timeout
+        self.stall_timeout = stall_timeout
+        self.budget = budget if budget is not None else RetryBudget()
+        self.hedge_limiter = hedge_limiter if hedge_limiter is not None else HedgeLimiter()
+        self.breakers = {}
+        self.retries = 0
+        self.hedges = 0
+        self.hedges_skipped = 0
+        self.fallbacks = 0
+
+    def breaker(self, model_name):
+        if model_name not in self.breakers:
+            self.breakers[model_name] = CircuitBreaker()
+        return self.breakers[model_name]
+
+    async def stream(self, *candidates, on_model=None):
+        """Yield the chunks of the first candidate that answers.
+
+        ``on_model(model_name)`` is called with the model that answered
+        before its first chunk is yielded.
+        """
+        self.budget.record_request()
+        attempt = 0
+        while True:
+            # Breakers are only claimed when a candidate is started, so a
+            # fallback that is never needed does not use up a trial.
+            allowed = [candidate for candidate in candidates if self.breaker(candidate[0]).available()]
+            if not allowed:
+                raise CircuitOpen(f"All models are unavailable: {', '.join(name for name, _ in candidates)}")
+            try:
+                model_name, iterator, first, trial = await self._first_chunk(allowed)
+                break
+            except Exception as e:
+                if not is_retryable(e) or attempt >= self.max_retries or not self.budget.try_retry():
+                    raise
+                attempt += 1
+                self.retries += 1
+                delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+                logger.warning(f"Gemini request failed ({e}), retry {attempt} in {delay:.2f}s")
+                await asyncio.sleep(delay)
+
+        breaker = self.breaker(model_name)
+        if on_model is not None:
+            on_model(model_name)
+        try:
+            if first is None:
+                breaker.record_success()
+                return
+            yield first
+            while True:
+                try:
+                    chunk = await asyncio.wait_for(anext(iterator), self.stall_timeout)
+                except StopAsyncIteration:
+                    break
+                except asyncio.TimeoutError:
+                    breaker.record_failure()
+                    raise StreamStalled(f"{model_name} sent nothing for {self.stall_timeout}s")
+                yield chunk
+            breaker.record_success()
+        except Exception as e:
+            if is_retryable(e):
+                breaker.record_failure()
+            raise
+        finally:
+            if trial:
+                # No-op once the trial has recorded a success or failure.
+                breaker.release()
+            await iterator.aclose()
+
+    async def _first_chunk(self, candidates):
+        """Start the candidates as needed and return the first to send a chunk.
+
+        Returns:
+            tuple: ``(model_name, iterator, first_chunk, trial)``;
+            ``first_chunk`` is None for an empty stream and ``trial`` tells
+            whether the request holds the model's circuit breaker trial.
+        """
+        waiting = list(candidates)
+        running = {}
+        last_error = None
+
+        def launch():
+            """Start the next candidate whose breaker allows it; False if none is left."""
+            while waiting:
+                model_name, make_stream = waiting.pop(0)
+                breaker = self.breaker(model_name)
+                trial = breaker.open
+                if not breaker.allow():
+                    continue
+                if running or last_error is not None:
+                    if running:
+                        self.hedges += 1
+                    else:
+                        self.fallbacks += 1
+                    logger.warning(f"Sending the request to {model_name}")
+                iterator = make_stream()
+                running[asyncio.ensure_future(anext(iterator))] = (model_name, iterator, trial)
+                return True
+            return False
+
+        if not launch():
+            raise CircuitOpen(f"All models are unavailable: {', '.join(name for name, _ in candidates)}")
+        may_hedge = True
+        try:
+            while True:
+                hedging = bool(waiting) and may_hedge
+                timeout = self.first_token_timeout if hedging else self.stall_timeout
+                done, _ = await asyncio.wait(running, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    if hedging:
+                        if self.hedge_limiter.try_hedge():
+                            launch()
+                        else:
+                            may_hedge = False
+                            self.hedges_skipped += 1
+                            logger.warning("Hedge limit reached, waiting for the slow model")
+                        continue
+                    for model_name, _, _ in running.values():
+                        self.breaker(model_name).record_failure()
+                    raise StreamStalled(f"No response within {timeout}s")
+
+                for task in done:
+                    model_name, iterator, trial = running.pop(task)
+                    error = task.exception()
+                    if error is None or isinstance(error, StopAsyncIteration):
+                        first = None if error is not None else task.result()
+                        return model_name, iterator, first, trial
+                    await iterator.aclose()
+                    if not is_retryable(error):
+                        if trial:
+                            self.breaker(model_name).release()
+                        raise error
+                    self.breaker(model_name).record_failure()
+                    last_error = error
+                if not running and not launch():
+                    raise last_error
+        finally:
+            await self._cancel(running)
+
+    async def _cancel(self, running):
+        """Cancel the streams that lost, releasing any breaker trial they held."""
+        for task in running:
+            task.cancel()
+        await asyncio.gather(*running, return_exceptions=True)
+        for model_name, iterator, trial in running.values():
+            if trial:
+                self.breaker(model_name).release()
+            await iterator.aclose()
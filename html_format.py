@@ -1,5 +1,16 @@
 import re
 
+CODE_BLOCK_PATTERN = re.compile(r"```([\w+#.-]*?)\n([\s\S]*?)```", flags=re.DOTALL)
+CODE_BLOCK_OPENING_PATTERN = re.compile(r"```[\w+#.-]*?\n")
+CODE_BLOCK_REPLACEMENT = r"<pre lang='\1'>\2</pre>"
+
+HEADER_PATTERN = re.compile(r"#{1,6}\s+")
+BULLET_PATTERN = re.compile(r"([ \t]*)\*\s(?!\*)")
+LINK_PATTERN = re.compile(r"\[(.*?)\]\((.*?)\)")
+MONOSPACE_CLOSING_PATTERN = re.compile(r"(?<!`)`(?!`)")
+INLINE_TOKEN_PATTERN = re.compile(r"\*+|__|~~|`+|\[")
+INLINE_TAGS = {"**": "<b>", "*": "<i>", "__": "<u>", "~~": "<s>"}
+
 
 def escape_html(text: str) -> str:
     """Escapes HTML special characters in a string.
@@ -19,50 +30,6 @@ def escape_html(text: str) -> str:
     return text
 
 
-def apply_hand_points(text: str) -> str:
-    """Replaces markdown bullet points (*) with right hand point emoji.
-
-    Arguments:
-    text (str): The text to modify.
-
-    Returns:
-    str: The text with markdown bullet points replaced with emoji.
-    """
-    pattern = r"(?<=\n)\*\s(?!\*)|^\*\s(?!\*)"
-
-    replaced_text = re.sub(pattern, "👉 ", text)
-
-    return replaced_text
-
-
-def apply_bold(text: str) -> str:
-    """Replaces markdown bold formatting with HTML bold tags.
-
-    Arguments:
-    text (str): The text to modify.
-
-    Returns:
-    str: The text with markdown bold replaced by HTML tags.
-    """
-    pattern = r"\*\*(.*?)\*\*"
-    replaced_text = re.sub(pattern, r"<b>\1</b>", text)
-    return replaced_text
-
-
-def apply_italic(text: str) -> str:
-    """Replaces markdown italic formatting with HTML italic tags.
-
-    Arguments:
-    text (str): The text to modify.
-
-    Returns:
-    str: The text with markdown italic replaced by HTML tags.
-    """
-    pattern = r"(?<!\*)\*(?!\*)(?!\*\*)(.*?)(?<!\*)\*(?!\*)"
-    replaced_text = re.sub(pattern, r"<i>\1</i>", text)
-    return replaced_text
-
-
 def apply_code(text: str) -> str:
     """Replace markdown code blocks with HTML <pre> tags.
 
@@ -72,122 +39,351 @@ def apply_code(text: str) -> str:
     Returns:
     str: The text with markdown code blocks replaced by HTML tags.
     """
-    pattern = r"```([\w]*?)\n([\s\S]*?)```"
-    replaced_text = re.sub(pattern, r"<pre lang='\1'>\2</pre>", text, flags=re.DOTALL)
+    replaced_text = CODE_BLOCK_PATTERN.sub(CODE_BLOCK_REPLACEMENT, text)
     return replaced_text
 
 
-def apply_monospace(text: str) -> str:
-    """Replaces markdown monospace backticks with HTML <code> tags.
+def apply_line_format(line: str) -> str:
+    """Apply inline text formatting to a single non-code line in one pass.
+
+    Handles headers and hand-point bullets at the start of the line, then
+    links, bold, italic, underline, strikethrough and monospace while
+    scanning the line once. Every emitted tag is balanced: markers that are
+    never closed, or that would close across another open marker, are kept
+    as plain text. Nothing is allowed to span a run of three backticks, so
+    a later code block substitution cannot cut through an inline tag.
 
     Arguments:
-    text (str): The input text containing markdown monospace formatting.
+    line (str): The HTML-escaped line to modify, without its trailing newline.
 
     Returns:
-    str: The text with monospace sections replaced with HTML tags.
+    str: The line with markdown formatting replaced by HTML tags.
     """
-    pattern = r"(?<!`)`(?!`)(.*?)(?<!`)`(?!`)"
-    replaced_text = re.sub(pattern, r"<code>\1</code>", text)
-    return replaced_text
-
+    header = HEADER_PATTERN.match(line)
+    if header:
+        return "<b><u>" + _render_inline(line, header.end()) + "</u></b>"
+    bullet = BULLET_PATTERN.match(line)
+    if bullet:
+        return bullet.group(1) + "👉 " + _render_inline(line, bullet.end())
+    return _render_inline(line)
+
+
+def _render_inline(text: str, pos: int = 0) -> str:
+    out = []
+    # Open markers as (marker, index of its placeholder in out). The
+    # placeholder is the literal marker and is only turned into an opening
+    # tag once the matching closing marker is found.
+    stack = []
+
+    def toggle(marker):
+        for depth in range(len(stack) - 1, -1, -1):
+            if stack[depth][0] == marker:
+                out[stack[depth][1]] = INLINE_TAGS[marker]
+                out.append("</" + INLINE_TAGS[marker][1:])
+                # Markers opened inside this one stay literal.
+                del stack[depth:]
+                return
+        stack.append((marker, len(out)))
+        out.append(marker)
+
+    while True:
+        match = INLINE_TOKEN_PATTERN.search(text, pos)
+        if not match:
+            out.append(text[pos:])
+            break
+        out.append(text[pos:match.start()])
+        token = match.group()
+        pos = match.end()
+
+        if token == "[":
+            link = LINK_PATTERN.match(text, match.start())
+            if link and "```" not in link.group():
+                href = link.group(2).replace('"', "&quot;")
+                out.append(f'<a href="{href}">{_render_inline(link.group(1))}</a>')
+                pos = link.end()
+            else:
+                out.append(token)
+        elif token == "`":
+            closing = MONOSPACE_CLOSING_PATTERN.search(text, pos)
+            if closing and "```" not in text[pos:closing.start()]:
+                out.append("<code>" + text[pos:closing.start()] + "</code>")
+                pos = closing.end()
+            else:
+                out.append(token)
+        elif token.startswith("`"):
+            if len(token) >= 3:
+                stack.clear()
+            out.append(token)
+        elif token.startswith("*") and len(token) > 2:
+            if stack and stack[-1][0] == "*":
+                toggle("*")
+                toggle("**")
+            else:
+                toggle("**")
+                toggle("*")
+            out.append(token[3:])
+        else:
+            toggle(token)
+
+    return "".join(out)
 
-def apply_link(text: str) -> str:
-    """Replace markdown links with HTML anchor tags.
 
-    Arguments:
-    text (str): The input text containing markdown links.
+def apply_exclude_code(text: str) -> str:
+    """Apply text formatting outside of code blocks.
 
-    Returns:
-    str: The text with markdown links replaced by HTML anchor tags.
+    Code blocks are located with the same pattern ``apply_code`` uses, so
+    the two always agree on what is code. Every line outside them gets the
+    inline formatting of ``apply_line_format``. Code blocks, and a block
+    whose closing fence has not been streamed yet, are left untouched.
     """
-    pattern = r"\[(.*?)\]\((.*?)\)"
-    replaced_text = re.sub(pattern, r'<a href="\2">\1</a>', text)
-    return replaced_text
+    parts = []
+    pos = 0
+    for match in CODE_BLOCK_PATTERN.finditer(text):
+        parts.append(_format_lines(text[pos:match.start()]))
+        parts.append(match.group())
+        pos = match.end()
 
+    opening = CODE_BLOCK_OPENING_PATTERN.search(text, pos)
+    end = opening.start() if opening else len(text)
+    parts.append(_format_lines(text[pos:end]))
+    parts.append(text[end:])
+    return "".join(parts)
 
-def apply_underline(text: str) -> str:
-    """Replace markdown underline with HTML underline tags.
 
-    Arguments:
-    text (str): The input text to modify.
+def _format_lines(text: str) -> str:
+    return "\n".join(apply_line_format(line) for line in text.split("\n"))
 
-    Returns:
-    str: The text with markdown underlines replaced with HTML tags."""
-    pattern = r"__(.*?)__"
-    replaced_text = re.sub(pattern, r"<u>\1</u>", text)
-    return replaced_text
 
+def format_message(text: str) -> str:
+    """Format the given message text from markdown to HTML.
 
-def apply_strikethrough(text: str) -> str:
-    """Replace markdown strikethrough with HTML strikethrough tags.
+    Escapes HTML characters, applies link, code, and other rich text formatting,
+    and returns the formatted HTML string.
 
-    Arguments:
-    text (str): The input text to modify.
+    Args:
+      message (str): The plain text message to format.
 
     Returns:
-    str: The text with markdown strikethroughs replaced with HTML tags.
+      str: The formatted HTML string.
     """
-    pattern = r"~~(.*?)~~"
-    replaced_text = re.sub(pattern, r"<s>\1</s>", text)
-    return replaced_text
+    formatted_text = escape_html(text)
+    formatted_text = apply_exclude_code(formatted_text)
+    formatted_text = apply_code(formatted_text)
+    return formatted_text
 
 
-def apply_header(text: str) -> str:
-    """Replace markdown header # with HTML header tags.
+class StreamingFormatter:
+    """Incrementally format a streamed markdown message to HTML.
 
-    Arguments:
-    text (str): The input text to modify.
+    Produces exactly the same output as ``format_message`` on the text fed so
+    far, but only re-renders the part that can still change: the last,
+    unterminated line and any code block that has not been closed yet.
+    Completed lines and closed code blocks are formatted once and kept.
 
-    Returns:
-    str: The text with markdown headers replaced with HTML tags.
+    Example:
+        formatter = StreamingFormatter()
+        for chunk in response:
+            html = formatter.feed(chunk)
     """
-    pattern = r"^(#{1,6})\s+(.*)"
-    replaced_text = re.sub(pattern, r"<b><u>\2</u></b>", text, flags=re.DOTALL)
-    return replaced_text
 
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        """Forget all text fed so far."""
+        self._tail = ""
+        # Escaped text of completed lines whose formatting may still change.
+        self._pending = ""
+        self._committed = []
+        self._committed_text = ""
+        self._output = ""
+
+    @property
+    def text(self) -> str:
+        """The HTML for all text fed so far."""
+        return self._output
+
+    def feed(self, chunk: str) -> str:
+        """Add newly streamed text and return the HTML for the whole message.
+
+        Args:
+            chunk (str): The text received since the previous call.
+
+        Returns:
+            str: The formatted HTML string for all text fed so far.
+        """
+        self._tail += chunk
+        if "\n" in chunk:
+            lines, _, self._tail = self._tail.rpartition("\n")
+            self._pending += escape_html(lines + "\n")
+            self._commit()
+
+        pending = self._pending + escape_html(self._tail)
+        self._output = self._committed_text + apply_code(apply_exclude_code(pending))
+        return self._output
+
+    def _commit(self):
+        """Format completed lines as far forward as possible and keep the result.
+
+        Text can only be committed up to the start of a code block that
+        has not been closed yet, since the closing fence may still arrive.
+        """
+        text = self._pending
+        pos = 0
+        for match in CODE_BLOCK_PATTERN.finditer(text):
+            self._committed.append(_format_lines(text[pos:match.start()]))
+            self._committed.append(match.expand(CODE_BLOCK_REPLACEMENT))
+            pos = match.end()
+
+        opening = CODE_BLOCK_OPENING_PATTERN.search(text, pos)
+        end = opening.start() if opening else len(text)
+        if end:
+            self._committed.append(_format_lines(text[pos:end]))
+            self._committed_text = "".join(self._committed)
+            self._committed = [self._committed_text]
+            self._pending = text[end:]
+
+
+TAG_PATTERN = re.compile(r"<[^>]*>")
+HTML_TOKEN_PATTERN = re.compile(r"<(/?)(\w+)[^>]*>|&#?\w+;|[^<&]+|[<&]")
+
+
+def split_html(text: str, limit: int) -> list:
+    """Split formatted HTML into parts of at most ``limit`` characters.
+
+    Tags that are open at a boundary are closed at the end of the part and
+    reopened, with their attributes, at the start of the next one, so every
+    part is valid HTML on its own. Text is cut at a line break when there is
+    one in the second half of the part, otherwise at a space, and only as a
+    last resort in the middle of a word. Tags and entities are never cut.
 
-def apply_exclude_code(text: str) -> str:
-    """Apply text formatting to non-code lines.
+    Args:
+        text (str): HTML as produced by ``format_message``.
+        limit (int): Maximum length of a part.
 
-    Iterates through each line, checking if it is in a code block.
-    If not, applies header, link, bold, italic, underline, strikethrough, monospace, and hand-point
-    text formatting.
+    Returns:
+        list: The parts, in order.
     """
-    lines = text.split("\n")
-    in_code_block = False
-
-    for i, line in enumerate(lines):
-        if line.startswith("```"):
-            in_code_block = not in_code_block
-
-        if not in_code_block:
-            formatted_line = lines[i]
-            formatted_line = apply_header(formatted_line)
-            formatted_line = apply_link(formatted_line)
-            formatted_line = apply_bold(formatted_line)
-            formatted_line = apply_italic(formatted_line)
-            formatted_line = apply_underline(formatted_line)
-            formatted_line = apply_strikethrough(formatted_line)
-            formatted_line = apply_monospace(formatted_line)
-            formatted_line = apply_hand_points(formatted_line)
-            lines[i] = formatted_line
-
-    return "\n".join(lines)
-
-
-def format_message(text: str) -> str:
-    """Format the given message text from markdown to HTML.
-
-    Escapes HTML characters, applies link, code, and other rich text formatting,
-    and returns the formatted HTML string.
+    parts = []
+    current = []
+    length = 0
+    stack = []  # (name, opening tag) of the open tags
+    closing_length = 0
+
+    def flush():
+        nonlocal current, length
+        parts.append("".join(current) + "".join(f"</{name}>" for name, _ in reversed(stack)))
+        current = [opening for _, opening in stack]
+        length = sum(len(opening) for opening in current)
+
+    def make_room(size):
+        # Only start a new part when it would leave something in the old one.
+        if length + size + closing_length > limit and len(current) > len(stack):
+            flush()
+
+    for match in HTML_TOKEN_PATTERN.finditer(text):
+        token = match.group()
+        if match.group(2):
+            name = match.group(2)
+            if match.group(1):
+                if stack and stack[-1][0] == name:
+                    stack.pop()
+                    closing_length -= len(name) + 3
+                current.append(token)
+                length += len(token)
+            else:
+                make_room(len(token) + len(name) + 3)
+                current.append(token)
+                length += len(token)
+                stack.append((name, token))
+                closing_length += len(name) + 3
+        elif token.startswith("&") and len(token) > 1:
+            make_room(len(token))
+            current.append(token)
+            length += len(token)
+        else:
+            while token:
+                room = limit - length - closing_length
+                if room <= 0 or (room < len(token) and len(current) > len(stack) and _text_cut(token, room) == 0):
+                    if len(current) > len(stack):
+                        flush()
+                        continue
+                    room = max(room, 1)
+                cut = len(token) if len(token) <= room else _text_cut(token, room) or room
+                current.append(token[:cut])
+                length += cut
+                token = token[cut:]
+                if token:
+                    flush()
+
+    if len(current) > len(stack):
+        flush()
+    # Telegram rejects messages without visible text.
+    return [part for part in parts if TAG_PATTERN.sub("", part).strip()] or [text]
+
+
+def _text_cut(text: str, room: int) -> int:
+    """Where to cut ``text`` to fit ``room`` characters, or 0 for no good place."""
+    cut = text.rfind("\n", 0, room)
+    if cut >= room // 2:
+        return cut + 1
+    cut = text.rfind(" ", 0, room)
+    if cut >= room // 2:
+        return cut + 1
+    return 0
+
+
+def split_markdown(text: str, limit: int) -> tuple:
+    """Split markdown so that the first part formats to at most ``limit`` characters.
+
+    Used to continue a streamed reply in a new message: the first part is
+    final, the second is where streaming goes on. The cut is made after the
+    last line that fits, or failing that after a space, or inside a word. A
+    code block that is open at the cut is closed at the end of the first
+    part and reopened, with its language, at the start of the second.
 
     Args:
-      message (str): The plain text message to format.
+        text (str): Markdown whose formatted HTML is longer than ``limit``.
+        limit (int): Maximum length of the formatted first part.
 
     Returns:
-      str: The formatted HTML string.
+        tuple: ``(head, tail)`` markdown strings.
     """
-    formatted_text = escape_html(text)
-    formatted_text = apply_exclude_code(formatted_text)
-    formatted_text = apply_code(formatted_text)
-    return formatted_text
+    def split_at(cut):
+        head, tail = text[:cut], text[cut:]
+        pos = 0
+        for match in CODE_BLOCK_PATTERN.finditer(head):
+            pos = match.end()
+        opening = CODE_BLOCK_OPENING_PATTERN.search(head, pos)
+        if opening is None:
+            return head, tail
+        if not head[opening.end():].strip():
+            # Nothing of the block fits, move all of it to the next part.
+            return head[:opening.start()], text[opening.start():]
+        return head + ("" if head.endswith("\n") else "\n") + "```", opening.group() + tail
+
+    def fits(cut):
+        head = split_at(cut)[0]
+        return bool(head.strip()) and len(format_message(head)) <= limit
+
+    for separator in ("\n", " ", None):
+        if separator is None:
+            cuts = range(1, len(text))
+        else:
+            cuts = [i + 1 for i, char in enumerate(text[:-1]) if char == separator]
+        # Formatted length grows with the cut, so the last cut that fits is
+        # found by binary search.
+        low, high = 0, len(cuts)
+        while low < high:
+            middle = (low + high) // 2
+            if fits(cuts[middle]):
+                low = middle + 1
+            else:
+                high = middle
+        if low:
+            return split_at(cuts[low - 1])
+    cut = max(1, min(limit, len(text) - 1))
+    head, tail = split_at(cut)
+    if not head.strip():
+        return text[:cut], text[cut:]
+    return head, tail
@@ -0,0 +1,74 @@
+import logging
+import threading
+import time
+from io import BytesIO
+from config import IMAGE_MAX_SIDE, IMAGE_FORMAT, IMAGE_QUALITY
+from metrics import IMAGE_PREPROCESS_SECONDS
+
+logger = logging.getLogger(__name__)
+
+MIME_TYPES = {"JPEG": "image/jpeg", "WEBP": "image/webp", "PNG": "image/png"}
+
+class ImageStats:
+    """Running totals of the bytes saved by preprocessing."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.images = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def record(self, bytes_in, bytes_out):
+        with self._lock:
+            self.images += 1
+            self.bytes_in += bytes_in
+            self.bytes_out += bytes_out
+
+    def saved(self):
+        return self.bytes_in - self.bytes_out
+
+image_stats = ImageStats()
+
+def choose_photo_size(photo_sizes, max_side=IMAGE_MAX_SIDE):
+    """Return the smallest Telegram PhotoSize whose longer side reaches ``max_side``.
+
+    Falls back to the largest size when none is big enough, so small photos
+    are sent at their full resolution.
+    """
+    sizes = sorted(photo_sizes, key=lambda size: max(size.width, size.height))
+    for size in sizes:
+        if max(size.width, size.height) >= max_side:
+            return size
+    return sizes[-1]
+
+def preprocess_image(data, max_side=IMAGE_MAX_SIDE, image_format=IMAGE_FORMAT, quality=IMAGE_QUALITY):
+    """Downscale and re-encode an image for the vision model.
+
+    The image is rotated according to its EXIF orientation, shrunk so its
+    longer side is at most ``max_side`` and saved without metadata. This is
+    CPU bound, so call it from an executor.
+
+    Args:
+        data (bytes): The encoded image.
+        max_side (int): Maximum width or height of the result.
+        image_format (str): "JPEG", "WEBP" or "PNG".
+        quality (int): Encoder quality for lossy formats.
+
+    Returns:
+        dict: A blob ``{"mime_type": ..., "data": ...}`` accepted by
+        ``generate_content``.
+    """
+    from PIL import Image, ImageOps
+    started = time.perf_counter()
+    with Image.open(BytesIO(data)) as image:
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((max_side, max_side), Image.LANCZOS)
+        if image_format != "PNG" and image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+        output = BytesIO()
+        # Nothing from the source info (EXIF, ICC, comments) is passed to save().
+        image.save(output, format=image_format, quality=quality)
+    processed = output.getvalue()
+    IMAGE_PREPROCESS_SECONDS.observe(time.perf_counter() - started)
+    image_stats.record(len(data), len(processed))
+    return {"mime_type": MIME_TYPES[image_format], "data": processed}
@@ -1,20 +1,60 @@
+import asyncio
 import logging
+import time
+
+# Lấy mốc trước các import nặng để thời gian khởi động tính cả chúng
+STARTED_AT = time.monotonic()
+
 from telegram import Update
 from telegram.ext import ApplicationBuilder, CommandHandler, MessageHandler, filters
-from config import TELEGRAM_BOT_TOKEN
-from telegram_handler import start, handle_message, handle_image, handle_document, clear
+from config import TELEGRAM_BOT_TOKEN, BOT_MODE, WEBHOOK_WORKERS, METRICS_LISTEN, METRICS_PORT
+from telegram_handler import (start, handle_message, handle_image, handle_document, clear, toggle_cache,
+                              conversation_manager)
+from webhook_server import run_webhook, run_router
+from gemini_handler import get_genai
+from metrics import start_metrics_server, STARTUP_SECONDS
 
 # Thiết lập logging
 logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-def main():
-    # Khởi tạo ứng dụng với token bot
-    application = ApplicationBuilder().token(TELEGRAM_BOT_TOKEN).build()
+# Chỉ nhận các loại update mà bot xử lý (tin nhắn văn bản, ảnh, PDF và lệnh)
+ALLOWED_UPDATES = [Update.MESSAGE]
+
+def log_preload_error(future):
+    # Lỗi import hoặc cấu hình SDK khi nạp nền, nếu không sẽ bị bỏ qua
+    if not future.cancelled() and future.exception() is not None:
+        logger.error(f"Failed to load the Gemini SDK: {future.exception()}")
+
+def build_application(metrics_port=METRICS_PORT):
+    async def post_init(application):
+        # Mở endpoint /metrics khi bot khởi động
+        if metrics_port:
+            application.bot_data["metrics_runner"] = await start_metrics_server(METRICS_LISTEN, metrics_port)
+            logger.info(f"Metrics available on http://{METRICS_LISTEN}:{metrics_port}/metrics")
+
+        # Bot đã sẵn sàng nhận update, ghi lại thời gian khởi động
+        startup_seconds = time.monotonic() - STARTED_AT
+        STARTUP_SECONDS.set(startup_seconds)
+        logger.info(f"Bot ready in {startup_seconds:.2f}s")
+
+        # Nạp Gemini SDK ở nền để tin nhắn đầu tiên không phải chờ import
+        preload = asyncio.get_running_loop().run_in_executor(None, get_genai)
+        preload.add_done_callback(log_preload_error)
+
+    async def post_shutdown(application):
+        runner = application.bot_data.pop("metrics_runner", None)
+        if runner is not None:
+            await runner.cleanup()
+
+    # Khởi tạo ứng dụng với token bot, xử lý song song các update từ nhiều chat
+    application = (ApplicationBuilder().token(TELEGRAM_BOT_TOKEN).concurrent_updates(True)
+                   .post_init(post_init).post_shutdown(post_shutdown).build())
 
     # Thêm các handlers
     application.add_handler(CommandHandler("start", start))
     application.add_handler(CommandHandler("clear", clear))
+    application.add_handler(CommandHandler("nocache", toggle_cache))
     
     # Handler cho tin nhắn văn bản
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
@@ -25,11 +65,24 @@ def main():
     # Handler cho file PDF
     application.add_handler(MessageHandler(filters.Document.PDF, handle_document))
 
+    return application
+
+def main():
     # Log khi bot bắt đầu
     logger.info("Bot is starting...")
     
-    # Bắt đầu polling
-    application.run_polling(allowed_updates=Update.ALL_TYPES)
+    if BOT_MODE == "webhook" and WEBHOOK_WORKERS > 1:
+        # Nhận update qua webhook và chia cho các worker theo chat
+        asyncio.run(run_router(ALLOWED_UPDATES))
+    elif BOT_MODE == "webhook":
+        # Nhận update qua webhook
+        asyncio.run(run_webhook(build_application(), ALLOWED_UPDATES))
+    else:
+        # Bắt đầu polling
+        build_application().run_polling(allowed_updates=ALLOWED_UPDATES)
+
+    # Ghi nốt lịch sử hội thoại còn chờ xuống đĩa
+    conversation_manager.close()
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -0,0 +1,47 @@
+import asyncio
+from config import MEDIA_GROUP_WAIT, MEDIA_GROUP_MAX_WAIT
+
+class MediaGroupCollector:
+    """Collect the messages of a Telegram album into a single batch.
+
+    Telegram delivers every photo of an album as its own update, all with
+    the same ``media_group_id``. The first update of a group waits until no
+    new item has arrived for ``wait`` seconds (or ``max_wait`` has passed)
+    and then receives the whole batch; the other updates receive None and
+    should be dropped by their handler.
+
+    Args:
+        wait (float): Quiet period that closes a group.
+        max_wait (float): Longest time a group is kept open.
+    """
+
+    def __init__(self, wait=MEDIA_GROUP_WAIT, max_wait=MEDIA_GROUP_MAX_WAIT):
+        self.wait = wait
+        self.max_wait = max_wait
+        self._groups = {}
+
+    async def add(self, update):
+        """Add an update to its group.
+
+        Returns:
+            list: The updates of the group in message order, for the update
+            that opened the group; None for the others.
+        """
+        group_id = update.message.media_group_id
+        updates = self._groups.get(group_id)
+        if updates is not None:
+            updates.append(update)
+            return None
+
+        updates = self._groups[group_id] = [update]
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.max_wait
+        try:
+            while True:
+                count = len(updates)
+                await asyncio.sleep(max(0, min(self.wait, deadline - loop.time())))
+                if len(updates) == count or loop.time() >= deadline:
+                    break
+        finally:
+            del self._groups[group_id]
+        return sorted(updates, key=lambda item: item.message.message_id)
@@ -0,0 +1,186 @@
+import bisect
+import math
+import threading
+import time
+from contextlib import contextmanager
+from config import METRICS_LISTEN, METRICS_PORT
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(names, values, extra=()):
+    pairs = [*zip(names, values), *extra]
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class _Metric:
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if len(labels) != len(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}")
+        return tuple([labels[name] for name in self.labelnames])
+
+    def header(self):
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+
+class Counter(_Metric):
+    type = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        with self._lock:
+            items = list(self._values.items())
+        return self.header() + [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+                                for key, value in items]
+
+class Gauge(Counter):
+    type = "gauge"
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render(self):
+        with self._lock:
+            items = [(key, list(counts), total, count) for key, (counts, total, count) in self._values.items()]
+        lines = self.header()
+        for key, counts, total, count in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labelnames, key, [("le", _format_value(bound))])
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+class _Callback(_Metric):
+    """Metric whose unlabeled value is read from a function at scrape time."""
+
+    def __init__(self, name, documentation, function, type):
+        super().__init__(name, documentation)
+        self.function = function
+        self.type = type
+
+    def render(self):
+        return self.header() + [f"{self.name} {_format_value(self.function())}"]
+
+class Registry:
+    """Collection of metrics rendered in the Prometheus text format."""
+
+    def __init__(self):
+        self._metrics = {}
+
+    def _register(self, metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def callback(self, name, documentation, function, type="gauge"):
+        """Register a metric read from ``function()`` whenever it is scraped."""
+        return self._register(_Callback(name, documentation, function, type))
+
+    def render(self):
+        lines = []
+        for metric in list(self._metrics.values()):
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+registry = Registry()
+
+async def start_metrics_server(host=METRICS_LISTEN, port=METRICS_PORT):
+    """Serve ``registry`` on http://host:port/metrics and return the aiohttp runner."""
+    from aiohttp import web
+
+    async def handle_metrics(request):
+        return web.Response(text=registry.render(), content_type="text/plain", charset="utf-8",
+                            headers={"X-Content-Type-Options": "nosniff"})
+
+    web_app = web.Application()
+    web_app.router.add_get("/metrics", handle_metrics)
+    runner = web.AppRunner(web_app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
+
+# Request path
+STREAM_FIRST_TOKEN = registry.histogram(
+    "bot_stream_first_token_seconds", "Time from the start of a reply to the first model chunk", ["handler"])
+STREAM_FIRST_EDIT = registry.histogram(
+    "bot_stream_first_edit_seconds", "Time from the start of a reply to the first visible text", ["handler"])
+STREAM_DURATION = registry.histogram(
+    "bot_stream_duration_seconds", "Total time to stream a reply", ["handler"])
+STREAM_TOKENS_PER_SECOND = registry.histogram(
+    "bot_stream_tokens_per_second", "Estimated output tokens per second of a reply", ["handler"],
+    buckets=(5, 10, 20, 50, 100, 200, 500, 1000))
+STREAMS_ACTIVE = registry.gauge("bot_streams_active", "Replies being streamed", ["handler"])
+FORMAT_SECONDS = registry.histogram(
+    "bot_format_seconds", "Time spent formatting a chunk as Telegram HTML", ["handler"],
+    buckets=(0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05))
+TELEGRAM_RETRIES = registry.counter("bot_telegram_retries_total", "Telegram requests retried after a timeout")
+PDF_PAGE_SECONDS = registry.histogram("bot_pdf_page_seconds", "Time to extract the text of one PDF page")
+IMAGE_PREPROCESS_SECONDS = registry.histogram("bot_image_preprocess_seconds", "Time to downscale and re-encode a photo")
+
+# Startup
+STARTUP_SECONDS = registry.gauge("bot_startup_seconds", "Time from process start until the bot was ready for updates")
@@ -0,0 +1,111 @@
+import multiprocessing
+import os
+import tempfile
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+from config import PDF_MAX_CHARS, PDF_WORKERS, PDF_PAGES_PER_TASK, PDF_PARALLEL_MIN_PAGES
+from metrics import PDF_PAGE_SECONDS
+
+_pool = None
+
+def _get_pool():
+    global _pool
+    if _pool is None:
+        # Forking a process that runs the bot's threads is unsafe, so workers are spawned.
+        _pool = ProcessPoolExecutor(max_workers=PDF_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return _pool
+
+def _open(source):
+    import pdfplumber
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        source = BytesIO(source)
+    return pdfplumber.open(source)
+
+def _extract_page(page):
+    text = page.extract_text() or ""
+    # Drop the parsed layout right away so memory stays flat on long documents.
+    page.close()
+    return text
+
+def _extract_range(path, start, stop):
+    with _open(path) as pdf:
+        return [_extract_page(page) for page in pdf.pages[start:stop]]
+
+def _spool(data):
+    """Write PDF bytes to a temporary file and return its path."""
+    fd, path = tempfile.mkstemp(suffix=".pdf")
+    with os.fdopen(fd, "wb") as file:
+        file.write(data)
+    return path
+
+def iter_pdf_pages(source):
+    """Yield the text of every page of a PDF, in page order.
+
+    Small documents are read page by page in the calling thread. Larger ones
+    are split into batches of pages extracted by a process pool, with only
+    a few batches in flight ahead of the consumer, so closing the generator
+    early cancels the work that has not started yet. The workers are given
+    a file path, never the content: bytes are written to one temporary file
+    first rather than sent to every batch. Pages without a text layer yield
+    an empty string.
+
+    Args:
+        source: Path of the PDF file or its content as bytes.
+    """
+    with _open(source) as pdf:
+        page_count = len(pdf.pages)
+        if PDF_WORKERS < 2 or page_count < PDF_PARALLEL_MIN_PAGES:
+            for page in pdf.pages:
+                yield _extract_page(page)
+            return
+
+    pool = _get_pool()
+    spooled = None if isinstance(source, (str, os.PathLike)) else _spool(source)
+    path = os.fspath(source) if spooled is None else spooled
+    batches = iter(range(0, page_count, PDF_PAGES_PER_TASK))
+    pending = deque()
+
+    def submit_next():
+        start = next(batches, None)
+        if start is not None:
+            pending.append(pool.submit(_extract_range, path, start, min(start + PDF_PAGES_PER_TASK, page_count)))
+
+    try:
+        for _ in range(PDF_WORKERS * 2):
+            submit_next()
+        while pending:
+            texts = pending.popleft().result()
+            submit_next()
+            yield from texts
+    finally:
+        for future in pending:
+            future.cancel()
+        if spooled is not None:
+            os.remove(spooled)
+
+def extract_pdf_text(source, max_chars=PDF_MAX_CHARS):
+    """Return the text of a PDF, cut off after ``max_chars`` characters.
+
+    Extraction stops as soon as the budget is reached, so the remaining
+    pages of a long document are never parsed.
+    """
+    parts = []
+    length = 0
+    pages = iter_pdf_pages(source)
+    started = time.perf_counter()
+    try:
+        for text in pages:
+            # Time until each page is available, so opening the file and
+            # waiting on the process pool are included.
+            now = time.perf_counter()
+            PDF_PAGE_SECONDS.observe(now - started)
+            started = now
+            parts.append(text + "\n")
+            length += len(text) + 1
+            if length > max_chars:
+                return "".join(parts)[:max_chars] + "...(truncated)"
+    finally:
+        pages.close()
+    return "".join(parts)
@@ -0,0 +1,126 @@
+import asyncio
+import logging
+from shared_state import create_lock_backend
+from config import REQUEST_POLICY, REQUEST_MAX_ACTIVE, REQUEST_MAX_WAITING, REQUEST_MAX_PENDING_PER_CHAT
+
+logger = logging.getLogger(__name__)
+
+class QueueFull(Exception):
+    """Raised when a request is rejected because the bot is overloaded."""
+
+class _ChatState:
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.pending = 0
+        self.latest = 0
+        self.task = None
+
+class RequestQueue:
+    """Run the requests of each chat one at a time, under a global limit.
+
+    Requests of the same chat run in arrival order, so answers are written
+    to the history in the order the messages were sent. At most
+    ``max_active`` requests run at once across all chats; when that many
+    are running and ``max_waiting`` more are already waiting, or a chat
+    already has ``max_pending`` requests queued, new requests raise
+    QueueFull right away instead of piling up.
+
+    With the "cancel" policy a new message cancels the request in flight
+    for its chat and supersedes any older request still waiting, so only
+    the newest message is answered.
+
+    Args:
+        policy (str): "queue" or "cancel".
+        max_active (int): Requests running at the same time.
+        max_waiting (int): Requests waiting for a free slot.
+        max_pending (int): Requests queued or running per chat.
+        locks: Lock backend shared with other worker processes, so a chat
+            is never answered by two workers at once.
+    """
+
+    def __init__(self, policy=REQUEST_POLICY, max_active=REQUEST_MAX_ACTIVE, max_waiting=REQUEST_MAX_WAITING,
+                 max_pending=REQUEST_MAX_PENDING_PER_CHAT, locks=None):
+        self.policy = policy
+        self.max_active = max_active
+        self.max_waiting = max_waiting
+        self.max_pending = max_pending
+        self.locks = locks if locks is not None else create_lock_backend()
+        self._slots = asyncio.Semaphore(max_active)
+        self._active = 0
+        self._waiting = 0
+        self._chats = {}
+        self.rejected = 0
+        self.cancelled = 0
+
+    @property
+    def active(self):
+        return self._active
+
+    @property
+    def waiting(self):
+        return self._waiting
+
+    def _check_capacity(self, chat):
+        if chat.pending >= self.max_pending and self.policy != "cancel":
+            raise QueueFull("Too many pending requests in this chat")
+        if self._active + self._waiting >= self.max_active + self.max_waiting:
+            raise QueueFull(f"{self._active} requests running and {self._waiting} waiting")
+
+    async def run(self, chat_id, make_coro):
+        """Run ``make_coro()`` in the queue of ``chat_id``.
+
+        Returns:
+            The coroutine's result, or None if the request was cancelled or
+            superseded by a newer message.
+
+        Raises:
+            QueueFull: When the request is rejected.
+        """
+        chat = self._chats.get(chat_id) or _ChatState()
+        try:
+            self._check_capacity(chat)
+        except QueueFull:
+            self.rejected += 1
+            raise
+        self._chats[chat_id] = chat
+
+        chat.pending += 1
+        chat.latest += 1
+        ticket = chat.latest
+        if self.policy == "cancel" and chat.task is not None:
+            chat.task.cancel()
+        self._waiting += 1
+        waiting = True
+        try:
+            async with chat.lock, self.locks.lock(f"chat:{chat_id}"):
+                if self.policy == "cancel" and ticket != chat.latest:
+                    self.cancelled += 1
+                    return None
+                async with self._slots:
+                    self._waiting -= 1
+                    waiting = False
+                    self._active += 1
+                    try:
+                        return await self._run_task(chat, make_coro)
+                    finally:
+                        self._active -= 1
+        finally:
+            if waiting:
+                self._waiting -= 1
+            chat.pending -= 1
+            if not chat.pending:
+                del self._chats[chat_id]
+
+    async def _run_task(self, chat, make_coro):
+        chat.task = asyncio.ensure_future(make_coro())
+        try:
+            return await asyncio.shield(chat.task)
+        except asyncio.CancelledError:
+            if not chat.task.cancelled():
+                # The caller itself was cancelled, not just its request.
+                chat.task.cancel()
+                raise
+            self.cancelled += 1
+            return None
+        finally:
+            chat.task = None
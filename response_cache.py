@@ -0,0 +1,80 @@
+import hashlib
+import re
+import threading
+import time
+from collections import OrderedDict
+from config import RESPONSE_CACHE_TTL, RESPONSE_CACHE_MAX_ENTRIES, RESPONSE_CACHE_REPLAY_CHARS
+
+_WHITESPACE = re.compile(r"\s+")
+
+def normalize_prompt(prompt):
+    """Fold case and whitespace so trivially different prompts share an entry."""
+    return _WHITESPACE.sub(" ", prompt).strip().casefold()
+
+def history_hash(history):
+    digest = hashlib.sha256()
+    for msg in history:
+        digest.update(f"{msg['role']}\0{msg['content']}\0".encode("utf-8"))
+    return digest.hexdigest()
+
+class ResponseCache:
+    """In-memory cache of complete model replies with TTL and LRU eviction.
+
+    Args:
+        ttl (float): Seconds a reply stays valid.
+        max_entries (int): Replies kept before the least recently used one
+            is dropped.
+    """
+
+    def __init__(self, ttl=RESPONSE_CACHE_TTL, max_entries=RESPONSE_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(prompt, system_instruction, model_name, settings, history=()):
+        """Key of a request: prompt, instruction, model, settings and history.
+
+        Args:
+            settings (tuple): Generation settings that change the reply.
+            history (list): Earlier messages; only requests with the same
+                history share an entry.
+        """
+        instruction = hashlib.sha256((system_instruction or "").encode("utf-8")).hexdigest()
+        parts = [normalize_prompt(prompt), instruction, model_name, repr(settings), history_hash(history)]
+        return hashlib.sha256("\0".join(parts).encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] <= now:
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, text):
+        with self._lock:
+            self._entries[key] = (text, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hit_rate(), "entries": len(self._entries)}
+
+def replay_chunks(text, size=RESPONSE_CACHE_REPLAY_CHARS):
+    """Split a cached reply into chunks, as if it were being streamed."""
+    return [text[i:i + size] for i in range(0, len(text), size)] or [""]
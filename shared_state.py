@@ -0,0 +1,80 @@
+import asyncio
+import fcntl
+import hashlib
+import os
+from contextlib import asynccontextmanager
+from config import STATE_BACKEND, STATE_LOCK_DIR
+
+class LocalLockBackend:
+    """Named locks for a single process.
+
+    Any backend shared by several workers offers the same interface, an
+    async context manager ``lock(name)``, so a Redis (or compatible) lock
+    can replace the file locks without touching the callers.
+    """
+
+    def __init__(self):
+        self._locks = {}
+        self._users = {}
+
+    @asynccontextmanager
+    async def lock(self, name):
+        lock = self._locks.setdefault(name, asyncio.Lock())
+        self._users[name] = self._users.get(name, 0) + 1
+        try:
+            async with lock:
+                yield
+        finally:
+            self._users[name] -= 1
+            if not self._users[name]:
+                del self._users[name]
+                del self._locks[name]
+
+def _release_acquired(future):
+    if not future.cancelled() and future.exception() is None:
+        os.close(future.result())
+
+class FileLockBackend:
+    """Named locks shared by the processes of one machine through ``flock``.
+
+    Each name maps to a lock file in ``directory``. Waiting for the lock
+    happens on a worker thread so the event loop is never blocked, and the
+    lock is released by the kernel if the process dies.
+    """
+
+    def __init__(self, directory=STATE_LOCK_DIR):
+        self.directory = directory
+        self._local = LocalLockBackend()
+        os.makedirs(directory, exist_ok=True)
+
+    def _acquire(self, path):
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+        except BaseException:
+            os.close(fd)
+            raise
+        return fd
+
+    @asynccontextmanager
+    async def lock(self, name):
+        path = os.path.join(self.directory, hashlib.sha256(name.encode("utf-8")).hexdigest() + ".lock")
+        # Tasks of this process queue up locally, so only one thread per
+        # name waits on the file lock.
+        async with self._local.lock(name):
+            acquire = asyncio.ensure_future(asyncio.to_thread(self._acquire, path))
+            try:
+                fd = await asyncio.shield(acquire)
+            except asyncio.CancelledError:
+                # Let the thread finish, then give the lock straight back.
+                acquire.add_done_callback(_release_acquired)
+                raise
+            try:
+                yield
+            finally:
+                os.close(fd)
+
+def create_lock_backend(backend=STATE_BACKEND):
+    if backend == "file":
+        return FileLockBackend()
+    return LocalLockBackend()
@@ -0,0 +1,231 @@
+import asyncio
+import logging
+import time
+from telegram import Update
+from telegram.constants import ParseMode
+from telegram.error import TelegramError, BadRequest, TimedOut
+from edit_scheduler import EditScheduler
+from html_format import StreamingFormatter, format_message, split_html, split_markdown
+from config import TELEGRAM_MSG_CHAR_LIMIT
+from context_builder import estimate_tokens
+from utils import split_text
+from metrics import (registry, STREAM_FIRST_TOKEN, STREAM_FIRST_EDIT, STREAM_DURATION, STREAM_TOKENS_PER_SECOND,
+                     STREAMS_ACTIVE, FORMAT_SECONDS, TELEGRAM_RETRIES)
+
+logger = logging.getLogger(__name__)
+
+edit_scheduler = EditScheduler()
+
+for _name, _documentation in [("sent", "Message edits sent to Telegram"),
+                              ("skipped_unchanged", "Message edits skipped because the text did not change"),
+                              ("coalesced", "Message edits replaced by a newer text before being sent"),
+                              ("retries", "Message edits retried after a Telegram error")]:
+    registry.callback(f"bot_edits_{_name}_total", _documentation,
+                      lambda _name=_name: edit_scheduler.stats()[_name], type="counter")
+
+async def retry_on_timeout(func, max_retries=3, delay=1):
+    for attempt in range(max_retries):
+        try:
+            return await func()
+        except TimedOut as e:
+            if attempt == max_retries - 1:
+                raise e
+            logger.warning(f"Request timed out. Retrying in {delay} seconds...")
+            TELEGRAM_RETRIES.inc()
+            await asyncio.sleep(delay)
+            delay *= 2
+
+async def send_long_message(update: Update, text: str, parse_mode=None):
+    if parse_mode == ParseMode.HTML:
+        # Tags left open at a cut are closed and reopened in the next part.
+        parts = split_html(text, TELEGRAM_MSG_CHAR_LIMIT)
+    else:
+        parts = [part.strip() for part in split_text(text, TELEGRAM_MSG_CHAR_LIMIT) if part.strip()]
+
+    first_message = None
+    for i, part in enumerate(parts):
+        try:
+            if i == 0:
+                first_message = await retry_on_timeout(lambda: update.message.reply_text(part, parse_mode=parse_mode))
+            else:
+                await retry_on_timeout(lambda: update.message.reply_text(part, parse_mode=parse_mode, reply_to_message_id=first_message.message_id))
+        except TelegramError as e:
+            logger.error(f"Error sending message part {i}: {e}")
+        await asyncio.sleep(0.1)
+
+    return first_message
+
+# Shown instead of the placeholder when the model returns no text: Telegram
+# rejects an edit to an empty message.
+EMPTY_REPLY = "Không nhận được câu trả lời nào. Vui lòng thử lại."
+
+STAGE_METRICS = {"first_token": STREAM_FIRST_TOKEN, "first_edit": STREAM_FIRST_EDIT, "total": STREAM_DURATION}
+
+class StreamResponder:
+    """Stream model output into a Telegram reply.
+
+    Consumes any async iterable of text chunks, formats them incrementally,
+    paces the edits of the placeholder message through ``edit_scheduler``
+    and, once the stream is complete, saves the exchange to the conversation
+    history. When the reply outgrows a single message, the part that fits
+    is cut at a line break with its formatting closed, left as final, and
+    the rest continues in a new message; messages already sent are never
+    deleted or sent again.
+
+    Stage timings (``first_token``, ``first_edit`` and ``total``, in seconds
+    since ``stream`` was called) are kept in ``timings``, recorded in the
+    metrics under the ``handler`` label and passed to
+    ``timing_hook(stage, seconds)`` when one is given.
+
+    Args:
+        update (Update): The update being answered.
+        init_msg: The placeholder message that is edited while streaming.
+        conversation_manager: Where to save the exchange, or None.
+        user_id: The user whose history is updated.
+        user_message (str): History entry for the user's side of the exchange.
+        timing_hook: Optional callable receiving each stage timing.
+        handler (str): Label of the metrics, e.g. "text", "image" or "pdf".
+    """
+
+    def __init__(self, update: Update, init_msg, conversation_manager=None, user_id=None,
+                 user_message=None, timing_hook=None, handler="text"):
+        self.update = update
+        self.message = init_msg
+        self.conversation_manager = conversation_manager
+        self.user_id = user_id
+        self.user_message = user_message
+        self.timing_hook = timing_hook
+        self.handler = handler
+        self.timings = {}
+        self._started = None
+
+    def _record(self, stage):
+        if stage in self.timings:
+            return
+        seconds = time.monotonic() - self._started
+        self.timings[stage] = seconds
+        STAGE_METRICS[stage].observe(seconds, handler=self.handler)
+        if self.timing_hook is not None:
+            self.timing_hook(stage, seconds)
+        else:
+            logger.debug(f"Stream stage {stage} after {seconds:.3f}s")
+
+    def _edit_sent(self):
+        self._record("first_edit")
+
+    async def show_status(self, text):
+        """Replace the placeholder text, for progress shown before the response."""
+        try:
+            await edit_scheduler.update(self.message, text)
+        except TelegramError as e:
+            logger.warning(f"Failed to update status message: {e}")
+
+    async def stream(self, chunks):
+        """Stream ``chunks`` into the reply and return the full response text."""
+        self._started = time.monotonic()
+        parts = []
+        # Raw text of the message currently being edited.
+        current = ""
+        formatted_response = ""
+        formatter = StreamingFormatter()
+
+        STREAMS_ACTIVE.inc(handler=self.handler)
+        try:
+            async for text in chunks:
+                self._record("first_token")
+                parts.append(text)
+                current += text
+                started = time.perf_counter()
+                formatted_response = formatter.feed(text)
+                FORMAT_SECONDS.observe(time.perf_counter() - started, handler=self.handler)
+                while len(formatted_response) > TELEGRAM_MSG_CHAR_LIMIT:
+                    head, current = split_markdown(current, TELEGRAM_MSG_CHAR_LIMIT)
+                    await self._finish(format_message(head))
+                    self.message = None
+                    formatter.reset()
+                    formatted_response = formatter.feed(current)
+                if not await self._show(formatted_response):
+                    break
+        except (Exception, asyncio.CancelledError):
+            # Superseded by a newer message or failed: leave the partial
+            # answer in place, but keep it out of the history.
+            await self._abandon(formatted_response)
+            raise
+        finally:
+            STREAMS_ACTIVE.dec(handler=self.handler)
+
+        if not formatted_response.strip() and self.message is not None:
+            formatted_response = EMPTY_REPLY
+        await self._finish(formatted_response)
+        full_response = "".join(parts)
+        if self.conversation_manager is not None and full_response.strip():
+            if self.user_message is not None:
+                await self.conversation_manager.add_message_async(self.user_id, "user", self.user_message)
+            await self.conversation_manager.add_message_async(self.user_id, "model", full_response)
+        self._record("total")
+        generating = self.timings["total"] - self.timings.get("first_token", 0)
+        if full_response and generating > 0:
+            STREAM_TOKENS_PER_SECOND.observe(estimate_tokens(full_response) / generating, handler=self.handler)
+        return full_response
+
+    async def _show(self, formatted_response):
+        """Show the current reply text. Returns False when streaming must stop."""
+        try:
+            if self.message is None:
+                # The previous message is full, the reply continues in a new one.
+                if not formatted_response.strip():
+                    return True
+                self.message = await retry_on_timeout(
+                    lambda: self.update.message.reply_text(formatted_response, parse_mode=ParseMode.HTML))
+                self._record("first_edit")
+            else:
+                # The edit is only queued here, so first_edit is recorded when it is delivered.
+                await edit_scheduler.update(self.message, formatted_response, parse_mode=ParseMode.HTML,
+                                            on_sent=self._edit_sent)
+        except BadRequest as e:
+            if "Message is not modified" not in str(e):
+                logger.warning(f"BadRequest error: {e}")
+                await self._resend(formatted_response)
+        except TelegramError as e:
+            logger.error(f"Telegram error when updating message: {e}")
+            try:
+                message = await send_long_message(self.update, formatted_response, parse_mode=ParseMode.HTML)
+                if self.message is None:
+                    self.message = message
+            except TelegramError as e2:
+                logger.error(f"Failed to send new message after error: {e2}")
+                return False
+        return True
+
+    async def _finish(self, formatted_response):
+        if self.message is None:
+            if formatted_response.strip():
+                await self._show(formatted_response)
+            return
+        try:
+            await edit_scheduler.flush(self.message, formatted_response, parse_mode=ParseMode.HTML,
+                                       on_sent=self._edit_sent)
+        except BadRequest as e:
+            logger.warning(f"BadRequest error: {e}")
+            await self._resend(formatted_response)
+        except TelegramError as e:
+            logger.error(f"Telegram error when updating message: {e}")
+
+    async def _abandon(self, formatted_response):
+        """Show the partial reply of an interrupted stream and drop its edit state."""
+        try:
+            if formatted_response:
+                await self._finish(formatted_response)
+        except Exception as e:
+            logger.warning(f"Failed to show the partial reply: {e}")
+        finally:
+            # Nothing of the message may stay behind in the shared scheduler.
+            if self.message is not None:
+                edit_scheduler.discard(self.message)
+
+    async def _resend(self, formatted_response):
+        if self.message is not None:
+            edit_scheduler.discard(self.message)
+            await self.message.delete()
+        self.message = await send_long_message(self.update, formatted_response, parse_mode=ParseMode.HTML)
+        self._record("first_edit")
@@ -1,76 +1,66 @@
 import asyncio
 import logging
+import tempfile
+from contextlib import asynccontextmanager
 from io import BytesIO
 import os
 from telegram import Update
 from telegram.ext import ContextTypes
-from telegram.constants import ParseMode
-from telegram.error import TelegramError, BadRequest, NetworkError, TimedOut
-from gemini_handler import generate_text, analyze_image, process_pdf
+from telegram.error import NetworkError, TimedOut
+from gemini_handler import generate_text_async, analyze_image_async, extract_pdf_text_async, analyze_pdf_async, pdf_text_limit
 from conversation_manager import ConversationManager
+from file_cache import FileCache
+from media_group import MediaGroupCollector
+from request_queue import RequestQueue, QueueFull
+from metrics import registry
+from stream_responder import StreamResponder, retry_on_timeout
 from utils import is_user_allowed
-from html_format import format_message
-from PIL import Image
-from config import SYSTEM_INSTRUCTION, TELEGRAM_MSG_CHAR_LIMIT
+from config_service import config_service
+from image_preprocessor import MIME_TYPES, choose_photo_size, preprocess_image, image_stats
+from config import DOCUMENT_MEMORY_MAX_BYTES, IMAGE_MAX_SIDE, IMAGE_FORMAT, IMAGE_QUALITY, RESPONSE_CACHE_ENABLED
 
 # Thiết lập logging
 logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 conversation_manager = ConversationManager()
-
-async def retry_on_timeout(func, max_retries=3, delay=1):
-    for attempt in range(max_retries):
-        try:
-            return await func()
-        except TimedOut as e:
-            if attempt == max_retries - 1:
-                raise e
-            logger.warning(f"Request timed out. Retrying in {delay} seconds...")
-            await asyncio.sleep(delay)
-            delay *= 2
+file_cache = FileCache()
+media_groups = MediaGroupCollector()
+request_queue = RequestQueue()
+# User setting of those who asked for every answer to be generated fresh (/nocache)
+NOCACHE_SETTING = "nocache"
+
+registry.callback("bot_requests_active", "Requests being processed", lambda: request_queue.active)
+registry.callback("bot_requests_waiting", "Requests waiting in the per-chat queues", lambda: request_queue.waiting)
+registry.callback("bot_requests_rejected_total", "Requests answered with a busy reply",
+                  lambda: request_queue.rejected, type="counter")
+registry.callback("bot_file_cache_hits_total", "Photos and PDF texts found in the file cache",
+                  lambda: file_cache.hits, type="counter")
+registry.callback("bot_file_cache_misses_total", "Photos and PDF texts missing from the file cache",
+                  lambda: file_cache.misses, type="counter")
+
+async def run_queued(update: Update, make_coro):
+    """Run a request in the queue of its chat, or reply that the bot is busy."""
+    try:
+        await request_queue.run(update.effective_chat.id, make_coro)
+    except QueueFull as e:
+        logger.warning(f"Rejected request from chat {update.effective_chat.id}: {e}")
+        await update.message.reply_text("Bot đang bận, vui lòng thử lại sau ít phút.")
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text("Xin chào! Tôi là bot Telegram được hỗ trợ bởi Gemini. Tôi có thể giúp gì cho bạn hôm nay?")
 
-async def send_long_message(update: Update, text: str, parse_mode=None):
-    parts = []
-    current_part = ""
-
-    for line in text.split('\n'):
-        if len(current_part) + len(line) + 1 <= TELEGRAM_MSG_CHAR_LIMIT:
-            current_part += line + '\n'
-        else:
-            if current_part:
-                parts.append(current_part.strip())
-            current_part = line + '\n'
-    
-    if current_part:
-        parts.append(current_part.strip())
-
-    first_message = None
-    for i, part in enumerate(parts):
-        try:
-            if i == 0:
-                first_message = await retry_on_timeout(lambda: update.message.reply_text(part, parse_mode=parse_mode))
-            else:
-                await retry_on_timeout(lambda: update.message.reply_text(part, parse_mode=parse_mode, reply_to_message_id=first_message.message_id))
-        except TelegramError as e:
-            logger.error(f"Error sending message part {i}: {e}")
-        await asyncio.sleep(0.1)
-
-    return first_message
-
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not is_user_allowed(update.effective_user.username):
         await update.message.reply_text("Xin lỗi, bạn không được phép sử dụng bot này.")
         return
 
+    await run_queued(update, lambda: answer_message(update))
+
+async def answer_message(update: Update):
     user_id = update.effective_user.id
     user_input = update.message.text
-
-    conversation_manager.add_message(user_id, "user", user_input)
-    history = conversation_manager.get_history(user_id)
+    history = await conversation_manager.get_history_async(user_id)
 
     try:
         init_msg = await retry_on_timeout(lambda: update.message.reply_text("Đang suy nghĩ..."))
@@ -79,35 +69,12 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     try:
-        response = generate_text(user_input, SYSTEM_INSTRUCTION, history)
-        full_response = ""
-
-        for text in response:
-            full_response += text
-            formatted_response = format_message(full_response)
-            
-            try:
-                if len(formatted_response) > TELEGRAM_MSG_CHAR_LIMIT:
-                    await init_msg.delete()
-                    init_msg = await send_long_message(update, formatted_response, parse_mode=ParseMode.HTML)
-                else:
-                    await retry_on_timeout(lambda: init_msg.edit_text(formatted_response, parse_mode=ParseMode.HTML))
-            except BadRequest as e:
-                if "Message is not modified" not in str(e):
-                    logger.warning(f"BadRequest error: {e}")
-                    await init_msg.delete()
-                    init_msg = await send_long_message(update, formatted_response, parse_mode=ParseMode.HTML)
-            except TelegramError as e:
-                logger.error(f"Telegram error when updating message: {e}")
-                try:
-                    await send_long_message(update, formatted_response, parse_mode=ParseMode.HTML)
-                except TelegramError as e2:
-                    logger.error(f"Failed to send new message after error: {e2}")
-                    break
-
-            await asyncio.sleep(0.1)
-
-        conversation_manager.add_message(user_id, "model", full_response)
+        responder = StreamResponder(update, init_msg, conversation_manager, user_id, user_input)
+        # The setting is only looked up when there is a cache to skip.
+        use_cache = RESPONSE_CACHE_ENABLED and not await conversation_manager.get_setting_async(user_id, NOCACHE_SETTING)
+        profile = config_service.profile(update.effective_chat.type)
+        await responder.stream(generate_text_async(user_input, config_service.system_instruction, history, use_cache,
+                                                   profile))
 
     except NetworkError as e:
         logger.error(f"Network error: {e}")
@@ -116,55 +83,62 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
         logger.error(f"Unexpected error: {e}")
         await update.message.reply_text("Đã xảy ra lỗi không mong đợi. Vui lòng thử lại sau.")
 
+async def load_photo(photo_sizes):
+    """Return the preprocessed photo as a blob, downloading it on a cache miss."""
+    photo = choose_photo_size(photo_sizes)
+    cache_key = f"photo:{IMAGE_MAX_SIDE}:{IMAGE_FORMAT}:{IMAGE_QUALITY}:{photo.file_unique_id}"
+    image_bytes = await asyncio.to_thread(file_cache.get, cache_key)
+    if image_bytes is None:
+        file = await photo.get_file()
+        image_bytes = bytes(await file.download_as_bytearray())
+        image = await asyncio.get_running_loop().run_in_executor(None, preprocess_image, image_bytes)
+        image_bytes = image["data"]
+        await asyncio.to_thread(file_cache.put, cache_key, image_bytes)
+        logger.info(f"Image preprocessing saved {image_stats.saved()} bytes over {image_stats.images} images")
+    return {"mime_type": MIME_TYPES[IMAGE_FORMAT], "data": image_bytes}
+
 async def handle_image(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     if not is_user_allowed(update.effective_user.username):
         await update.message.reply_text("Xin lỗi, bạn không được phép sử dụng bot này.")
         return
 
+    updates = [update]
+    if update.message.media_group_id:
+        # The whole album is answered from the update of its first photo.
+        updates = await media_groups.add(update)
+        if updates is None:
+            return
+    await run_queued(updates[0], lambda: answer_images(updates))
+
+async def answer_images(updates):
+    update = updates[0]
+    message = update.message
+
     try:
-        init_msg = await retry_on_timeout(lambda: update.message.reply_text("Đang xử lý hình ảnh...", reply_to_message_id=update.message.message_id))
+        init_msg = await retry_on_timeout(lambda: message.reply_text("Đang xử lý hình ảnh...", reply_to_message_id=message.message_id))
     except TimedOut:
         logger.error("Failed to send initial message after multiple retries")
         return
 
     try:
-        file = await update.message.photo[-1].get_file()
-        image_bytes = await file.download_as_bytearray()
-        image = Image.open(BytesIO(image_bytes))
-
-        prompt = update.message.caption if update.message.caption else "Phân tích hình ảnh này và tạo phản hồi"
-
-        response = analyze_image(image, prompt)
-        full_response = ""
-
-        for text in response:
-            full_response += text
-            formatted_response = format_message(full_response)
-            
-            try:
-                if len(formatted_response) > TELEGRAM_MSG_CHAR_LIMIT:
-                    await init_msg.delete()
-                    init_msg = await send_long_message(update, formatted_response, parse_mode=ParseMode.HTML)
-                else:
-                    await retry_on_timeout(lambda: init_msg.edit_text(formatted_response, parse_mode=ParseMode.HTML))
-            except BadRequest as e:
-                if "Message is not modified" not in str(e):
-                    logger.warning(f"BadRequest error: {e}")
-                    await init_msg.delete()
-                    init_msg = await send_long_message(update, formatted_response, parse_mode=ParseMode.HTML)
-            except TelegramError as e:
-                logger.error(f"Telegram error when updating message: {e}")
-                try:
-                    await send_long_message(update, formatted_response, parse_mode=ParseMode.HTML)
-                except TelegramError as e2:
-                    logger.error(f"Failed to send new message after error: {e2}")
-                    break
-
-            await asyncio.sleep(0.1)
+        images = await asyncio.gather(*(load_photo(item.message.photo) for item in updates))
+
+        captions = [item.message.caption for item in updates if item.message.caption]
+        if captions:
+            prompt = captions[0]
+        elif len(images) > 1:
+            prompt = "Phân tích các hình ảnh này và tạo phản hồi"
+        else:
+            prompt = "Phân tích hình ảnh này và tạo phản hồi"
 
         user_id = update.effective_user.id
-        conversation_manager.add_message(user_id, "user", f"Đã gửi một hình ảnh với prompt: {prompt}")
-        conversation_manager.add_message(user_id, "model", full_response)
+        if len(images) > 1:
+            user_message = f"Đã gửi {len(images)} hình ảnh với prompt: {prompt}"
+        else:
+            user_message = f"Đã gửi một hình ảnh với prompt: {prompt}"
+        responder = StreamResponder(update, init_msg, conversation_manager, user_id, user_message, handler="image")
+        profile = config_service.profile(update.effective_chat.type)
+        await responder.stream(analyze_image_async(images if len(images) > 1 else images[0], prompt, profile=profile))
 
     except NetworkError as e:
         logger.error(f"Network error: {e}")
@@ -173,64 +147,91 @@ async def handle_image(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
         logger.error(f"Unexpected error: {e}")
         await update.message.reply_text("Đã xảy ra lỗi không mong đợi khi xử lý hình ảnh. Vui lòng thử lại sau.")
 
+@asynccontextmanager
+async def download_document(document):
+    """Download a document and yield its content for pdfplumber.
+
+    Files up to DOCUMENT_MEMORY_MAX_BYTES are kept in memory and yielded as
+    bytes. Larger ones go to a uniquely named temporary file whose path is
+    yielded, so concurrent uploads never share a file, and the file is
+    removed even when processing fails.
+    """
+    file = await document.get_file()
+    size = document.file_size or file.file_size or 0
+    if size <= DOCUMENT_MEMORY_MAX_BYTES:
+        buffer = BytesIO()
+        await file.download_to_memory(buffer)
+        yield buffer.getvalue()
+        return
+
+    fd, file_path = tempfile.mkstemp(suffix=".pdf")
+    os.close(fd)
+    try:
+        await file.download_to_drive(file_path)
+        yield file_path
+    finally:
+        os.remove(file_path)
+
 async def handle_document(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not is_user_allowed(update.effective_user.username):
         await update.message.reply_text("Xin lỗi, bạn không được phép sử dụng bot này.")
         return
 
-    document = update.message.document
-    if document.file_name.lower().endswith('.pdf'):
-        try:
-            init_msg = await retry_on_timeout(lambda: update.message.reply_text("Đang xử lý file PDF..."))
-            file = await document.get_file()
-            file_path = f"temp_{update.effective_user.id}.pdf"
-            await file.download_to_drive(file_path)
-
-            prompt = "Hãy tóm tắt nội dung chính của file PDF này."
-            if update.message.caption:
-                prompt = update.message.caption
-
-            response = process_pdf(file_path, prompt)
-            full_response = ""
-
-            for text in response:
-                full_response += text
-                formatted_response = format_message(full_response)
-                
-                try:
-                    if len(formatted_response) > TELEGRAM_MSG_CHAR_LIMIT:
-                        await init_msg.delete()
-                        init_msg = await send_long_message(update, formatted_response, parse_mode=ParseMode.HTML)
-                    else:
-                        await retry_on_timeout(lambda: init_msg.edit_text(formatted_response, parse_mode=ParseMode.HTML))
-                except BadRequest as e:
-                    if "Message is not modified" not in str(e):
-                        logger.warning(f"BadRequest error: {e}")
-                        await init_msg.delete()
-                        init_msg = await send_long_message(update, formatted_response, parse_mode=ParseMode.HTML)
-                except TelegramError as e:
-                    logger.error(f"Telegram error when updating message: {e}")
-                    try:
-                        await send_long_message(update, formatted_response, parse_mode=ParseMode.HTML)
-                    except TelegramError as e2:
-                        logger.error(f"Failed to send new message after error: {e2}")
-                        break
-
-                await asyncio.sleep(0.1)
-
-            os.remove(file_path)  # Clean up the temporary file
-
-        except Exception as e:
-            logger.error(f"Error processing PDF: {e}")
-            await update.message.reply_text("Có lỗi xảy ra khi xử lý file PDF. Vui lòng thử lại sau.")
+    if update.message.document.file_name.lower().endswith('.pdf'):
+        await run_queued(update, lambda: answer_document(update))
     else:
         await update.message.reply_text("Xin lỗi, tôi chỉ có thể xử lý file PDF.")
 
+async def answer_document(update: Update):
+    document = update.message.document
+    try:
+        init_msg = await retry_on_timeout(lambda: update.message.reply_text("Đang xử lý file PDF..."))
+
+        # Telegram gives the same file_unique_id to every copy of a file,
+        # so forwarded PDFs are neither downloaded nor extracted again.
+        cache_key = f"pdf-text:{pdf_text_limit()}:{document.file_unique_id}"
+        text = await asyncio.to_thread(file_cache.get_text, cache_key)
+        if text is None:
+            async with download_document(document) as source:
+                text = await extract_pdf_text_async(source)
+            await asyncio.to_thread(file_cache.put_text, cache_key, text)
+        logger.info(f"File cache stats: {file_cache.stats()}")
+
+        prompt = "Hãy tóm tắt nội dung chính của file PDF này."
+        if update.message.caption:
+            prompt = update.message.caption
+
+        user_id = update.effective_user.id
+        responder = StreamResponder(update, init_msg, conversation_manager, user_id,
+                                    f"Đã gửi một file PDF với prompt: {prompt}", handler="pdf")
+        await responder.stream(analyze_pdf_async(
+            text, prompt,
+            on_progress=lambda done, total: responder.show_status(f"Đang xử lý file PDF... ({done}/{total})"),
+            profile=config_service.profile(update.effective_chat.type),
+        ))
+
+    except Exception as e:
+        logger.error(f"Error processing PDF: {e}")
+        await update.message.reply_text("Có lỗi xảy ra khi xử lý file PDF. Vui lòng thử lại sau.")
+
 async def clear(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not is_user_allowed(update.effective_user.username):
         await update.message.reply_text("Xin lỗi, bạn không được phép sử dụng bot này.")
         return
 
     user_id = update.effective_user.id
-    conversation_manager.clear_history(user_id)
-    await update.message.reply_text("Lịch sử hội thoại đã được xóa.")
\ No newline at end of file
+    await conversation_manager.clear_history_async(user_id)
+    await update.message.reply_text("Lịch sử hội thoại đã được xóa.")
+
+async def toggle_cache(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not is_user_allowed(update.effective_user.username):
+        await update.message.reply_text("Xin lỗi, bạn không được phép sử dụng bot này.")
+        return
+
+    user_id = update.effective_user.id
+    if await conversation_manager.get_setting_async(user_id, NOCACHE_SETTING):
+        await conversation_manager.set_setting_async(user_id, NOCACHE_SETTING, None)
+        await update.message.reply_text("Đã bật lại bộ nhớ đệm câu trả lời.")
+    else:
+        await conversation_manager.set_setting_async(user_id, NOCACHE_SETTING, "1")
+        await update.message.reply_text("Đã tắt bộ nhớ đệm, mọi câu trả lời sẽ được tạo mới.")
\ No newline at end of file
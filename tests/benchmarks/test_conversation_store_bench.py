@@ -0,0 +1,51 @@
+import time
+import tracemalloc
+import pytest
+from conversation_manager import MemoryConversationStore, SQLiteConversationStore
+
+pytestmark = pytest.mark.slow
+
+USERS = 100_000
+MAX_USERS = 10_000
+
+
+def simulate(store, users):
+    """Two turns for each of ``users`` simulated users. Returns (seconds, peak bytes)."""
+    tracemalloc.start()
+    started = time.perf_counter()
+    for user_id in range(users):
+        for turn in range(2):
+            store.get(user_id)
+            store.append(user_id, {"role": "user", "content": f"câu hỏi {turn} của {user_id}"})
+            store.append(user_id, {"role": "model", "content": f"câu trả lời {turn} cho {user_id} " * 5})
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak
+
+
+def test_memory_stays_flat_past_the_user_limit():
+    _, peak_at_limit = simulate(MemoryConversationStore(max_users=MAX_USERS), MAX_USERS)
+    elapsed, peak = simulate(MemoryConversationStore(max_users=MAX_USERS), USERS)
+    print(f"\nmemory store: {USERS} users in {elapsed:.2f}s, peak {peak / 2**20:.1f} MiB "
+          f"({peak_at_limit / 2**20:.1f} MiB at {MAX_USERS} users)")
+    assert peak < peak_at_limit * 1.5
+
+
+def test_sqlite_store_with_100k_users(tmp_path):
+    path = tmp_path / "conversations.db"
+    store = SQLiteConversationStore(path, max_users=MAX_USERS)
+    elapsed, peak = simulate(store, USERS)
+    started = time.perf_counter()
+    store.close()
+    flushed = time.perf_counter() - started
+
+    store = SQLiteConversationStore(path, max_users=MAX_USERS)
+    started = time.perf_counter()
+    for user_id in range(0, USERS, 100):
+        assert len(store.get(user_id)) == 4
+    reload = (time.perf_counter() - started) / (USERS // 100)
+    store.close()
+    print(f"\nsqlite store: {USERS} users in {elapsed:.2f}s (+{flushed:.2f}s to flush), "
+          f"peak {peak / 2**20:.1f} MiB, {reload * 1000:.2f} ms per cold load")
+    assert reload < 0.01
@@ -0,0 +1,24 @@
+import pytest
+from html_format import format_message
+from tests.benchmarks import legacy_html_format
+from tests.corpus import SAMPLES, model_reply
+
+pytestmark = pytest.mark.slow
+
+OUTPUTS = {
+    "short": SAMPLES[2],
+    "long": model_reply(200),
+    "code_heavy": model_reply(200, code_every=2),
+}
+
+
+@pytest.mark.parametrize("kind", OUTPUTS)
+def test_single_pass_lexer(benchmark, kind):
+    benchmark.group = kind
+    benchmark(format_message, OUTPUTS[kind])
+
+
+@pytest.mark.parametrize("kind", OUTPUTS)
+def test_chained_regex_passes(benchmark, kind):
+    benchmark.group = kind
+    benchmark(legacy_html_format.format_message, OUTPUTS[kind])
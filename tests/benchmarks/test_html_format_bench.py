@@ -0,0 +1,55 @@
+import statistics
+import time
+import pytest
+from html_format import StreamingFormatter, format_message
+from tests.corpus import model_reply
+
+pytestmark = pytest.mark.slow
+
+REPLY = model_reply(300, code_every=6)
+CHUNK = 20
+
+
+def chunks(text):
+    return [text[i:i + CHUNK] for i in range(0, len(text), CHUNK)]
+
+
+def feed_costs(text):
+    formatter = StreamingFormatter()
+    costs = []
+    for chunk in chunks(text):
+        started = time.perf_counter()
+        formatter.feed(chunk)
+        costs.append(time.perf_counter() - started)
+    return costs
+
+
+def test_per_chunk_cost_stays_flat():
+    # Best of a few runs, so a scheduler hiccup does not decide the result.
+    runs = [feed_costs(REPLY) for _ in range(3)]
+    costs = [min(run[i] for run in runs) for i in range(len(runs[0]))]
+    tenth = len(costs) // 10
+    early = statistics.median(costs[:tenth])
+    late = statistics.median(costs[-tenth:])
+    print(f"\n{len(REPLY)} chars: median feed {early * 1e6:.1f}us early, {late * 1e6:.1f}us late")
+    assert late < early * 3
+
+
+def test_stream_with_streaming_formatter(benchmark):
+    def run():
+        formatter = StreamingFormatter()
+        for chunk in chunks(REPLY):
+            formatter.feed(chunk)
+
+    benchmark(run)
+
+
+def test_stream_reformatting_whole_text(benchmark):
+    # What the handlers did before: format the accumulated text on every chunk.
+    def run():
+        text = ""
+        for chunk in chunks(REPLY):
+            text += chunk
+            format_message(text)
+
+    benchmark.pedantic(run, rounds=3)
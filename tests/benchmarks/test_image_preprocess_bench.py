@@ -0,0 +1,41 @@
+import time
+from io import BytesIO
+import pytest
+from PIL import Image
+from image_preprocessor import preprocess_image
+from tests.images import make_photo
+
+pytestmark = pytest.mark.slow
+
+SIDES = [640, 1280, 2560, 4000]
+
+
+def sdk_payload(data):
+    """What the Gemini SDK uploads for a PIL image opened from bytes: lossless WebP."""
+    output = BytesIO()
+    with Image.open(BytesIO(data)) as image:
+        image.save(output, format="webp", lossless=True)
+    return output.getvalue()
+
+
+def timed(function, *args):
+    started = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - started
+
+
+def test_payload_and_time_across_image_sizes():
+    rows = []
+    for side in SIDES:
+        photo = make_photo(side, side * 3 // 4)
+        before, before_seconds = timed(sdk_payload, photo)
+        after, after_seconds = timed(preprocess_image, photo)
+        rows.append((side, len(photo), len(before), before_seconds, len(after["data"]), after_seconds))
+    print("\n  side   upload   sdk payload          preprocessed")
+    for side, size, before, before_seconds, after, after_seconds in rows:
+        print(f"{side:>6} {size / 1024:>7.0f}K {before / 1024:>8.0f}K {before_seconds * 1000:>6.0f}ms "
+              f"{after / 1024:>8.0f}K {after_seconds * 1000:>6.0f}ms")
+        assert after < before
+        assert after_seconds < before_seconds
+    # Past IMAGE_MAX_SIDE the payload stays flat however large the photo is.
+    assert rows[-1][4] < rows[1][4] * 1.5
@@ -0,0 +1,35 @@
+import timeit
+import pytest
+from metrics import Registry
+
+pytestmark = pytest.mark.slow
+
+CALLS = 200_000
+
+
+def per_call(statement):
+    return min(timeit.repeat(statement, number=CALLS, repeat=3)) / CALLS
+
+
+def test_recording_overhead():
+    registry = Registry()
+    counter = registry.counter("requests_total", "Requests", ["handler"])
+    histogram = registry.histogram("latency_seconds", "Latency", ["handler"])
+    baseline = per_call(lambda: None)
+    costs = {
+        "counter.inc": per_call(lambda: counter.inc(handler="text")),
+        "histogram.observe": per_call(lambda: histogram.observe(0.123, handler="text")),
+    }
+    print("\n" + "\n".join(f"{name}: {(cost - baseline) * 1e9:.0f} ns" for name, cost in costs.items()))
+    # Recording must stay negligible next to formatting a chunk (tens of microseconds).
+    assert all(cost - baseline < 5e-6 for cost in costs.values())
+
+
+def test_render_cost_with_many_series():
+    registry = Registry()
+    histogram = registry.histogram("latency_seconds", "Latency", ["handler"])
+    for i in range(100):
+        histogram.observe(0.1, handler=f"handler-{i}")
+    seconds = min(timeit.repeat(registry.render, number=10, repeat=3)) / 10
+    print(f"\nrender of 100 histogram series: {seconds * 1000:.2f} ms")
+    assert seconds < 0.05
@@ -0,0 +1,60 @@
+import json
+import subprocess
+import sys
+from pathlib import Path
+import pytest
+from tests.pdfs import make_pdf
+
+pytestmark = pytest.mark.slow
+
+PAGES = 300
+
+# Each run is a fresh interpreter, so its peak RSS only covers one extraction.
+# The process pool is shut down before measuring so its workers are reaped
+# and counted in RUSAGE_CHILDREN, which holds the peak of the largest one.
+RUN = """
+import json, resource, sys, time
+import pdf_extractor
+from tests.test_pdf_extractor import legacy_extract
+from pdf_extractor import extract_pdf_text
+mode, path, max_chars = sys.argv[1], sys.argv[2], int(sys.argv[3])
+if mode == "parallel":
+    # The pool is used whatever the number of CPUs, and given the bytes of an upload.
+    pdf_extractor.PDF_WORKERS = 4
+    path = open(path, "rb").read()
+started = time.perf_counter()
+text = (legacy_extract if mode == "legacy" else extract_pdf_text)(path, max_chars)
+seconds = time.perf_counter() - started
+workers = 0
+if pdf_extractor._pool is not None:
+    workers = pdf_extractor.PDF_WORKERS
+    pdf_extractor._pool.shutdown()
+main = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+worker = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024 if workers else 0
+print(json.dumps({"seconds": seconds, "chars": len(text), "main_rss_mb": main, "worker_rss_mb": worker,
+                  "peak_rss_mb": main + workers * worker}))
+"""
+
+
+def run(mode, path, max_chars):
+    result = subprocess.run([sys.executable, "-c", RUN, mode, str(path), str(max_chars)],
+                            cwd=Path(__file__).parents[2], capture_output=True, text=True, check=True)
+    return json.loads(result.stdout)
+
+
+@pytest.mark.parametrize("max_chars", [10_000, 400_000])
+def test_extraction_stops_at_the_budget(tmp_path, max_chars):
+    path = tmp_path / "document.pdf"
+    path.write_bytes(make_pdf(PAGES))
+    legacy = run("legacy", path, max_chars)
+    current = run("incremental", path, max_chars)
+    parallel = run("parallel", path, max_chars)
+    print(f"\n{PAGES} pages, {max_chars} chars: legacy {legacy['seconds']:.2f}s {legacy['peak_rss_mb']:.0f} MB, "
+          f"incremental {current['seconds']:.2f}s {current['peak_rss_mb']:.0f} MB, "
+          f"parallel {parallel['seconds']:.2f}s {parallel['peak_rss_mb']:.0f} MB "
+          f"({parallel['main_rss_mb']:.0f} MB + 4 x {parallel['worker_rss_mb']:.0f} MB in the pool)")
+    assert current["chars"] == parallel["chars"] == legacy["chars"]
+    assert current["peak_rss_mb"] < legacy["peak_rss_mb"]
+    assert parallel["peak_rss_mb"] < legacy["peak_rss_mb"]
+    if max_chars == 10_000:
+        assert current["seconds"] < legacy["seconds"] / 5
@@ -0,0 +1,35 @@
+import re
+import subprocess
+import sys
+from pathlib import Path
+import pytest
+
+pytestmark = pytest.mark.slow
+
+# Loaded on first use, so starting the bot must not import them.
+LAZY_MODULES = ("google.generativeai", "PIL", "pdfplumber")
+# Importing main took 2.9s when the SDK was imported at startup, about 0.5s without it.
+MAX_IMPORT_SECONDS = 1.5
+
+LINE = re.compile(r"import time:\s+\d+ \|\s+(\d+) \| \s*(\S+)")
+
+
+def import_times():
+    """``{module: cumulative seconds}`` from ``python -X importtime -c "import main"``."""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import main"],
+                            cwd=Path(__file__).parents[2], capture_output=True, text=True, check=True)
+    times = {}
+    for match in LINE.finditer(result.stderr):
+        times[match.group(2)] = int(match.group(1)) / 1e6
+    return times
+
+
+def test_startup_imports_stay_light():
+    # The fastest of a few runs, so other processes on the machine add no noise.
+    runs = [import_times() for _ in range(3)]
+    seconds = min(times["main"] for times in runs)
+    slowest = sorted(runs[0].items(), key=lambda item: -item[1])[1:6]
+    print(f"\nimport main: {seconds:.2f}s; slowest: " + ", ".join(f"{name} {t:.2f}s" for name, t in slowest))
+    for module in LAZY_MODULES:
+        assert not any(name == module or name.startswith(module + ".") for name in runs[0]), module
+    assert seconds < MAX_IMPORT_SECONDS
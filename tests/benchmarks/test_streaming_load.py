@@ -0,0 +1,34 @@
+import asyncio
+import time
+import pytest
+import gemini_handler
+
+pytestmark = pytest.mark.slow
+
+CHUNKS = 10
+CHUNK_LATENCY = 0.02  # Seconds the fake model blocks before every chunk, like the SDK iterator
+
+
+def fake_generate_text(prompt, system_instruction, history, model_name=None, profile=None):
+    for i in range(CHUNKS):
+        time.sleep(CHUNK_LATENCY)
+        yield f"chunk {i} "
+
+
+async def throughput(concurrency):
+    async def one_user(i):
+        return [chunk async for chunk in gemini_handler.generate_text_async(f"hỏi {i}", "si", [], use_cache=False)]
+
+    started = time.perf_counter()
+    replies = await asyncio.gather(*(one_user(i) for i in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    assert all(len(reply) == CHUNKS for reply in replies)
+    return concurrency * CHUNKS / elapsed
+
+
+def test_throughput_rises_with_concurrency(monkeypatch):
+    monkeypatch.setattr(gemini_handler, "generate_text", fake_generate_text)
+    results = {concurrency: asyncio.run(throughput(concurrency)) for concurrency in (1, 4, 16)}
+    print("\n" + "\n".join(f"{c:>3} users: {rate:7.1f} chunks/s" for c, rate in results.items()))
+    assert results[4] > results[1] * 3
+    assert results[16] > results[1] * 10
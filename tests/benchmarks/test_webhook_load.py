@@ -0,0 +1,99 @@
+import asyncio
+import json
+import statistics
+import time
+import pytest
+from aiohttp import ClientSession
+from aiohttp.test_utils import TestServer
+from config import WEBHOOK_PATH
+from request_queue import RequestQueue
+from stream_responder import StreamResponder
+from webhook_server import SECRET_HEADER, chat_id_of, create_web_app
+from tests.fakes import FakeBot, make_update
+
+pytestmark = pytest.mark.slow
+
+SECRET = "load-test"
+CHUNKS = 10
+CHUNK_LATENCY = 0.02  # Seconds between model chunks
+
+
+def synthetic_update(update_id, chat_id):
+    return {"update_id": update_id, "message": {"message_id": update_id, "date": 0, "text": f"câu hỏi {update_id}",
+                                                 "chat": {"id": chat_id, "type": "private"}}}
+
+
+async def fake_model():
+    for i in range(CHUNKS):
+        await asyncio.sleep(CHUNK_LATENCY)
+        yield f"phần {i} "
+
+
+async def load(updates, chats, rate=None, concurrency=32, answer_updates=True):
+    """POST ``updates`` synthetic updates spread over ``chats`` chats.
+
+    Updates are sent as fast as ``concurrency`` connections allow, or at
+    ``rate`` updates per second. Returns updates accepted per second and,
+    when the updates are answered, the seconds from each POST to the first
+    edit of its reply.
+    """
+    bot = FakeBot(latency=0.005)
+    request_queue = RequestQueue(max_active=16, max_waiting=updates, max_pending=updates)
+    posted, first_edit = {}, {}
+    handlers = []
+
+    async def answer(update_id, update):
+        init_msg = await update.message.reply_text("Đang suy nghĩ...")
+
+        def hook(stage, seconds):
+            if stage == "first_edit":
+                first_edit[update_id] = time.monotonic()
+
+        await StreamResponder(update, init_msg, timing_hook=hook).stream(fake_model())
+
+    async def dispatch(data):
+        if not answer_updates:
+            return
+        # Like the application's update queue: handlers run in the background.
+        update = make_update(bot, chat_id=chat_id_of(data), text=data["message"]["text"])
+        handlers.append(asyncio.create_task(
+            request_queue.run(update.effective_chat.id, lambda: answer(data["update_id"], update))))
+
+    server = TestServer(create_web_app(SECRET, dispatch))
+    await server.start_server()
+    semaphore = asyncio.Semaphore(concurrency)
+    try:
+        async with ClientSession() as session:
+            async def post(update_id):
+                if rate is not None:
+                    await asyncio.sleep(update_id / rate)
+                async with semaphore:
+                    posted[update_id] = time.monotonic()
+                    async with session.post(server.make_url(WEBHOOK_PATH),
+                                            data=json.dumps(synthetic_update(update_id, update_id % chats)),
+                                            headers={SECRET_HEADER: SECRET, "Content-Type": "application/json"}) as r:
+                        assert r.status == 200
+
+            started = time.monotonic()
+            await asyncio.gather(*(post(update_id) for update_id in range(updates)))
+            accepted = updates / (time.monotonic() - started)
+            await asyncio.gather(*handlers)
+    finally:
+        await server.close()
+    return accepted, [first_edit[update_id] - posted[update_id] for update_id in first_edit]
+
+
+def test_webhook_accepts_bursts():
+    accepted, _ = asyncio.run(load(updates=2000, chats=100, answer_updates=False))
+    print(f"\n{accepted:.0f} updates/s accepted")
+    assert accepted > 200
+
+
+def test_time_to_first_edit_at_a_steady_rate():
+    # 10 updates/s stays under the global edit rate, so the replies keep up.
+    accepted, latencies = asyncio.run(load(updates=200, chats=50, rate=10))
+    p50 = statistics.median(latencies)
+    p99 = statistics.quantiles(latencies, n=100)[98]
+    print(f"\ntime to first edit at 10 updates/s over 50 chats: p50 {p50 * 1000:.0f}ms p99 {p99 * 1000:.0f}ms")
+    assert len(latencies) == 200
+    assert p99 < 2
@@ -0,0 +1,5 @@
+import os
+
+# The modules read their settings at import time; tests never talk to the real services.
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "123456:test-token")
+os.environ.setdefault("GOOGLE_API_KEY", "test-key")
@@ -0,0 +1,56 @@
+"""Markdown shaped like Gemini replies, shared by the formatter tests and benchmarks."""
+import random
+
+SAMPLES = [
+    "",
+    "Xin chào! Tôi có thể giúp gì cho bạn?",
+    "# Tiêu đề\n## Mục con\nNội dung **đậm**, *nghiêng*, __gạch dưới__ và ~~gạch ngang~~.",
+    "* Mục một\n* Mục **hai**\n  * Mục con với `code`\n*không phải bullet*",
+    "Xem [tài liệu](https://example.com/docs?a=1&b=\"2\") hoặc [link **đậm**](https://example.com).",
+    "So sánh: 1 < 2 && 3 > 2, <b>không phải thẻ</b> & &amp; giữ nguyên.",
+    "Ví dụ:\n```python\ndef add(a, b):\n    return a + b  # **không** định dạng\n```\nXong.",
+    "```\nkhối không ngôn ngữ\n```\n```js\nconsole.log('<tag>');\n```",
+    "Khối chưa đóng:\n```c++\nint main() {\n    return 0;",
+    "Dấu lẻ: **mở không đóng, *nghiêng **đậm* chéo**, `code không đóng",
+    "***đậm nghiêng*** và **_hỗn hợp_** cùng ``hai backtick`` và `a`b`",
+    "Inline ```không phải khối``` trên một dòng, rồi `code` sau đó.",
+    "[link hỏng](không đóng và [lồng [nhau]](https://x.y)",
+    "\n\n# \n*\n**\n`\n```\n",
+]
+
+# Tokens the random generator is built from, weighted toward the ones the
+# lexer treats specially.
+TOKENS = [
+    "chữ", "text", " ", " ", " ", "\n", "\n", "*", "**", "***", "_", "__", "~~", "`", "``", "```",
+    "```python\n", "```\n", "# ", "## ", "* ", "  * ", "[", "]", "(", ")", "[a](https://b.c)",
+    "<", ">", "&", "&amp;", '"', "👉", "tiếng Việt",
+]
+
+
+def random_markdown(rng: random.Random, tokens: int) -> str:
+    return "".join(rng.choice(TOKENS) for _ in range(tokens))
+
+
+def random_chunks(rng: random.Random, text: str, max_size: int = 12) -> list:
+    """Cut ``text`` into pieces of random size, like a model stream."""
+    chunks = []
+    pos = 0
+    while pos < len(text):
+        size = rng.randint(1, max_size)
+        chunks.append(text[pos:pos + size])
+        pos += size
+    return chunks
+
+
+def model_reply(paragraphs: int, code_every: int = 0) -> str:
+    """A long, realistic reply; every ``code_every``-th paragraph is a code block."""
+    parts = []
+    for i in range(paragraphs):
+        if code_every and i % code_every == code_every - 1:
+            parts.append(f"```python\ndef step_{i}(x):\n    # *không* định dạng\n    return x * {i}\n```\n")
+        elif i % 5 == 0:
+            parts.append(f"## Phần {i}\n")
+        else:
+            parts.append(f"* Ý **{i}**: dùng `value_{i}` với *tham số* và [nguồn](https://example.com/{i}) "
+                         f"khi a < b && c > d.\n")
+    return "".join(parts)
@@ -0,0 +1,162 @@
+"""In-process stand-ins for the Telegram Bot API, shared by the tests and the benchmark harness."""
+import asyncio
+import itertools
+import math
+import time
+from collections import deque
+from types import SimpleNamespace
+from telegram.error import BadRequest, RetryAfter
+
+TELEGRAM_MSG_CHAR_LIMIT = 4096
+
+
+class FakeBot:
+    """Records every Bot API call and enforces Telegram-like flood limits.
+
+    Calls that go over ``chat_limit`` per chat or ``global_limit`` overall
+    within ``window`` seconds raise ``RetryAfter``, like Telegram's flood
+    control. Errors queued with ``inject`` are raised by the next calls.
+    Editing a message to its current text raises "Message is not modified"
+    and texts over 4096 characters raise "Message is too long".
+
+    Args:
+        chat_limit (int): Calls allowed per chat within ``window``, or None.
+        global_limit (int): Calls allowed overall within ``window``, or None.
+        window (float): Length of the flood control window in seconds.
+        latency (float): Seconds every call takes.
+    """
+
+    def __init__(self, chat_limit=None, global_limit=None, window=1.0, latency=0.0):
+        self.chat_limit = chat_limit
+        self.global_limit = global_limit
+        self.window = window
+        self.latency = latency
+        self.calls = []
+        self.flood_errors = 0
+        self.messages = {}
+        self._errors = deque()
+        self._recent = deque()
+        self._ids = itertools.count(1)
+
+    def inject(self, *errors):
+        self._errors.extend(errors)
+
+    def count(self, method=None, chat_id=None):
+        return sum(1 for call in self.calls
+                   if (method is None or call.method == method) and (chat_id is None or call.chat_id == chat_id))
+
+    def incoming(self, chat_id, **fields):
+        """Create a message sent by a user, without counting it as a call."""
+        message = FakeMessage(self, chat_id, next(self._ids), **fields)
+        self.messages[(chat_id, message.message_id)] = message
+        return message
+
+    async def send_message(self, chat_id, text, parse_mode=None, reply_to_message_id=None):
+        await self._call("send_message", chat_id, text)
+        return self.incoming(chat_id, text=text, parse_mode=parse_mode, from_bot=True)
+
+    async def edit_message_text(self, chat_id, message_id, text, parse_mode=None):
+        message = self.messages[(chat_id, message_id)]
+        if (text, parse_mode) == (message.text, message.parse_mode):
+            raise BadRequest("Message is not modified: specified new message content and reply markup are "
+                             "exactly the same as a current content and reply markup of the message")
+        await self._call("edit_message_text", chat_id, text, message_id)
+        message.text, message.parse_mode = text, parse_mode
+        return message
+
+    async def delete_message(self, chat_id, message_id):
+        await self._call("delete_message", chat_id, None, message_id)
+        self.messages.pop((chat_id, message_id)).deleted = True
+        return True
+
+    async def _call(self, method, chat_id, text, message_id=None):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self._errors:
+            raise self._errors.popleft()
+        if text is not None and len(text) > TELEGRAM_MSG_CHAR_LIMIT:
+            raise BadRequest("Message is too long")
+        self._flood_control(chat_id)
+        self.calls.append(SimpleNamespace(method=method, chat_id=chat_id, message_id=message_id, text=text,
+                                          time=time.monotonic()))
+
+    def _flood_control(self, chat_id):
+        now = time.monotonic()
+        while self._recent and self._recent[0][0] <= now - self.window:
+            self._recent.popleft()
+        in_chat = [sent for sent, chat in self._recent if chat == chat_id]
+        for limit, sent in ((self.chat_limit, in_chat), (self.global_limit, [sent for sent, _ in self._recent])):
+            if limit is not None and len(sent) >= limit:
+                self.flood_errors += 1
+                raise RetryAfter(max(1, math.ceil(sent[-limit] + self.window - now)))
+        self._recent.append((now, chat_id))
+
+
+class FakeMessage:
+    def __init__(self, bot, chat_id, message_id, text=None, parse_mode=None, from_bot=False, photo=(),
+                 caption=None, media_group_id=None, document=None):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.message_id = message_id
+        self.text = text
+        self.parse_mode = parse_mode
+        self.from_bot = from_bot
+        self.photo = list(photo)
+        self.caption = caption
+        self.media_group_id = media_group_id
+        self.document = document
+        self.deleted = False
+
+    async def reply_text(self, text, parse_mode=None, reply_to_message_id=None, **kwargs):
+        return await self.bot.send_message(self.chat_id, text, parse_mode=parse_mode,
+                                           reply_to_message_id=reply_to_message_id)
+
+    async def edit_text(self, text, parse_mode=None, **kwargs):
+        return await self.bot.edit_message_text(self.chat_id, self.message_id, text, parse_mode=parse_mode)
+
+    async def delete(self):
+        return await self.bot.delete_message(self.chat_id, self.message_id)
+
+
+class FakeFile:
+    def __init__(self, data):
+        self.data = data
+        self.file_size = len(data)
+        self.downloads = 0
+
+    async def download_as_bytearray(self):
+        self.downloads += 1
+        return bytearray(self.data)
+
+    async def download_to_memory(self, out):
+        self.downloads += 1
+        out.write(self.data)
+
+    async def download_to_drive(self, path):
+        self.downloads += 1
+        with open(path, "wb") as file:
+            file.write(self.data)
+
+
+class FakeFileRef:
+    """A PhotoSize or Document: ``get_file`` returns the same FakeFile every time."""
+
+    def __init__(self, data, file_unique_id, width=0, height=0, file_name=None):
+        self.file = FakeFile(data)
+        self.file_unique_id = file_unique_id
+        self.file_size = len(data)
+        self.width = width
+        self.height = height
+        self.file_name = file_name
+
+    async def get_file(self):
+        return self.file
+
+
+def make_update(bot, chat_id=1, user_id=None, username="tester", chat_type="private", **message_fields):
+    """Build an Update carrying a new user message in ``chat_id``."""
+    return SimpleNamespace(
+        message=bot.incoming(chat_id, **message_fields),
+        effective_user=SimpleNamespace(id=user_id if user_id is not None else chat_id, username=username),
+        effective_chat=SimpleNamespace(id=chat_id, type=chat_type),
+    )
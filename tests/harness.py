@@ -0,0 +1,286 @@
+"""End-to-end load harness: the real handlers against a fake Telegram and a fake Gemini.
+
+Runs a scenario of mixed text, photo and PDF requests through
+telegram_handler, with tests.fakes.FakeBot standing in for the Bot API
+(recording every call and enforcing flood limits) and FakeGemini replaying
+chunk traces with their original timings on the stream worker threads.
+Photos are really preprocessed and PDFs really extracted, so CPU per reply
+covers the bot's own work. Results are written as JSON so runs can be
+compared::
+
+    python -m tests.harness --requests 200 --concurrency 16 --mix text=7,image=2,pdf=1 --output run.json
+
+A trace is a list of ``[seconds since the previous chunk, text]`` pairs. A
+traces file maps "text", "image" and "pdf" to lists of traces; kinds it
+leaves out use synthetic traces. ``record_trace`` turns a real Gemini
+stream into a trace.
+"""
+import argparse
+import asyncio
+import json
+import math
+import random
+import statistics
+import sys
+import tempfile
+import time
+from contextlib import ExitStack
+from unittest import mock
+import gemini_handler
+import stream_responder
+import telegram_handler
+from conversation_manager import ConversationManager, MemoryConversationStore
+from edit_scheduler import EditScheduler
+from file_cache import FileCache
+from gemini_resilience import ResilientStreamer
+from media_group import MediaGroupCollector
+from request_queue import RequestQueue
+from tests.corpus import model_reply, random_chunks
+from tests.fakes import FakeBot, FakeFileRef, make_update
+from tests.images import make_photo
+from tests.pdfs import make_pdf
+
+KINDS = ("text", "image", "pdf")
+# Typical time to first token in seconds and reply length in paragraphs.
+FIRST_TOKEN = {"text": 0.8, "image": 1.5, "pdf": 2.5}
+PARAGRAPHS = {"text": (3, 15), "image": (4, 12), "pdf": (8, 25)}
+HANDLERS = {
+    "text": telegram_handler.handle_message,
+    "image": telegram_handler.handle_image,
+    "pdf": telegram_handler.handle_document,
+}
+
+
+def synthetic_trace(rng, kind):
+    """A reply of ``kind`` cut into stream chunks with realistic gaps."""
+    text = model_reply(rng.randint(*PARAGRAPHS[kind]), code_every=rng.choice([0, 4]))
+    first = rng.lognormvariate(math.log(FIRST_TOKEN[kind]), 0.4)
+    return [[first if i == 0 else rng.uniform(0.02, 0.12), chunk]
+            for i, chunk in enumerate(random_chunks(rng, text, max_size=120))]
+
+
+def record_trace(chunks):
+    """Consume a real stream of text chunks and return it as a trace."""
+    trace = []
+    last = time.monotonic()
+    for chunk in chunks:
+        now = time.monotonic()
+        trace.append([now - last, chunk])
+        last = now
+    return trace
+
+
+class FakeGemini:
+    """Stands in for the blocking Gemini calls of gemini_handler.
+
+    Every call replays a trace of its kind, sleeping between chunks like
+    the SDK iterator blocks on the network.
+
+    Args:
+        traces (dict): Lists of traces by kind.
+        seed (int): Seed for picking traces.
+        speed (float): Factor applied to every delay.
+    """
+
+    def __init__(self, traces, seed=0, speed=1.0):
+        self.traces = traces
+        self.rng = random.Random(seed)
+        self.speed = speed
+
+    def play(self, kind):
+        for delay, text in self.rng.choice(self.traces[kind]):
+            time.sleep(delay * self.speed)
+            yield text
+
+    def generate_text(self, prompt, system_instruction, history, model_name=None, profile=None):
+        return self.play("text")
+
+    def analyze_image(self, image, prompt, model_name=None, profile=None):
+        return self.play("image")
+
+    def analyze_pdf_text(self, text, prompt, model=None, profile=None):
+        return self.play("pdf")
+
+
+def load_traces(path=None, seed=0, per_kind=20):
+    """Traces from ``path``, completed with synthetic ones for missing kinds."""
+    traces = {}
+    if path:
+        with open(path, encoding="utf-8") as file:
+            traces = json.load(file)
+    rng = random.Random(seed)
+    for kind in KINDS:
+        if not traces.get(kind):
+            traces[kind] = [synthetic_trace(rng, kind) for _ in range(per_kind)]
+    return traces
+
+
+def percentiles(values):
+    """p50/p95/p99 and mean of ``values`` in milliseconds."""
+    if not values:
+        return None
+    ms = sorted(value * 1000 for value in values)
+    cuts = statistics.quantiles(ms, n=100, method="inclusive") if len(ms) > 1 else ms * 99
+    return {"p50": round(cuts[49], 1), "p95": round(cuts[94], 1), "p99": round(cuts[98], 1),
+            "mean": round(statistics.fmean(ms), 1)}
+
+
+def summarize(replies):
+    return {
+        "replies": len(replies),
+        "errors": sum(reply["error"] for reply in replies),
+        "latency_ms": percentiles([reply["seconds"] for reply in replies]),
+        "first_text_ms": percentiles([reply["first_text"] for reply in replies if reply["first_text"] is not None]),
+        "telegram_calls_per_reply": round(statistics.fmean(reply["calls"] for reply in replies), 2),
+        "edits_per_reply": round(statistics.fmean(reply["edits"] for reply in replies), 2),
+    }
+
+
+class Scenario:
+    """Mixed traffic sent by ``concurrency`` users, each waiting for its reply before the next.
+
+    Users wait ``think_time`` seconds after a reply before sending again;
+    the per-chat edit rate makes a message sent right after the previous
+    reply wait for the chat's edit budget to refill.
+
+    Args:
+        requests (int): Requests sent in total.
+        concurrency (int): Users sending at the same time, each in its own chat.
+        mix (dict): Relative weight of each kind of request.
+        traces (dict): Chunk traces by kind, see load_traces.
+        speed (float): Factor applied to the fake Gemini and Bot API delays.
+        think_time (float): Seconds a user waits between a reply and its next message.
+        bot_latency (float): Seconds every Bot API call takes.
+        chat_limit (int): Bot API calls allowed per chat per second.
+        global_limit (int): Bot API calls allowed per second overall.
+        seed (int): Seed for the request mix and the traces picked.
+    """
+
+    def __init__(self, requests=100, concurrency=8, mix=None, traces=None, speed=1.0, think_time=1.0,
+                 bot_latency=0.05, chat_limit=5, global_limit=30, seed=0):
+        self.requests = requests
+        self.concurrency = concurrency
+        self.mix = mix or {"text": 7, "image": 2, "pdf": 1}
+        self.traces = traces or load_traces(seed=seed)
+        self.speed = speed
+        self.think_time = think_time
+        self.bot_latency = bot_latency
+        self.chat_limit = chat_limit
+        self.global_limit = global_limit
+        self.seed = seed
+        self.bot = None
+
+    def run(self):
+        """Run the scenario and return its report as a dict."""
+        rng = random.Random(self.seed)
+        kinds = rng.choices(list(self.mix), weights=list(self.mix.values()), k=self.requests)
+        # Inputs are generated up front so their cost is not counted.
+        photo = make_photo(1280, 960)
+        pdf = make_pdf(4, lines_per_page=30)
+        gemini = FakeGemini(self.traces, self.seed, self.speed)
+        with tempfile.TemporaryDirectory() as cache_dir, ExitStack() as stack:
+            for target, name, value in [
+                (telegram_handler, "is_user_allowed", lambda username: True),
+                (telegram_handler, "conversation_manager", ConversationManager(MemoryConversationStore())),
+                (telegram_handler, "file_cache", FileCache(cache_dir)),
+                (telegram_handler, "request_queue", RequestQueue(max_waiting=self.requests)),
+                (telegram_handler, "media_groups", MediaGroupCollector()),
+                (stream_responder, "edit_scheduler", EditScheduler()),
+                (gemini_handler, "resilience", ResilientStreamer()),
+                (gemini_handler, "generate_text", gemini.generate_text),
+                (gemini_handler, "analyze_image", gemini.analyze_image),
+                (gemini_handler, "analyze_pdf_text", gemini.analyze_pdf_text),
+            ]:
+                stack.enter_context(mock.patch.object(target, name, value))
+            self.bot = FakeBot(chat_limit=self.chat_limit, global_limit=self.global_limit,
+                               latency=self.bot_latency * self.speed)
+            cpu = time.process_time()
+            started = time.monotonic()
+            replies = asyncio.run(self._send(kinds, photo, pdf))
+            wall = time.monotonic() - started
+            cpu = time.process_time() - cpu
+
+        report = {
+            "scenario": {"requests": self.requests, "concurrency": self.concurrency, "mix": self.mix,
+                         "speed": self.speed, "think_time": self.think_time, "bot_latency": self.bot_latency, "chat_limit": self.chat_limit,
+                         "global_limit": self.global_limit, "seed": self.seed},
+            "wall_seconds": round(wall, 3),
+            "replies_per_second": round(len(replies) / wall, 2),
+            "cpu_per_reply_ms": round(cpu / len(replies) * 1000, 2),
+            "flood_errors": self.bot.flood_errors,
+            **summarize(replies),
+            "by_kind": {kind: summarize([reply for reply in replies if reply["kind"] == kind])
+                        for kind in self.mix if kind in kinds},
+        }
+        return report
+
+    async def _send(self, kinds, photo, pdf):
+        requests = iter(enumerate(kinds))
+        replies = []
+
+        async def user(chat_id):
+            for index, kind in requests:
+                replies.append(await self._request(chat_id, index, kind, photo, pdf))
+                await asyncio.sleep(self.think_time)
+
+        await asyncio.gather(*(user(chat_id) for chat_id in range(1, self.concurrency + 1)))
+        return replies
+
+    async def _request(self, chat_id, index, kind, photo, pdf):
+        if kind == "text":
+            fields = {"text": f"Câu hỏi số {index}"}
+        elif kind == "image":
+            fields = {"photo": [FakeFileRef(photo, f"photo-{index}", width=1280, height=960)]}
+        else:
+            fields = {"document": FakeFileRef(pdf, f"pdf-{index}", file_name=f"tài liệu {index}.pdf")}
+        update = make_update(self.bot, chat_id=chat_id, **fields)
+        started = time.monotonic()
+        await HANDLERS[kind](update, None)
+        finished = time.monotonic()
+
+        calls = [call for call in self.bot.calls if call.chat_id == chat_id and started <= call.time <= finished]
+        edits = [call for call in calls if call.method == "edit_message_text"]
+        # Placeholders and status updates start with "Đang ...".
+        first_text = next((call.time - started for call in edits if not call.text.startswith("Đang")), None)
+        error = any(call.method == "send_message" and "lỗi" in call.text for call in calls)
+        return {"kind": kind, "seconds": finished - started, "first_text": first_text, "calls": len(calls),
+                "edits": len(edits), "error": error}
+
+
+def parse_mix(value):
+    mix = {}
+    for part in value.split(","):
+        kind, _, weight = part.partition("=")
+        if kind not in KINDS:
+            raise argparse.ArgumentTypeError(f"Unknown request kind: {kind}")
+        mix[kind] = float(weight or 1)
+    return mix
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--mix", type=parse_mix, default="text=7,image=2,pdf=1")
+    parser.add_argument("--traces", help="JSON file of recorded chunk traces")
+    parser.add_argument("--speed", type=float, default=1.0, help="factor applied to the simulated delays")
+    parser.add_argument("--think-time", type=float, default=1.0)
+    parser.add_argument("--bot-latency", type=float, default=0.05)
+    parser.add_argument("--chat-limit", type=int, default=5)
+    parser.add_argument("--global-limit", type=int, default=30)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the report here instead of stdout")
+    args = parser.parse_args(argv)
+
+    scenario = Scenario(args.requests, args.concurrency, args.mix, load_traces(args.traces, args.seed),
+                        args.speed, args.think_time, args.bot_latency, args.chat_limit, args.global_limit, args.seed)
+    report = json.dumps(scenario.run(), ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            file.write(report + "\n")
+    else:
+        sys.stdout.write(report + "\n")
+
+
+if __name__ == "__main__":
+    main()
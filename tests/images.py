@@ -0,0 +1,19 @@
+"""Generate photo-like test images."""
+from io import BytesIO
+
+
+def make_photo(width, height, orientation=None, quality=95):
+    """Return JPEG bytes of a noisy gradient, roughly as hard to compress as a photo.
+
+    With ``orientation`` the image carries that EXIF orientation tag.
+    """
+    from PIL import Image, ImageFilter
+    gradient = Image.linear_gradient("L").resize((width, height))
+    noise = Image.effect_noise((width, height), 64).filter(ImageFilter.GaussianBlur(1))
+    image = Image.merge("RGB", (gradient, noise, gradient.transpose(Image.Transpose.FLIP_LEFT_RIGHT)))
+    exif = Image.Exif()
+    if orientation is not None:
+        exif[0x0112] = orientation
+    output = BytesIO()
+    image.save(output, format="JPEG", quality=quality, exif=exif)
+    return output.getvalue()
@@ -0,0 +1,39 @@
+"""Generate text PDFs of any length without a PDF library."""
+
+
+def make_pdf(pages, lines_per_page=40, line="Line {line} of page {page}: the quick brown fox jumps over the lazy dog."):
+    """Return the bytes of a PDF with ``pages`` pages of Helvetica text.
+
+    A page with no lines (``lines_per_page=0``) has no text layer, like a
+    scanned page.
+    """
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        None,  # The page tree, filled in once the page objects are numbered
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    kids = []
+    for page in range(1, pages + 1):
+        commands = ["BT", "/F1 10 Tf", "12 TL", "40 800 Td"]
+        for number in range(1, lines_per_page + 1):
+            commands.append(f"({line.format(line=number, page=page)}) Tj T*")
+        commands.append("ET")
+        stream = "\n".join(commands).encode("latin-1")
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream))
+        objects.append(b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+                       b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % (len(objects)))
+        kids.append(len(objects))
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (
+        b" ".join(b"%d 0 R" % kid for kid in kids), pages)
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n%s\nendobj\n" % (number, body)
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    for offset in offsets:
+        out += b"%010d 00000 n \n" % offset
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    return bytes(out)
@@ -0,0 +1,127 @@
+import asyncio
+import os
+from types import SimpleNamespace
+import pytest
+import gemini_handler
+import config_service as config_service_module
+from config import CHAT_PROFILES
+from config_service import ConfigService
+from gemini_resilience import ResilientStreamer
+
+
+@pytest.fixture(autouse=True)
+def clean_process_env(monkeypatch):
+    # Settings from the environment the tests run in must not leak in.
+    monkeypatch.setattr(config_service_module, "PROCESS_ENV", {})
+
+
+def write_env(path, text):
+    path.write_text(text, encoding="utf-8")
+    # Make sure the change is seen even on coarse file system timestamps.
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+
+@pytest.fixture
+def service(tmp_path):
+    def make(env_text):
+        env = tmp_path / ".env"
+        write_env(env, env_text)
+        instruction = tmp_path / "system_instruction.txt"
+        instruction.write_text("Bạn là trợ lý.", encoding="utf-8")
+        return ConfigService(env, instruction, check_interval=0), env
+    return make
+
+
+@pytest.mark.parametrize("value", ["", ",", " , "])
+def test_empty_allow_list_denies_everyone(service, value):
+    config, _ = service(f"ALLOWED_USERS={value}\n")
+    assert not config.is_user_allowed("alice")
+    assert not config.is_user_allowed(None)
+
+
+def test_unset_allow_list_denies_everyone(service):
+    config, _ = service("PRIVATE_TOP_K=20\n")
+    assert not config.is_user_allowed("alice")
+
+
+def test_star_allows_everyone(service):
+    config, _ = service("ALLOWED_USERS=*\n")
+    assert config.is_user_allowed("alice")
+    assert config.is_user_allowed(None)
+
+
+def test_allow_list_is_reloaded(service):
+    config, env = service("ALLOWED_USERS=alice, bob\n")
+    assert config.is_user_allowed("bob") and not config.is_user_allowed("carol")
+    write_env(env, "ALLOWED_USERS=carol\n")
+    assert config.is_user_allowed("carol") and not config.is_user_allowed("bob")
+    assert config.reloads == 1
+
+
+def test_removed_env_file_keeps_the_previous_settings(service):
+    config, env = service("ALLOWED_USERS=alice\nGROUP_MAX_TOKENS=512\n")
+    env.unlink()
+    assert config.is_user_allowed("alice")
+    assert not config.is_user_allowed("bob")
+    assert config.profile("group").max_tokens == 512
+    assert config.reloads == 0
+
+    # The file coming back is read again.
+    write_env(env, "ALLOWED_USERS=bob\n")
+    assert config.is_user_allowed("bob") and not config.is_user_allowed("alice")
+    assert config.profile("group").max_tokens == CHAT_PROFILES["group"]["max_tokens"]
+
+
+def test_invalid_setting_keeps_the_current_value(service):
+    config, env = service("ALLOWED_USERS=alice\nGROUP_MAX_TOKENS=512\nGROUP_TEMPERATURE=0.3\n")
+    write_env(env, "ALLOWED_USERS=alice\nGROUP_MAX_TOKENS=lots\nGROUP_TEMPERATURE=0.6\n")
+    profile = config.profile("group")
+    assert profile.max_tokens == 512
+    assert profile.temperature == 0.6
+
+
+def test_invalid_setting_at_startup_uses_the_default(service):
+    config, _ = service("PRIVATE_TOP_K=many\n")
+    assert config.profile("private").top_k == CHAT_PROFILES["private"]["top_k"]
+
+
+class RecordingModel:
+    def __init__(self, name, requests):
+        self.name = name
+        self.requests = requests
+
+    def generate_content(self, contents, generation_config=None, **kwargs):
+        self.requests.append((self.name, generation_config))
+        return iter([SimpleNamespace(text="trả lời")])
+
+
+def test_reloaded_profile_applies_to_pdf_and_image_replies(service, monkeypatch):
+    requests = []
+    genai = SimpleNamespace(types=SimpleNamespace(GenerationConfig=lambda **settings: settings))
+    monkeypatch.setattr(gemini_handler, "get_genai", lambda: genai)
+    monkeypatch.setattr(gemini_handler, "get_text_model",
+                        lambda system_instruction, model_name=None: RecordingModel(model_name, requests))
+    monkeypatch.setattr(gemini_handler, "get_vision_model", lambda model_name=None: RecordingModel(model_name, requests))
+    monkeypatch.setattr(gemini_handler, "resilience", ResilientStreamer())
+    monkeypatch.setattr(gemini_handler, "CONTEXT_CACHE_ENABLED", False)
+
+    async def ask(profile):
+        async for _ in gemini_handler.analyze_pdf_async("Nội dung PDF.", "Tóm tắt", profile=profile):
+            pass
+        async for _ in gemini_handler.analyze_image_async({"mime_type": "image/jpeg", "data": b""}, "Mô tả",
+                                                          profile=profile):
+            pass
+
+    config, env = service("GROUP_MODEL_NAME=group-model\nGROUP_MAX_TOKENS=300\n")
+    asyncio.run(ask(config.profile("group")))
+    write_env(env, "GROUP_MODEL_NAME=group-model-2\nGROUP_MAX_TOKENS=600\nGROUP_TEMPERATURE=0.1\n")
+    asyncio.run(ask(config.profile("supergroup")))
+
+    (pdf, pdf_settings), (image, image_settings), (pdf_2, pdf_settings_2), (_, image_settings_2) = requests
+    assert (pdf, pdf_2) == ("group-model", "group-model-2")
+    # Photos keep the vision model but take the profile's settings.
+    assert image == gemini_handler.VISION_MODEL_NAME
+    assert pdf_settings["max_output_tokens"] == image_settings["max_output_tokens"] == 300
+    assert pdf_settings_2 == image_settings_2
+    assert (pdf_settings_2["max_output_tokens"], pdf_settings_2["temperature"]) == (600, 0.1)
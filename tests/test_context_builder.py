@@ -0,0 +1,114 @@
+import random
+import pytest
+from context_builder import ContextBuilder, estimate_tokens
+
+
+def random_history(rng, turns):
+    history = []
+    for _ in range(turns):
+        # Mostly alternating, with the odd repeated role so the history may
+        # start on a model turn after trimming.
+        role = "user" if not history or history[-1]["role"] == "model" else "model"
+        if rng.random() < 0.2:
+            role = rng.choice(["user", "model"])
+        history.append({"role": role, "content": "x" * rng.randint(0, 2000)})
+    return history
+
+
+def tokens(builder, contents):
+    return sum(builder.count(content["parts"][0]["text"]) for content in contents)
+
+
+@pytest.mark.parametrize("summarizing", [False, True])
+def test_budget_is_never_exceeded(summarizing):
+    rng = random.Random(7)
+
+    def summarize(previous, messages):
+        # Sometimes longer than the space set aside, which must drop it.
+        return "s" * rng.choice([10, 200, 5000])
+
+    built = 0
+    for _ in range(2000):
+        budget = rng.randint(50, 3000)
+        builder = ContextBuilder(budget=budget, summarize=summarize if summarizing else None,
+                                 summary_tokens=rng.randint(20, 300), cache_size=16)
+        history = random_history(rng, rng.randint(0, 30))
+        prompt = "p" * rng.randint(1, 400)
+        reserved = rng.randint(0, 200)
+        needed = reserved + builder.count(prompt) + (builder.summary_tokens if summarizing else 0)
+        if needed > budget:
+            continue
+
+        contents = builder.build(history, prompt, reserved_tokens=reserved)
+        built += 1
+        assert reserved + tokens(builder, contents) <= budget
+        assert contents[0]["role"] == "user"
+        assert contents[-1] == {"role": "user", "parts": [{"text": prompt}]}
+    assert built > 1000
+
+
+def history_ending_in(*roles):
+    return [{"role": role, "content": f"{role} {i} " + "x" * 90} for i, role in enumerate(roles)]
+
+
+def test_trimmed_history_starts_on_a_user_turn():
+    history = history_ending_in("user", "model", "user", "model", "model", "user", "model")
+    builder = ContextBuilder(budget=10_000)
+    # Room for exactly four messages: the oldest of them is a model turn.
+    budget = builder.count("câu hỏi") + 4 * builder.count(history[-1]["content"])
+    builder = ContextBuilder(budget=budget)
+
+    contents = builder.build(history, "câu hỏi")
+    assert [c["role"] for c in contents] == ["user", "model", "user"]
+    assert contents[0]["parts"][0]["text"] == history[5]["content"]
+    assert tokens(builder, contents) <= budget
+
+
+def test_summary_of_the_dropped_turns_fits_the_budget():
+    history = history_ending_in("user", "model", "user", "model", "model", "user", "model")
+    dropped = []
+
+    def summarize(previous, messages):
+        dropped.extend(messages)
+        return "tóm tắt"
+
+    builder = ContextBuilder(budget=10_000)
+    summary_tokens = 30
+    budget = builder.count("câu hỏi") + 4 * builder.count(history[-1]["content"]) + summary_tokens
+    builder = ContextBuilder(budget=budget, summarize=summarize, summary_tokens=summary_tokens)
+
+    contents = builder.build(history, "câu hỏi")
+    # The model turn skipped to start on a user turn goes into the summary.
+    assert dropped == history[:5]
+    assert [c["role"] for c in contents] == ["user", "model", "user", "model", "user"]
+    assert contents[0]["parts"][0]["text"].endswith("tóm tắt")
+    assert tokens(builder, contents) <= budget
+
+    # A summary too long for its share of the budget is left out.
+    builder = ContextBuilder(budget=budget, summarize=lambda previous, messages: "s" * 5000,
+                             summary_tokens=summary_tokens)
+    contents = builder.build(history, "câu hỏi")
+    assert [c["role"] for c in contents] == ["user", "model", "user"]
+    assert tokens(builder, contents) <= budget
+
+
+def test_summary_is_only_requested_for_newly_dropped_turns():
+    requests = []
+
+    def summarize(previous, messages):
+        requests.append((previous, len(messages)))
+        return f"{previous or ''}+{len(messages)}"
+
+    builder = ContextBuilder(budget=200, summarize=summarize, summary_tokens=50)
+    history = []
+    for i in range(10):
+        history += [{"role": "user", "content": "u" * 200}, {"role": "model", "content": "m" * 200}]
+        builder.build(history, "câu hỏi")
+    # Every request continues the previous summary with only the new turns.
+    assert all(count == 2 for _, count in requests[1:])
+    assert requests[-1][0] is not None
+
+
+def test_estimate_tokens():
+    assert estimate_tokens("") == 0
+    assert estimate_tokens("abcd") >= 1
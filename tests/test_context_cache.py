@@ -0,0 +1,126 @@
+import asyncio
+from types import SimpleNamespace
+import gemini_handler
+from context_builder import estimate_tokens
+from context_cache import ContextCache
+
+
+def text_tokens(contents):
+    if isinstance(contents, str):
+        return estimate_tokens(contents)
+    return sum(estimate_tokens(part["text"]) for content in contents for part in content["parts"])
+
+
+class FakeModel:
+    def __init__(self, sent):
+        self.sent = sent
+
+    def generate_content(self, contents, **kwargs):
+        self.sent.append(text_tokens(contents))
+        if kwargs.get("stream"):
+            return iter([SimpleNamespace(text="trả lời")])
+        return SimpleNamespace(text="tóm tắt")
+
+
+class FakeCacheClient:
+    """Records every payload the cache uploads to Gemini."""
+
+    def __init__(self, sent, fail=False):
+        self.sent = sent
+        self.fail = fail
+        self.created = self.refreshed = self.deleted = 0
+
+    def create(self, model_name, system_instruction, contents, ttl):
+        if self.fail:
+            raise RuntimeError("quota")
+        self.created += 1
+        self.sent.append(text_tokens(contents) + estimate_tokens(system_instruction or ""))
+        return object()
+
+    def refresh(self, handle, ttl):
+        self.refreshed += 1
+
+    def delete(self, handle):
+        self.deleted += 1
+
+    def model_for(self, handle):
+        return FakeModel(self.sent)
+
+
+def prefix(text):
+    return [{"role": "user", "parts": [{"text": text}]}]
+
+
+def test_small_prefixes_are_not_cached():
+    client = FakeCacheClient([])
+    cache = ContextCache(client, min_tokens=100)
+    assert cache.get_model("m", "si", prefix("ngắn"), 10) is None
+    assert client.created == 0
+
+
+def test_prefix_is_uploaded_once_and_reused():
+    client = FakeCacheClient([])
+    cache = ContextCache(client, min_tokens=100)
+    first = cache.get_model("m", "si", prefix("x" * 600), 200)
+    assert cache.get_model("m", "si", prefix("x" * 600), 200) is first
+    assert (client.created, cache.hits, cache.misses, cache.tokens_reused) == (1, 1, 1, 200)
+    # A different model or prefix is a different cache entry.
+    assert cache.get_model("other", "si", prefix("x" * 600), 200) is not first
+    assert client.created == 2
+
+
+def test_least_recently_used_entries_are_deleted():
+    client = FakeCacheClient([])
+    cache = ContextCache(client, min_tokens=0, max_entries=2)
+    for text in ("a", "b", "a", "c"):
+        cache.get_model("m", None, prefix(text), 1)
+    assert client.deleted == 1
+    # "b" was evicted, "a" is still cached.
+    cache.get_model("m", None, prefix("a"), 1)
+    assert client.created == 3
+
+
+def test_failed_upload_sends_the_prefix_in_full():
+    cache = ContextCache(FakeCacheClient([], fail=True), min_tokens=0)
+    assert cache.get_model("m", None, prefix("a"), 1) is None
+
+
+def ask(questions, text):
+    async def main():
+        for question in questions:
+            async for _ in gemini_handler.analyze_pdf_async(text, question):
+                pass
+
+    asyncio.run(main())
+
+
+def test_cached_pdf_resends_fewer_tokens(monkeypatch):
+    # A document read in map-reduce mode, well over Gemini's caching minimum.
+    text = ("Doanh thu quý ba tăng mười hai phần trăm so với cùng kỳ. " * 2500)[:gemini_handler.PDF_MAP_REDUCE_MAX_CHARS]
+    questions = ["Tóm tắt tài liệu", "Doanh thu tăng bao nhiêu?", "Có rủi ro nào không?"]
+    monkeypatch.setattr(gemini_handler, "PDF_MAP_REDUCE", True)
+    genai = SimpleNamespace(types=SimpleNamespace(GenerationConfig=lambda **settings: settings))
+    monkeypatch.setattr(gemini_handler, "get_genai", lambda: genai)
+
+    uncached = []
+    monkeypatch.setattr(gemini_handler, "get_text_model", lambda *args: FakeModel(uncached))
+    monkeypatch.setattr(gemini_handler, "CONTEXT_CACHE_ENABLED", False)
+    gemini_handler._chunk_summaries.clear()
+    ask(questions, text)
+
+    cached = []
+    client = FakeCacheClient(cached)
+    monkeypatch.setattr(gemini_handler, "get_text_model", lambda *args: FakeModel(cached))
+    monkeypatch.setattr(gemini_handler, "CONTEXT_CACHE_ENABLED", True)
+    monkeypatch.setattr(gemini_handler, "context_cache", ContextCache(client))
+    ask(questions, text)
+
+    print(f"\ntokens sent: {sum(uncached)} without the cache, {sum(cached)} with it")
+    assert client.created == 1
+    # The document is uploaded once; every question then sends only itself.
+    assert cached[0] >= estimate_tokens(text)
+    assert all(tokens < 50 for tokens in cached[1:])
+    assert len(cached) == 1 + len(questions)
+    assert sum(cached) < sum(uncached)
+    # Map-reduce re-sends every summary with each question.
+    assert sum(cached[1:]) < sum(uncached[-len(questions):])
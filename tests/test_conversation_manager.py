@@ -0,0 +1,127 @@
+import asyncio
+import time
+import pytest
+from conversation_manager import (ConversationManager, MemoryConversationStore, SQLiteConversationStore,
+                                  SharedSQLiteConversationStore)
+
+
+def message(i):
+    return {"role": "user", "content": f"tin nhắn {i}"}
+
+
+def test_memory_store_bounds_users_and_messages():
+    store = MemoryConversationStore(max_users=3, max_messages=4)
+    for user_id in range(5):
+        for i in range(10):
+            store.append(user_id, message(i))
+    assert list(store._conversations) == [2, 3, 4]
+    assert store.get(4) == [message(i) for i in range(6, 10)]
+    # Evicted users start over.
+    assert store.get(0) == []
+
+
+def test_sqlite_store_survives_a_restart(tmp_path):
+    path = tmp_path / "conversations.db"
+    store = SQLiteConversationStore(path, max_messages=4, flush_interval=0.01)
+    for i in range(6):
+        store.append(1, message(i))
+    store.append(2, message(0))
+    store.clear(2)
+    store.close()
+
+    store = SQLiteConversationStore(path, max_messages=4, flush_interval=0.01)
+    try:
+        assert store.get(1) == [message(i) for i in range(2, 6)]
+        assert store.get(2) == []
+    finally:
+        store.close()
+
+
+def test_evicted_user_waits_only_for_their_own_writes(tmp_path):
+    store = SQLiteConversationStore(tmp_path / "conversations.db", max_users=1, flush_interval=0.2)
+    try:
+        store.append(1, message(0))
+        time.sleep(0.3)
+        # User 1's message is on disk; user 2's write sits in the next batch.
+        store.append(2, message(0))
+        started = time.monotonic()
+        assert store.get(1) == [message(0)]
+        assert time.monotonic() - started < 0.1
+        # Evicting user 2 before the batch commits must not lose the message.
+        assert store.get(2) == [message(0)]
+    finally:
+        store.close()
+
+
+def test_history_is_loaded_without_blocking_the_event_loop(tmp_path, monkeypatch):
+    store = SQLiteConversationStore(tmp_path / "conversations.db", flush_interval=0.01)
+    load = store._load
+
+    def slow_load(user_id):
+        time.sleep(0.1)
+        return load(user_id)
+
+    monkeypatch.setattr(store, "_load", slow_load)
+    conversations = ConversationManager(store)
+
+    async def main():
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                ticks += 1
+                await asyncio.sleep(0.01)
+
+        task = asyncio.create_task(ticker())
+        await conversations.add_message_async(1, "user", "xin chào")
+        history = await conversations.get_history_async(1)
+        task.cancel()
+        return history, ticks
+
+    try:
+        history, ticks = asyncio.run(main())
+    finally:
+        conversations.close()
+    assert history == [{"role": "user", "content": "xin chào"}]
+    assert ticks >= 5
+
+
+def test_settings_outlive_the_history():
+    store = MemoryConversationStore(max_users=1)
+    manager = ConversationManager(store)
+
+    async def main():
+        await manager.set_setting_async(1, "nocache", "1")
+        await manager.add_message_async(1, "user", "a")
+        await manager.clear_history_async(1)
+        # Evicts user 1 from the cache of histories.
+        await manager.add_message_async(2, "user", "b")
+        kept = await manager.get_setting_async(1, "nocache")
+        await manager.set_setting_async(1, "nocache", None)
+        return kept, await manager.get_setting_async(1, "nocache")
+
+    assert asyncio.run(main()) == ("1", None)
+
+
+@pytest.mark.parametrize("store_class", [SQLiteConversationStore, SharedSQLiteConversationStore])
+def test_settings_survive_a_restart(tmp_path, store_class):
+    path = tmp_path / "conversations.db"
+    store = store_class(path)
+    store.set_setting(1, "nocache", "1")
+    store.set_setting(2, "nocache", "1")
+    store.set_setting(2, "nocache", None)
+    store.close()
+
+    store = store_class(path)
+    assert (store.get_setting(1, "nocache"), store.get_setting(2, "nocache")) == ("1", None)
+    store.close()
+
+
+def test_shared_store_settings_are_seen_by_every_worker(tmp_path):
+    path = tmp_path / "conversations.db"
+    workers = [SharedSQLiteConversationStore(path) for _ in range(2)]
+    asyncio.run(workers[0].set_setting_async(7, "nocache", "1"))
+    assert asyncio.run(workers[1].get_setting_async(7, "nocache")) == "1"
+    for store in workers:
+        store.close()
@@ -0,0 +1,85 @@
+import asyncio
+import os
+import tempfile
+import pytest
+import telegram_handler
+from file_cache import FileCache
+from tests.fakes import FakeBot, FakeFileRef, make_update
+from tests.pdfs import make_pdf
+
+
+@pytest.fixture
+def temp_dir(tmp_path, monkeypatch):
+    directory = tmp_path / "tmp"
+    directory.mkdir()
+    monkeypatch.setattr(tempfile, "tempdir", str(directory))
+    return directory
+
+
+def document(number, size_pages=1):
+    return FakeFileRef(make_pdf(size_pages, lines_per_page=1, line=f"Document {number}"), f"doc-{number}",
+                       file_name=f"tài liệu {number}.pdf")
+
+
+def test_concurrent_downloads_never_share_a_file(temp_dir, monkeypatch):
+    # Every other document is over the memory limit and goes to disk.
+    monkeypatch.setattr(telegram_handler, "DOCUMENT_MEMORY_MAX_BYTES", 1000)
+    documents = [document(i, size_pages=1 + 10 * (i % 2)) for i in range(8)]
+    paths = []
+
+    async def read(doc):
+        async with telegram_handler.download_document(doc) as source:
+            if isinstance(source, str):
+                paths.append(source)
+                await asyncio.sleep(0.01)
+                with open(source, "rb") as file:
+                    return file.read()
+            await asyncio.sleep(0.01)
+            return source
+
+    async def main():
+        return await asyncio.gather(*(read(doc) for doc in documents))
+
+    contents = asyncio.run(main())
+    assert contents == [doc.file.data for doc in documents]
+    assert len(paths) == len(set(paths)) == 4
+    assert not os.listdir(temp_dir)
+
+
+def test_temporary_file_is_removed_when_processing_fails(temp_dir, monkeypatch):
+    monkeypatch.setattr(telegram_handler, "DOCUMENT_MEMORY_MAX_BYTES", 0)
+
+    async def main():
+        async with telegram_handler.download_document(document(1)) as source:
+            assert os.path.exists(source)
+            raise ValueError("hỏng")
+
+    with pytest.raises(ValueError):
+        asyncio.run(main())
+    assert not os.listdir(temp_dir)
+
+
+def test_simultaneous_uploads_from_one_user(tmp_path, temp_dir, monkeypatch):
+    monkeypatch.setattr(telegram_handler, "DOCUMENT_MEMORY_MAX_BYTES", 1000)
+    monkeypatch.setattr(telegram_handler, "file_cache", FileCache(str(tmp_path / "cache")))
+
+    async def fake_analyze(text, prompt, on_progress=None, profile=None):
+        await asyncio.sleep(0.01)
+        yield f"{prompt}: {text.strip()}"
+
+    monkeypatch.setattr(telegram_handler, "analyze_pdf_async", fake_analyze)
+
+    async def main():
+        bot = FakeBot()
+        # The same user sends PDFs from several chats at once, so nothing
+        # serializes them.
+        updates = [make_update(bot, chat_id=100 + i, user_id=7, document=document(i, size_pages=1 + 10 * (i % 2)),
+                               caption=f"Câu hỏi {i}") for i in range(6)]
+        await asyncio.gather(*(telegram_handler.answer_document(update) for update in updates))
+        return bot
+
+    bot = asyncio.run(main())
+    replies = {chat_id: message.text for (chat_id, _), message in bot.messages.items() if message.from_bot}
+    assert replies == {100 + i: f"Câu hỏi {i}: Document {i}" + f"\nDocument {i}" * (10 * (i % 2))
+                       for i in range(6)}
+    assert not os.listdir(temp_dir)
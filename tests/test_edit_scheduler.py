@@ -0,0 +1,113 @@
+import asyncio
+import datetime
+import time
+import pytest
+from telegram.error import RetryAfter, TimedOut
+from edit_scheduler import EditScheduler
+from tests.fakes import FakeBot
+
+
+async def placeholder(bot, chat_id=1):
+    return await bot.incoming(chat_id).reply_text("...")
+
+
+def test_coalesces_edits_and_delivers_the_final_text():
+    async def main():
+        bot = FakeBot()
+        scheduler = EditScheduler(chat_rate=20, chat_burst=1)
+        message = await placeholder(bot)
+        for i in range(50):
+            await scheduler.update(message, f"text {i}")
+            await asyncio.sleep(0.001)
+        await scheduler.flush(message)
+        return bot, scheduler, message
+
+    bot, scheduler, message = asyncio.run(main())
+    assert message.text == "text 49"
+    stats = scheduler.stats()
+    assert stats["requested"] == 50
+    assert stats["sent"] == bot.count("edit_message_text") < 10
+    assert stats["saved"] == 50 - stats["sent"]
+
+
+def test_skips_edits_that_do_not_change_the_text():
+    async def main():
+        bot = FakeBot()
+        scheduler = EditScheduler(chat_rate=100, chat_burst=5)
+        message = await placeholder(bot)
+        await scheduler.flush(message, "same")
+        await scheduler.flush(message, "same")
+        return bot, scheduler
+
+    bot, scheduler = asyncio.run(main())
+    assert bot.count("edit_message_text") == 1
+    assert scheduler.stats()["skipped_unchanged"] == 1
+
+
+def test_retry_after_pauses_the_chat_and_still_delivers():
+    async def main():
+        bot = FakeBot()
+        scheduler = EditScheduler(chat_rate=100, chat_burst=5)
+        message = await placeholder(bot)
+        bot.inject(RetryAfter(datetime.timedelta(seconds=0.2)), RetryAfter(datetime.timedelta(seconds=0.1)))
+        started = time.monotonic()
+        await scheduler.update(message, "first")
+        await asyncio.sleep(0.05)
+        await scheduler.flush(message, "final")
+        return bot, scheduler, message, time.monotonic() - started
+
+    bot, scheduler, message, elapsed = asyncio.run(main())
+    assert message.text == "final"
+    assert scheduler.stats()["retries"] == 2
+    assert elapsed >= 0.3
+
+
+def test_timeouts_are_retried_then_raised_by_flush():
+    async def main():
+        bot = FakeBot()
+        scheduler = EditScheduler(chat_rate=100, chat_burst=5, max_retries=3)
+        message = await placeholder(bot)
+        bot.inject(TimedOut(), TimedOut())
+        await scheduler.flush(message, "after two timeouts")
+        bot.inject(TimedOut(), TimedOut(), TimedOut())
+        with pytest.raises(TimedOut):
+            await scheduler.flush(message, "never delivered")
+        return message
+
+    assert asyncio.run(main()).text == "after two timeouts"
+
+
+def test_rates_stay_under_telegram_flood_limits():
+    async def main():
+        # Telegram-like limits scaled up 10x so the test runs quickly.
+        bot = FakeBot(chat_limit=10, global_limit=30, window=1.0)
+        scheduler = EditScheduler(chat_rate=8, chat_burst=2, global_rate=25, global_burst=5)
+        messages = [await placeholder(bot, chat_id) for chat_id in range(6)]
+        bot.calls.clear()
+
+        async def stream(message):
+            for i in range(40):
+                await scheduler.update(message, f"{message.chat_id}: {i}")
+                await asyncio.sleep(0.01)
+            await scheduler.flush(message, f"{message.chat_id}: done")
+
+        await asyncio.gather(*(stream(message) for message in messages))
+        return bot, messages
+
+    bot, messages = asyncio.run(main())
+    assert bot.flood_errors == 0
+    assert all(message.text == f"{message.chat_id}: done" for message in messages)
+
+
+def test_idle_chat_buckets_are_swept():
+    async def main():
+        bot = FakeBot()
+        scheduler = EditScheduler(chat_rate=100, chat_burst=1)
+        for chat_id in range(1, 201):
+            await scheduler.flush(await placeholder(bot, chat_id), f"chat {chat_id}")
+            await asyncio.sleep(0.005)
+        return scheduler
+
+    scheduler = asyncio.run(main())
+    # Finished chats are dropped as their buckets refill instead of piling up.
+    assert len(scheduler._chat_buckets) < 100
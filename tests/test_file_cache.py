@@ -0,0 +1,110 @@
+import asyncio
+import os
+import pytest
+import telegram_handler
+from conversation_manager import ConversationManager, MemoryConversationStore
+from file_cache import FileCache
+from tests.fakes import FakeBot, FakeFileRef, make_update
+from tests.images import make_photo
+from tests.pdfs import make_pdf
+
+
+def age(cache, key, seconds_ago):
+    """Make an entry look last used ``seconds_ago``, as if time had passed."""
+    path = os.path.join(cache.directory, cache._name(key))
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns - int(seconds_ago * 1e9)))
+
+
+def test_least_recently_used_entries_are_evicted_by_size(tmp_path):
+    cache = FileCache(tmp_path, max_bytes=30)
+    for seconds_ago, key in ((30, "a"), (20, "b"), (10, "c")):
+        cache.put(key, key.encode() * 10)
+        age(cache, key, seconds_ago)
+    assert cache.get("a") == b"a" * 10
+    cache.put("d", b"d" * 10)
+    assert cache.get("b") is None
+    assert [cache.get(key) is not None for key in "acd"] == [True, True, True]
+    assert cache.stats()["bytes"] == 30
+    assert len(os.listdir(tmp_path)) == 3
+
+
+def test_entries_larger_than_the_cache_are_not_stored(tmp_path):
+    cache = FileCache(tmp_path, max_bytes=10)
+    cache.put("big", b"x" * 11)
+    assert cache.get("big") is None
+    assert os.listdir(tmp_path) == []
+
+
+def test_hits_and_misses_are_counted(tmp_path):
+    cache = FileCache(tmp_path, max_bytes=100)
+    assert cache.get_text("văn bản") is None
+    cache.put_text("văn bản", "nội dung")
+    assert cache.get_text("văn bản") == "nội dung"
+    assert cache.get_text("văn bản") == "nội dung"
+    assert cache.stats() == {"hits": 2, "misses": 1, "entries": 1, "bytes": len("nội dung".encode())}
+
+
+def test_index_is_rebuilt_from_disk_after_a_restart(tmp_path):
+    cache = FileCache(tmp_path, max_bytes=30)
+    for seconds_ago, key in ((30, "a"), (20, "b"), (10, "c")):
+        cache.put(key, key.encode() * 10)
+        age(cache, key, seconds_ago)
+
+    restarted = FileCache(tmp_path, max_bytes=30)
+    assert restarted.stats() == {"hits": 0, "misses": 0, "entries": 3, "bytes": 30}
+    # The oldest entry on disk is the first to go.
+    restarted.put("d", b"d" * 10)
+    assert restarted.get("a") is None
+    assert restarted.get("b") == b"b" * 10
+
+
+def test_workers_sharing_the_directory_respect_one_limit(tmp_path):
+    workers = [FileCache(tmp_path, max_bytes=100) for _ in range(4)]
+    for i in range(40):
+        workers[i % 4].put(f"entry {i}", b"x" * 10)
+        assert sum(entry.stat().st_size for entry in os.scandir(tmp_path)) <= 100
+    # An entry written by one worker is found by the others.
+    assert workers[1].get("entry 39") == b"x" * 10
+
+
+@pytest.fixture
+def handler_cache(tmp_path, monkeypatch):
+    cache = FileCache(tmp_path / "cache")
+    monkeypatch.setattr(telegram_handler, "file_cache", cache)
+    monkeypatch.setattr(telegram_handler, "conversation_manager", ConversationManager(MemoryConversationStore()))
+    return cache
+
+
+def test_cached_photo_is_not_downloaded_again(handler_cache):
+    photo = FakeFileRef(make_photo(1600, 1200), "photo-1", width=1600, height=1200)
+
+    async def main():
+        first = await telegram_handler.load_photo([photo])
+        second = await telegram_handler.load_photo([photo])
+        return first, second
+
+    first, second = asyncio.run(main())
+    assert first == second
+    assert photo.file.downloads == 1
+    assert handler_cache.stats()["hits"] == 1
+
+
+def test_cached_pdf_text_is_not_downloaded_again(handler_cache, monkeypatch):
+    prompts = []
+
+    async def analyze_pdf_async(text, prompt, on_progress=None, profile=None):
+        prompts.append(text)
+        yield "tóm tắt"
+
+    monkeypatch.setattr(telegram_handler, "analyze_pdf_async", analyze_pdf_async)
+    document = FakeFileRef(make_pdf(2, lines_per_page=3), "pdf-1", file_name="báo cáo.pdf")
+
+    async def main():
+        bot = FakeBot()
+        for _ in range(2):
+            await telegram_handler.answer_document(make_update(bot, document=document))
+
+    asyncio.run(main())
+    assert document.file.downloads == 1
+    assert len(prompts) == 2 and prompts[0] == prompts[1] and "Line 1 of page 1" in prompts[0]
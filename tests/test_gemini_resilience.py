@@ -0,0 +1,226 @@
+import asyncio
+import threading
+import time
+import pytest
+from gemini_resilience import (CircuitOpen, HedgeLimiter, ResilientStreamer, RetryBudget, StreamStalled,
+                               is_retryable)
+from utils import iterate_in_thread
+
+
+class ServiceUnavailable(Exception):
+    code = 503
+
+
+class FakeModel:
+    """A model whose streams fail, stall or answer late as scripted.
+
+    ``script`` lists what each call does, the last entry repeating: an
+    exception to raise before the first chunk, or a delay in seconds
+    before the first chunk. ``stall_after`` makes the stream hang after
+    that many chunks.
+    """
+
+    def __init__(self, name, *script, chunks=3, stall_after=None):
+        self.name = name
+        self.script = list(script) or [0.0]
+        self.chunks = chunks
+        self.stall_after = stall_after
+        self.calls = 0
+        self.closed = 0
+
+    def candidate(self):
+        return self.name, self.stream
+
+    async def stream(self):
+        step = self.script[min(self.calls, len(self.script) - 1)]
+        self.calls += 1
+        try:
+            if isinstance(step, Exception):
+                raise step
+            await asyncio.sleep(step)
+            for i in range(self.chunks):
+                if i == self.stall_after:
+                    await asyncio.sleep(3600)
+                yield f"{self.name} {i} "
+        finally:
+            self.closed += 1
+
+
+def streamer(**kwargs):
+    settings = dict(max_retries=2, base_delay=0.01, max_delay=0.02, first_token_timeout=0.1, stall_timeout=0.5)
+    settings.update(kwargs)
+    return ResilientStreamer(**settings)
+
+
+async def collect(stream):
+    return "".join([chunk async for chunk in stream])
+
+
+def run(stream):
+    return asyncio.run(collect(stream))
+
+
+def test_transient_errors_are_retried():
+    model = FakeModel("primary", ServiceUnavailable(), ServiceUnavailable(), 0.0)
+    resilience = streamer()
+    assert run(resilience.stream(model.candidate())) == "primary 0 primary 1 primary 2 "
+    assert (model.calls, resilience.retries) == (3, 2)
+
+
+def test_other_errors_are_not_retried():
+    model = FakeModel("primary", ValueError("bad request"))
+    resilience = streamer()
+    with pytest.raises(ValueError):
+        run(resilience.stream(model.candidate()))
+    assert (model.calls, resilience.retries) == (1, 0)
+
+
+def test_errors_move_the_request_to_the_fallback():
+    primary = FakeModel("primary", ServiceUnavailable())
+    fallback = FakeModel("fallback")
+    resilience = streamer()
+    assert run(resilience.stream(primary.candidate(), fallback.candidate())).startswith("fallback")
+    assert (resilience.fallbacks, resilience.hedges) == (1, 0)
+
+
+def test_slow_primary_is_hedged_and_the_loser_closed():
+    primary = FakeModel("primary", 1.0)
+    fallback = FakeModel("fallback")
+    resilience = streamer()
+    started = time.monotonic()
+    assert run(resilience.stream(primary.candidate(), fallback.candidate())).startswith("fallback")
+    assert time.monotonic() - started < 0.5
+    assert resilience.hedges == 1
+    assert primary.closed == 1
+
+
+def test_hedges_are_capped_per_window():
+    primary = FakeModel("primary", 0.3)
+    fallback = FakeModel("fallback")
+    resilience = streamer(hedge_limiter=HedgeLimiter(max_hedges=2, window=60))
+
+    async def main():
+        return await asyncio.gather(*(collect(resilience.stream(primary.candidate(), fallback.candidate()))
+                                      for _ in range(5)))
+
+    replies = asyncio.run(main())
+    assert sum(reply.startswith("fallback") for reply in replies) == 2
+    assert sum(reply.startswith("primary") for reply in replies) == 3
+    assert (resilience.hedges, resilience.hedges_skipped, fallback.calls) == (2, 3, 2)
+
+
+def test_stalled_stream_raises():
+    model = FakeModel("primary", stall_after=1)
+    resilience = streamer(stall_timeout=0.1)
+
+    async def main():
+        chunks = []
+        with pytest.raises(StreamStalled):
+            async for chunk in resilience.stream(model.candidate()):
+                chunks.append(chunk)
+        return chunks
+
+    assert asyncio.run(main()) == ["primary 0 "]
+
+
+def test_circuit_opens_after_repeated_failures():
+    model = FakeModel("primary", ServiceUnavailable())
+    resilience = streamer(max_retries=0)
+    resilience.breaker("primary").failures = 3
+    for _ in range(3):
+        with pytest.raises(ServiceUnavailable):
+            run(resilience.stream(model.candidate()))
+    with pytest.raises(CircuitOpen):
+        run(resilience.stream(model.candidate()))
+    assert model.calls == 3
+
+
+def open_circuit(resilience, model_name):
+    breaker = resilience.breaker(model_name)
+    breaker.failures, breaker.reset_timeout = 1, 0
+    breaker.record_failure()
+    return breaker
+
+
+def test_trial_is_not_claimed_by_a_fallback_that_is_not_needed():
+    primary = FakeModel("primary")
+    fallback = FakeModel("fallback")
+    resilience = streamer()
+    breaker = open_circuit(resilience, "fallback")
+    assert run(resilience.stream(primary.candidate(), fallback.candidate())).startswith("primary")
+    assert fallback.calls == 0
+    assert breaker.open and breaker.available()
+
+    # The trial is still there for a request that needs the fallback.
+    primary.script = [ServiceUnavailable()]
+    assert run(resilience.stream(primary.candidate(), fallback.candidate())).startswith("fallback")
+    assert not breaker.open
+
+
+def test_trial_is_released_when_it_loses_a_hedge():
+    primary = FakeModel("primary", 1.0)
+    fallback = FakeModel("fallback")
+    resilience = streamer()
+    breaker = open_circuit(resilience, "primary")
+    assert run(resilience.stream(primary.candidate(), fallback.candidate())).startswith("fallback")
+    assert primary.closed == 1
+    assert breaker.open and breaker.available()
+
+    primary.script = [0.0]
+    assert run(resilience.stream(primary.candidate(), fallback.candidate())).startswith("primary")
+    assert not breaker.open
+
+
+def test_trial_is_released_when_the_reader_stops_early():
+    model = FakeModel("primary")
+    resilience = streamer()
+    breaker = open_circuit(resilience, "primary")
+
+    async def main():
+        stream = resilience.stream(model.candidate())
+        await anext(stream)
+        await stream.aclose()
+
+    asyncio.run(main())
+    assert breaker.available()
+
+
+def test_retry_budget_limits_retries():
+    budget = RetryBudget(ratio=0.0, window=60, min_retries=2)
+    assert [budget.try_retry() for _ in range(3)] == [True, True, False]
+
+
+def test_is_retryable_follows_the_cause():
+    try:
+        try:
+            raise ServiceUnavailable()
+        except ServiceUnavailable as e:
+            raise RuntimeError("wrapped") from e
+    except RuntimeError as e:
+        assert is_retryable(e)
+    assert not is_retryable(ValueError())
+
+
+def test_spare_streams_run_while_the_primary_pool_is_busy():
+    release = threading.Event()
+
+    def blocked():
+        release.wait(5)
+        yield "late"
+
+    async def main():
+        # Fill every primary thread with streams stuck on a slow read.
+        from utils import _stream_executor
+        stuck = [iterate_in_thread(blocked) for _ in range(_stream_executor._max_workers)]
+        pending = [asyncio.ensure_future(anext(stream)) for stream in stuck]
+        await asyncio.sleep(0.05)
+        try:
+            spare = await asyncio.wait_for(collect(iterate_in_thread(lambda: iter(["hedge"]), spare=True)), 1)
+        finally:
+            release.set()
+            await asyncio.gather(*pending)
+            for stream in stuck:
+                await stream.aclose()
+        return spare
+
+    assert asyncio.run(main()) == "hedge"
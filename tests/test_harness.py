@@ -0,0 +1,39 @@
+import json
+import random
+from tests.harness import FakeGemini, Scenario, load_traces, main, percentiles, record_trace, synthetic_trace
+
+
+def test_synthetic_traces_replay_the_reply():
+    trace = synthetic_trace(random.Random(1), "text")
+    assert trace[0][0] > 0 and all(0.02 <= delay <= 0.12 for delay, _ in trace[1:])
+    gemini = FakeGemini({"text": [trace]}, speed=0)
+    assert record_trace(gemini.generate_text("câu hỏi", None, []))[-1][1] == trace[-1][1]
+    assert "".join(gemini.generate_text("câu hỏi", None, [])) == "".join(text for _, text in trace)
+
+
+def test_percentiles():
+    assert percentiles([0.001 * i for i in range(1, 101)])["p50"] == 50.5
+    assert percentiles([0.2]) == {"p50": 200.0, "p95": 200.0, "p99": 200.0, "mean": 200.0}
+    assert percentiles([]) is None
+
+
+def test_mixed_scenario_reports_every_reply():
+    report = Scenario(requests=12, concurrency=4, mix={"text": 2, "image": 1, "pdf": 1},
+                      traces=load_traces(per_kind=3), speed=0.05, think_time=0).run()
+    assert report["replies"] == 12 and report["errors"] == 0
+    assert set(report["by_kind"]) == {"text", "image", "pdf"}
+    assert report["latency_ms"]["p50"] <= report["latency_ms"]["p99"]
+    # Every reply sends at least its placeholder and one edit.
+    assert report["telegram_calls_per_reply"] >= 2
+    assert report["cpu_per_reply_ms"] > 0
+
+
+def test_cli_writes_json(tmp_path):
+    traces = tmp_path / "traces.json"
+    traces.write_text(json.dumps({"text": [[[0.01, "Xin "], [0.01, "chào"]]]}), encoding="utf-8")
+    output = tmp_path / "run.json"
+    main(["--requests", "3", "--concurrency", "3", "--mix", "text", "--traces", str(traces),
+          "--speed", "0.1", "--think-time", "0", "--output", str(output)])
+    report = json.loads(output.read_text(encoding="utf-8"))
+    assert report["scenario"]["mix"] == {"text": 1.0}
+    assert report["replies"] == 3
@@ -0,0 +1,98 @@
+import random
+import re
+import pytest
+from html_format import StreamingFormatter, format_message, split_html, split_markdown
+from tests.corpus import SAMPLES, model_reply, random_chunks, random_markdown
+
+TAG_PATTERN = re.compile(r"<(/?)(\w+)[^>]*>")
+
+
+def stream(text, chunks):
+    formatter = StreamingFormatter()
+    fed = ""
+    for chunk in chunks:
+        fed += chunk
+        yield fed, formatter.feed(chunk)
+
+
+@pytest.mark.parametrize("text", SAMPLES + [model_reply(40, code_every=4)])
+def test_streaming_matches_format_message_on_samples(text):
+    rng = random.Random(text)
+    for max_size in (1, 7, 200):
+        for fed, html in stream(text, random_chunks(rng, text, max_size)):
+            assert html == format_message(fed)
+
+
+def test_streaming_matches_format_message_on_random_corpus():
+    rng = random.Random(20)
+    for _ in range(2000):
+        text = random_markdown(rng, rng.randint(1, 60))
+        for fed, html in stream(text, random_chunks(rng, text)):
+            assert html == format_message(fed), repr(fed)
+
+
+def test_reset_forgets_previous_text():
+    formatter = StreamingFormatter()
+    formatter.feed("```python\nprint(1)\n")
+    formatter.reset()
+    assert formatter.feed("**đậm**") == format_message("**đậm**")
+    assert formatter.text == "<b>đậm</b>"
+
+
+def assert_balanced(html):
+    stack = []
+    for closing, tag in TAG_PATTERN.findall(html):
+        if closing:
+            assert stack and stack.pop() == tag, html
+        else:
+            stack.append(tag)
+    assert not stack, html
+
+
+def test_format_message_emits_balanced_tags():
+    rng = random.Random(3)
+    for text in SAMPLES + [random_markdown(rng, rng.randint(1, 80)) for _ in range(3000)]:
+        assert_balanced(format_message(text))
+
+
+def visible(html):
+    return "".join(TAG_PATTERN.sub("", html).split())
+
+
+@pytest.mark.parametrize("limit", [120, 300, 4096])
+def test_split_html_parts_fit_and_keep_the_text(limit):
+    rng = random.Random(limit)
+    for text in SAMPLES + [model_reply(30, code_every=3)] + [random_markdown(rng, rng.randint(1, 80)) for _ in range(300)]:
+        html = format_message(text)
+        parts = split_html(html, limit)
+        for part in parts:
+            assert len(part) <= limit
+            assert_balanced(part)
+        assert visible("".join(parts)) == visible(html)
+
+
+def test_split_html_reopens_tags_in_the_next_part():
+    html = format_message("**" + "từ " * 30 + "**\n" + "dòng hai " * 5)
+    parts = split_html(html, 60)
+    assert parts[0].startswith("<b>") and parts[0].endswith("</b>")
+    # The bold text goes on in the next part.
+    assert parts[1].startswith("<b>")
+    assert all(len(part) <= 60 for part in parts)
+
+
+def test_split_markdown_head_fits_the_limit():
+    rng = random.Random(22)
+    for _ in range(300):
+        code_every = rng.choice([0, 2])
+        text = model_reply(rng.randint(3, 12), code_every=code_every)
+        limit = rng.randint(100, 1000)
+        if len(format_message(text)) <= limit:
+            continue
+        head, tail = split_markdown(text, limit)
+        assert head.strip() and tail
+        assert len(format_message(head)) <= limit
+        assert_balanced(format_message(head))
+        assert_balanced(format_message(tail))
+        if head + tail != text:
+            # Only a code block open at the cut is closed and reopened.
+            assert code_every and head.endswith("```") and tail.startswith("```")
@@ -0,0 +1,39 @@
+from io import BytesIO
+from types import SimpleNamespace
+import pytest
+from PIL import Image
+from image_preprocessor import choose_photo_size, preprocess_image
+from tests.images import make_photo
+
+
+def open_blob(blob):
+    return Image.open(BytesIO(blob["data"]))
+
+
+@pytest.mark.parametrize("image_format", ["JPEG", "WEBP", "PNG"])
+def test_downscales_and_reencodes(image_format):
+    blob = preprocess_image(make_photo(1600, 900), max_side=800, image_format=image_format)
+    assert blob["mime_type"] == f"image/{image_format.lower()}"
+    with open_blob(blob) as image:
+        assert image.format == image_format
+        assert image.size == (800, 450)
+
+
+def test_applies_the_exif_orientation_and_drops_metadata():
+    # Orientation 6: the camera was rotated, the image must be turned upright.
+    blob = preprocess_image(make_photo(1600, 900, orientation=6), max_side=800)
+    with open_blob(blob) as image:
+        assert image.size == (450, 800)
+        assert not image.getexif()
+
+
+def test_small_images_are_not_enlarged():
+    with open_blob(preprocess_image(make_photo(300, 200), max_side=800)) as image:
+        assert image.size == (300, 200)
+
+
+def test_choose_photo_size():
+    sizes = [SimpleNamespace(width=side, height=side * 3 // 4) for side in (90, 320, 800, 1280, 2560)]
+    assert choose_photo_size(sizes, max_side=1024).width == 1280
+    assert choose_photo_size(sizes, max_side=800).width == 800
+    assert choose_photo_size(sizes, max_side=4000).width == 2560
@@ -0,0 +1,68 @@
+import asyncio
+import pytest
+import telegram_handler
+from conversation_manager import ConversationManager, MemoryConversationStore
+from file_cache import FileCache
+from media_group import MediaGroupCollector
+from tests.fakes import FakeBot, FakeFileRef, make_update
+from tests.images import make_photo
+
+
+@pytest.fixture
+def handler(tmp_path, monkeypatch):
+    calls = []
+
+    async def fake_analyze(image, prompt, profile=None):
+        calls.append((image, prompt))
+        yield "Một album ảnh."
+
+    monkeypatch.setattr(telegram_handler, "is_user_allowed", lambda username: True)
+    monkeypatch.setattr(telegram_handler, "analyze_image_async", fake_analyze)
+    monkeypatch.setattr(telegram_handler, "media_groups", MediaGroupCollector(wait=0.05, max_wait=1.0))
+    monkeypatch.setattr(telegram_handler, "file_cache", FileCache(str(tmp_path / "cache")))
+    monkeypatch.setattr(telegram_handler, "conversation_manager", ConversationManager(MemoryConversationStore()))
+    return calls
+
+
+def photo_update(bot, number, **fields):
+    photo = FakeFileRef(make_photo(64, 48), f"photo-{number}", width=64, height=48)
+    return make_update(bot, chat_id=5, user_id=7, photo=[photo], **fields)
+
+
+def test_album_is_answered_once(handler):
+    async def main():
+        bot = FakeBot()
+        updates = [photo_update(bot, i, media_group_id="album", caption="So sánh các ảnh" if i == 1 else None)
+                   for i in range(3)]
+
+        async def deliver(update, delay):
+            await asyncio.sleep(delay)
+            await telegram_handler.handle_image(update, None)
+
+        # Telegram delivers the photos of an album as separate updates.
+        await asyncio.gather(*(deliver(update, 0.01 * i) for i, update in enumerate(updates)))
+        return bot
+
+    bot = asyncio.run(main())
+    assert len(handler) == 1
+    images, prompt = handler[0]
+    assert len(images) == 3 and prompt == "So sánh các ảnh"
+    assert bot.count("send_message") == 1
+    assert telegram_handler.conversation_manager.get_history(7) == [
+        {"role": "user", "content": "Đã gửi 3 hình ảnh với prompt: So sánh các ảnh"},
+        {"role": "model", "content": "Một album ảnh."},
+    ]
+
+
+def test_single_photo_is_not_batched(handler):
+    async def main():
+        bot = FakeBot()
+        await telegram_handler.handle_image(photo_update(bot, 1), None)
+        return bot
+
+    bot = asyncio.run(main())
+    assert len(handler) == 1
+    image, prompt = handler[0]
+    assert image["mime_type"] == "image/jpeg"
+    assert prompt == "Phân tích hình ảnh này và tạo phản hồi"
+    assert bot.count("send_message") == 1
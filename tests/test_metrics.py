@@ -0,0 +1,65 @@
+import math
+import pytest
+from metrics import Registry
+
+
+def test_counter_and_gauge():
+    registry = Registry()
+    requests = registry.counter("requests_total", "Requests", ["handler"])
+    active = registry.gauge("active", "Active streams")
+    requests.inc(handler="text")
+    requests.inc(2, handler='say "hi"\n')
+    active.inc()
+    active.inc()
+    active.dec()
+    assert registry.render() == (
+        "# HELP requests_total Requests\n"
+        "# TYPE requests_total counter\n"
+        'requests_total{handler="text"} 1\n'
+        'requests_total{handler="say \\"hi\\"\\n"} 2\n'
+        "# HELP active Active streams\n"
+        "# TYPE active gauge\n"
+        "active 1\n"
+    )
+
+
+def test_histogram_buckets_are_cumulative():
+    registry = Registry()
+    latency = registry.histogram("latency_seconds", "Latency", buckets=(0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 2.0):
+        latency.observe(value)
+    lines = registry.render().splitlines()
+    assert lines[2:] == [
+        'latency_seconds_bucket{le="0.1"} 2',
+        'latency_seconds_bucket{le="1.0"} 3',
+        'latency_seconds_bucket{le="+Inf"} 4',
+        "latency_seconds_sum 2.65",
+        "latency_seconds_count 4",
+    ]
+
+
+def test_histogram_time_observes_the_block():
+    registry = Registry()
+    latency = registry.histogram("latency_seconds", "Latency", ["stage"])
+    with latency.time(stage="format"):
+        pass
+    assert 'latency_seconds_count{stage="format"} 1' in registry.render()
+
+
+def test_callback_is_read_at_render_time():
+    registry = Registry()
+    value = [1]
+    registry.callback("queue_size", "Queue size", lambda: value[0])
+    value[0] = math.inf
+    assert registry.render().endswith("queue_size +Inf\n")
+
+
+def test_misuse_raises():
+    registry = Registry()
+    counter = registry.counter("requests_total", "Requests", ["handler"])
+    with pytest.raises(ValueError):
+        registry.gauge("requests_total", "Again")
+    with pytest.raises(ValueError):
+        counter.inc()
+    with pytest.raises(ValueError):
+        counter.inc(handler="text", chat="1")
@@ -0,0 +1,64 @@
+import os
+import tempfile
+import pdfplumber
+import pytest
+import pdf_extractor
+from pdf_extractor import extract_pdf_text, iter_pdf_pages
+from tests.pdfs import make_pdf
+
+
+def legacy_extract(source, max_chars):
+    """Extraction before pages were read incrementally: every page, then truncate."""
+    with pdfplumber.open(source) as pdf:
+        text = ""
+        for page in pdf.pages:
+            text += (page.extract_text() or "") + "\n"
+    if len(text) > max_chars:
+        text = text[:max_chars] + "...(truncated)"
+    return text
+
+
+@pytest.mark.parametrize("max_chars", [50, 1000, 10**6])
+def test_same_text_as_extracting_every_page(tmp_path, max_chars):
+    path = tmp_path / "document.pdf"
+    path.write_bytes(make_pdf(5, lines_per_page=10))
+    assert extract_pdf_text(str(path), max_chars) == legacy_extract(str(path), max_chars)
+    assert extract_pdf_text(path.read_bytes(), max_chars) == legacy_extract(str(path), max_chars)
+
+
+def test_pages_without_text_are_empty():
+    assert list(iter_pdf_pages(make_pdf(2, lines_per_page=0))) == ["", ""]
+
+
+def test_process_pool_keeps_page_order(tmp_path, monkeypatch):
+    monkeypatch.setattr(pdf_extractor, "PDF_WORKERS", 2)
+    monkeypatch.setattr(pdf_extractor, "PDF_PAGES_PER_TASK", 3)
+    monkeypatch.setattr(pdf_extractor, "PDF_PARALLEL_MIN_PAGES", 4)
+    path = tmp_path / "document.pdf"
+    path.write_bytes(make_pdf(20, lines_per_page=2))
+    pages = list(iter_pdf_pages(str(path)))
+    assert len(pages) == 20
+    assert all(f"of page {number}:" in text for number, text in enumerate(pages, 1))
+
+
+def test_process_pool_is_given_a_path_for_bytes(tmp_path, monkeypatch):
+    monkeypatch.setattr(pdf_extractor, "PDF_WORKERS", 2)
+    monkeypatch.setattr(pdf_extractor, "PDF_PAGES_PER_TASK", 3)
+    monkeypatch.setattr(pdf_extractor, "PDF_PARALLEL_MIN_PAGES", 4)
+    monkeypatch.setattr(tempfile, "tempdir", str(tmp_path))
+    pool = pdf_extractor._get_pool()
+    submitted = []
+
+    class SpyPool:
+        def submit(self, func, *args):
+            submitted.append(args)
+            return pool.submit(func, *args)
+
+    monkeypatch.setattr(pdf_extractor, "_get_pool", lambda: SpyPool())
+    data = make_pdf(20, lines_per_page=2)
+    pages = list(iter_pdf_pages(data))
+    assert all(f"of page {number}:" in text for number, text in enumerate(pages, 1))
+    # Every batch reads the same spooled file, which is gone afterwards.
+    assert len(submitted) == 7 and len({args[0] for args in submitted}) == 1
+    assert isinstance(submitted[0][0], str)
+    assert os.listdir(tmp_path) == []
@@ -0,0 +1,104 @@
+import asyncio
+import threading
+import time
+from types import SimpleNamespace
+import pytest
+import gemini_handler
+from gemini_resilience import ResilientStreamer
+
+
+class FakeModel:
+    """Answers summary requests and streams the final answer, recording every request."""
+
+    def __init__(self, fail_on=None):
+        self.summaries = 0
+        self.streamed = []
+        self.active = self.peak = 0
+        self.fail_on = fail_on
+        self._lock = threading.Lock()
+
+    def generate_content(self, contents, stream=False, **kwargs):
+        if stream:
+            self.streamed.append(contents[0]["parts"][0]["text"])
+            return iter([SimpleNamespace(text="câu "), SimpleNamespace(text="trả lời")])
+        with self._lock:
+            self.summaries += 1
+            self.active += 1
+            self.peak = max(self.peak, self.active)
+        try:
+            time.sleep(0.01)
+            if self.fail_on and self.fail_on in contents:
+                raise RuntimeError("quota")
+            return SimpleNamespace(text=f"tóm tắt {contents[-20:]}")
+        finally:
+            with self._lock:
+                self.active -= 1
+
+
+@pytest.fixture
+def model(monkeypatch):
+    model = FakeModel()
+    genai = SimpleNamespace(types=SimpleNamespace(GenerationConfig=lambda **settings: settings))
+    monkeypatch.setattr(gemini_handler, "get_genai", lambda: genai)
+    monkeypatch.setattr(gemini_handler, "get_text_model", lambda *args: model)
+    monkeypatch.setattr(gemini_handler, "PDF_MAP_REDUCE", True)
+    monkeypatch.setattr(gemini_handler, "CONTEXT_CACHE_ENABLED", False)
+    monkeypatch.setattr(gemini_handler, "resilience", ResilientStreamer())
+    gemini_handler._chunk_summaries.clear()
+    return model
+
+
+def long_text(chunks):
+    line = "Doanh thu quý ba tăng mười hai phần trăm so với cùng kỳ năm trước.\n"
+    size = gemini_handler.PDF_CHUNK_TOKENS * gemini_handler.CHARS_PER_TOKEN
+    return "".join(f"Mục {i}\n" + line * (size // len(line) - 1) for i in range(chunks))
+
+
+def ask(text, prompt="Tóm tắt tài liệu"):
+    progress = []
+
+    async def on_progress(done, total):
+        progress.append((done, total))
+
+    async def main():
+        return "".join([chunk async for chunk in gemini_handler.analyze_pdf_async(text, prompt, on_progress)])
+
+    return asyncio.run(main()), progress
+
+
+def test_short_pdf_is_sent_in_full(model):
+    answer, progress = ask("Hợp đồng ngắn.")
+    assert answer == "câu trả lời"
+    assert model.summaries == 0 and progress == []
+    assert "Hợp đồng ngắn." in model.streamed[0]
+
+
+def test_long_pdf_is_summarized_chunk_by_chunk(model):
+    text = long_text(10)
+    answer, progress = ask(text)
+    assert answer == "câu trả lời"
+    chunks = model.summaries
+    assert chunks >= 10
+    assert progress == [(done, chunks) for done in range(1, chunks + 1)]
+    assert model.peak <= gemini_handler.PDF_MAP_CONCURRENCY
+    # Only the summaries and the request reach the reduce pass.
+    reduce = model.streamed[-1]
+    assert reduce.count("Part ") == chunks and "Tóm tắt tài liệu" in reduce
+    assert len(reduce) < len(text) // 10
+
+
+def test_follow_up_questions_reuse_the_chunk_summaries(model):
+    text = long_text(6)
+    ask(text)
+    summaries = model.summaries
+    _, progress = ask(text, "Doanh thu tăng bao nhiêu?")
+    assert model.summaries == summaries
+    assert len(model.streamed) == 2 and "Doanh thu tăng bao nhiêu?" in model.streamed[-1]
+    assert progress[-1] == (summaries, summaries)
+
+
+def test_failed_chunk_fails_the_request(model):
+    model.fail_on = "Mục 3\n"
+    with pytest.raises(Exception, match="Error processing PDF"):
+        ask(long_text(6))
+    assert model.streamed == []
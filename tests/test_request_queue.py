@@ -0,0 +1,127 @@
+import asyncio
+import time
+import pytest
+from request_queue import QueueFull, RequestQueue
+
+
+class FakeModel:
+    """Answers after a controllable delay and records what ran when."""
+
+    def __init__(self):
+        self.started = []
+        self.finished = []
+        self.running = 0
+        self.peak = 0
+
+    def request(self, name, delay):
+        async def answer():
+            self.started.append(name)
+            self.running += 1
+            self.peak = max(self.peak, self.running)
+            try:
+                await asyncio.sleep(delay)
+            finally:
+                self.running -= 1
+            self.finished.append(name)
+            return f"answer {name}"
+        return answer
+
+
+async def submit(queue, chat_id, make_coro, delay=0.0):
+    await asyncio.sleep(delay)
+    return await queue.run(chat_id, make_coro)
+
+
+def test_requests_of_a_chat_run_in_arrival_order():
+    model = FakeModel()
+
+    async def main():
+        queue = RequestQueue(max_active=4, max_waiting=10, max_pending=5)
+        # Later requests are faster, but must still wait for the earlier ones.
+        return await asyncio.gather(*(submit(queue, 1, model.request(i, 0.05 - 0.01 * i), 0.001 * i)
+                                      for i in range(3)))
+
+    assert asyncio.run(main()) == ["answer 0", "answer 1", "answer 2"]
+    assert model.finished == [0, 1, 2]
+    assert model.peak == 1
+
+
+def test_chats_run_concurrently_up_to_max_active():
+    model = FakeModel()
+
+    async def main():
+        queue = RequestQueue(max_active=3, max_waiting=10)
+        started = time.monotonic()
+        await asyncio.gather(*(submit(queue, chat_id, model.request(chat_id, 0.1)) for chat_id in range(6)))
+        return time.monotonic() - started
+
+    elapsed = asyncio.run(main())
+    assert model.peak == 3
+    assert 0.2 <= elapsed < 0.35
+
+
+def test_overload_is_rejected_right_away():
+    model = FakeModel()
+
+    async def main():
+        queue = RequestQueue(max_active=1, max_waiting=1, max_pending=5)
+        running = [asyncio.create_task(submit(queue, chat_id, model.request(chat_id, 0.1))) for chat_id in (1, 2)]
+        await asyncio.sleep(0.01)
+        with pytest.raises(QueueFull):
+            await queue.run(3, model.request(3, 0.1))
+        await asyncio.gather(*running)
+        return queue
+
+    queue = asyncio.run(main())
+    assert queue.rejected == 1
+    assert model.finished == [1, 2]
+    assert (queue.active, queue.waiting) == (0, 0)
+
+
+def test_too_many_pending_requests_in_one_chat():
+    model = FakeModel()
+
+    async def main():
+        queue = RequestQueue(max_active=4, max_waiting=10, max_pending=2)
+        running = [asyncio.create_task(submit(queue, 1, model.request(i, 0.05))) for i in range(2)]
+        await asyncio.sleep(0.01)
+        with pytest.raises(QueueFull):
+            await queue.run(1, model.request(2, 0.05))
+        # Other chats are not affected.
+        assert await queue.run(2, model.request("other", 0.01)) == "answer other"
+        await asyncio.gather(*running)
+
+    asyncio.run(main())
+    assert sorted(model.finished, key=str) == [0, 1, "other"]
+
+
+def test_cancel_policy_answers_only_the_newest_message():
+    model = FakeModel()
+
+    async def main():
+        queue = RequestQueue(policy="cancel", max_active=4, max_waiting=10, max_pending=1)
+        results = await asyncio.gather(*(submit(queue, 1, model.request(i, 0.1), 0.02 * i) for i in range(4)))
+        return queue, results
+
+    queue, results = asyncio.run(main())
+    assert results == [None, None, None, "answer 3"]
+    assert model.finished == [3]
+    assert queue.cancelled == 3
+
+
+def test_cancelling_the_caller_cancels_its_request():
+    model = FakeModel()
+
+    async def main():
+        queue = RequestQueue(max_active=1, max_waiting=1)
+        task = asyncio.create_task(queue.run(1, model.request(1, 1.0)))
+        await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        await asyncio.sleep(0)
+        return queue
+
+    queue = asyncio.run(main())
+    assert model.started == [1] and model.finished == []
+    assert (queue.active, queue.waiting, model.running) == (0, 0, 0)
@@ -0,0 +1,118 @@
+import asyncio
+import time
+import gemini_handler
+import telegram_handler
+from conversation_manager import ConversationManager, SQLiteConversationStore
+from config_service import ChatProfile
+from gemini_resilience import ResilientStreamer
+from response_cache import ResponseCache, normalize_prompt, replay_chunks
+from tests.fakes import FakeBot, make_update
+
+SETTINGS = (0.7, 0.9, 40, 2048)
+
+
+def test_prompts_differing_in_case_and_spacing_share_an_entry():
+    assert normalize_prompt("  Xin   CHÀO\nbạn ") == "xin chào bạn"
+    key = ResponseCache.key("Xin chào", "si", "m", SETTINGS)
+    assert ResponseCache.key(" xin  CHÀO ", "si", "m", SETTINGS) == key
+    # Anything else that changes the reply is part of the key.
+    assert ResponseCache.key("Xin chào", "other", "m", SETTINGS) != key
+    assert ResponseCache.key("Xin chào", "si", "other", SETTINGS) != key
+    assert ResponseCache.key("Xin chào", "si", "m", (0.1,) + SETTINGS[1:]) != key
+    assert ResponseCache.key("Xin chào", "si", "m", SETTINGS, [{"role": "user", "content": "a"}]) != key
+
+
+def test_entries_expire_and_the_least_recently_used_is_dropped(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(time, "monotonic", lambda: now[0])
+    cache = ResponseCache(ttl=10, max_entries=2)
+    cache.put("a", "A")
+    cache.put("b", "B")
+    assert cache.get("a") == "A"
+    cache.put("c", "C")
+    assert cache.get("b") is None
+    now[0] += 11
+    assert cache.get("a") is None
+    assert cache.stats() == {"hits": 1, "misses": 2, "hit_rate": 1 / 3, "entries": 1}
+
+
+def test_replay_chunks_rebuild_the_reply():
+    text = "x" * 450
+    assert "".join(replay_chunks(text, 200)) == text
+    assert [len(chunk) for chunk in replay_chunks(text, 200)] == [200, 200, 50]
+    assert replay_chunks("") == [""]
+
+
+def ask(prompt, history=(), use_cache=True):
+    async def main():
+        return "".join([chunk async for chunk in gemini_handler.generate_text_async(
+            prompt, "si", history, use_cache, ChatProfile("private", "m", *SETTINGS))])
+    return asyncio.run(main())
+
+
+def test_repeated_prompt_is_answered_from_the_cache(monkeypatch):
+    calls = []
+
+    def generate_text(prompt, system_instruction, history, model_name=None, profile=None):
+        calls.append(prompt)
+        return iter(["trả lời ", f"số {len(calls)}"])
+
+    monkeypatch.setattr(gemini_handler, "RESPONSE_CACHE_ENABLED", True)
+    monkeypatch.setattr(gemini_handler, "FALLBACK_MODEL_NAME", "m")
+    monkeypatch.setattr(gemini_handler, "response_cache", ResponseCache())
+    monkeypatch.setattr(gemini_handler, "resilience", ResilientStreamer())
+    monkeypatch.setattr(gemini_handler, "generate_text", generate_text)
+
+    assert ask("Thủ đô của Pháp?") == "trả lời số 1"
+    assert ask("thủ đô của  pháp?") == "trả lời số 1"
+    assert len(calls) == 1
+    # Opting out, or a turn with history, always reaches the model.
+    assert ask("Thủ đô của Pháp?", use_cache=False) == "trả lời số 2"
+    assert ask("Thủ đô của Pháp?", [{"role": "user", "content": "chào"}]) == "trả lời số 3"
+    assert ask("Thủ đô của Pháp?") == "trả lời số 1"
+
+
+def test_fallback_replies_are_not_cached(monkeypatch):
+    calls = []
+
+    class Overloaded(Exception):
+        code = 503
+
+    def generate_text(prompt, system_instruction, history, model_name=None, profile=None):
+        calls.append(model_name)
+        if model_name == "m":
+            raise Overloaded()
+        return iter([f"trả lời của {model_name}"])
+
+    cache = ResponseCache()
+    monkeypatch.setattr(gemini_handler, "RESPONSE_CACHE_ENABLED", True)
+    monkeypatch.setattr(gemini_handler, "FALLBACK_MODEL_NAME", "fallback")
+    monkeypatch.setattr(gemini_handler, "response_cache", cache)
+    monkeypatch.setattr(gemini_handler, "resilience", ResilientStreamer(max_retries=0))
+    monkeypatch.setattr(gemini_handler, "generate_text", generate_text)
+
+    assert ask("Thủ đô của Pháp?") == "trả lời của fallback"
+    assert ask("Thủ đô của Pháp?") == "trả lời của fallback"
+    assert calls == ["m", "fallback", "m", "fallback"]
+    assert cache.stats()["entries"] == 0
+
+
+def test_nocache_choice_is_kept_in_the_conversation_store(tmp_path, monkeypatch):
+    monkeypatch.setattr(telegram_handler, "is_user_allowed", lambda username: True)
+
+    def toggle(store):
+        monkeypatch.setattr(telegram_handler, "conversation_manager", ConversationManager(store))
+        bot = FakeBot()
+        asyncio.run(telegram_handler.toggle_cache(make_update(bot, text="/nocache"), None))
+        return bot.calls[-1].text
+
+    path = tmp_path / "conversations.db"
+    store = SQLiteConversationStore(path)
+    assert toggle(store).startswith("Đã tắt")
+    store.close()
+    # After a restart the user is still opted out.
+    store = SQLiteConversationStore(path)
+    assert store.get_setting(1, telegram_handler.NOCACHE_SETTING) == "1"
+    assert toggle(store).startswith("Đã bật")
+    assert store.get_setting(1, telegram_handler.NOCACHE_SETTING) is None
+    store.close()
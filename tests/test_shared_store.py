@@ -0,0 +1,87 @@
+import asyncio
+import multiprocessing
+import time
+import pytest
+from conversation_manager import ConversationManager, SharedSQLiteConversationStore
+from request_queue import RequestQueue
+from webhook_server import chat_id_of
+
+MESSAGES_PER_CHAT = 3
+
+
+def worker(path, updates, done, delay, max_active):
+    """A worker process answering the updates the router sends it."""
+    conversations = ConversationManager(SharedSQLiteConversationStore(path))
+
+    async def answer(chat_id, text):
+        history = await conversations.get_history_async(chat_id)
+        await asyncio.sleep(delay)  # The model
+        await conversations.add_message_async(chat_id, "user", text)
+        await conversations.add_message_async(chat_id, "model", f"{text}: {len(history)} earlier")
+
+    async def main():
+        queue = RequestQueue(max_active=max_active, max_waiting=1000, max_pending=1000)
+        loop = asyncio.get_running_loop()
+        tasks = []
+        done.put("ready")
+        while (data := await loop.run_in_executor(None, updates.get)) is not None:
+            chat_id, text = chat_id_of(data), data["message"]["text"]
+            tasks.append(asyncio.create_task(queue.run(chat_id, lambda chat_id=chat_id, text=text: answer(chat_id, text))))
+        await asyncio.gather(*tasks)
+
+    asyncio.run(main())
+    conversations.close()
+    done.put("done")
+
+
+def route(path, workers, chats, delay=0.05, max_active=4):
+    """Send every chat's messages through ``workers`` processes; return the seconds taken."""
+    context = multiprocessing.get_context("spawn")
+    queues = [context.Queue() for _ in range(workers)]
+    done = context.Queue()
+    processes = [context.Process(target=worker, args=(str(path), queue, done, delay, max_active))
+                 for queue in queues]
+    for process in processes:
+        process.start()
+    for _ in processes:
+        assert done.get(timeout=60) == "ready"
+    started = time.monotonic()
+    for number in range(MESSAGES_PER_CHAT):
+        for chat_id in range(1, chats + 1):
+            data = {"message": {"chat": {"id": chat_id}, "text": f"tin {number}"}}
+            queues[chat_id % workers].put(data)
+    for queue in queues:
+        queue.put(None)
+    for _ in processes:
+        assert done.get(timeout=120) == "done"
+    elapsed = time.monotonic() - started
+    for process in processes:
+        process.join()
+    return elapsed
+
+
+def expected_history():
+    history = []
+    for number in range(MESSAGES_PER_CHAT):
+        history.append({"role": "user", "content": f"tin {number}"})
+        history.append({"role": "model", "content": f"tin {number}: {2 * number} earlier"})
+    return history
+
+
+def test_workers_keep_each_chat_in_order(tmp_path):
+    path = tmp_path / "conversations.db"
+    route(path, workers=2, chats=10)
+    store = SharedSQLiteConversationStore(str(path))
+    try:
+        for chat_id in range(1, 11):
+            assert store.get(chat_id) == expected_history()
+    finally:
+        store.close()
+
+
+@pytest.mark.slow
+def test_throughput_scales_with_workers(tmp_path):
+    results = {workers: route(tmp_path / f"{workers}.db", workers, chats=32) for workers in (1, 4)}
+    rates = {workers: 32 * MESSAGES_PER_CHAT / elapsed for workers, elapsed in results.items()}
+    print("\n" + "\n".join(f"{workers} workers: {rate:.0f} requests/s" for workers, rate in rates.items()))
+    assert rates[4] > rates[1] * 2.5
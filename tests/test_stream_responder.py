@@ -0,0 +1,149 @@
+import asyncio
+import pytest
+import re
+import stream_responder
+from config import TELEGRAM_MSG_CHAR_LIMIT
+from conversation_manager import ConversationManager, MemoryConversationStore
+from edit_scheduler import EditScheduler
+from html_format import format_message
+from stream_responder import EMPTY_REPLY, StreamResponder
+from tests.corpus import model_reply
+from tests.fakes import FakeBot, make_update
+
+
+async def chunks(texts, delay=0.0):
+    for text in texts:
+        if delay:
+            await asyncio.sleep(delay)
+        yield text
+
+
+async def respond(bot, texts, delay=0.0, **kwargs):
+    update = make_update(bot, text="câu hỏi")
+    init_msg = await update.message.reply_text("Đang suy nghĩ...")
+    responder = StreamResponder(update, init_msg, **kwargs)
+    reply = await responder.stream(chunks(texts, delay))
+    return responder, init_msg, reply
+
+
+def test_streams_the_reply_and_saves_the_exchange():
+    conversations = ConversationManager(MemoryConversationStore())
+
+    async def main():
+        bot = FakeBot()
+        responder, message, reply = await respond(bot, ["Xin ", "**chào**", " bạn"],
+                                                  conversation_manager=conversations, user_id=7,
+                                                  user_message="câu hỏi")
+        return message, reply
+
+    message, reply = asyncio.run(main())
+    assert reply == "Xin **chào** bạn"
+    assert message.text == "Xin <b>chào</b> bạn"
+    assert conversations.get_history(7) == [
+        {"role": "user", "content": "câu hỏi"},
+        {"role": "model", "content": "Xin **chào** bạn"},
+    ]
+
+
+def test_first_edit_is_recorded_when_the_edit_is_delivered():
+    stages = []
+
+    async def main():
+        bot = FakeBot(latency=0.2)
+        responder, _, _ = await respond(bot, ["một", " hai"], timing_hook=lambda stage, seconds: stages.append(stage))
+        return responder.timings
+
+    timings = asyncio.run(main())
+    assert stages == ["first_token", "first_edit", "total"]
+    # Queuing the edit takes no time; delivering it takes the Bot API latency.
+    assert timings["first_edit"] - timings["first_token"] >= 0.2
+    assert timings["first_edit"] <= timings["total"]
+
+
+def test_cancelled_stream_keeps_the_partial_answer_out_of_history():
+    conversations = ConversationManager(MemoryConversationStore())
+
+    async def main():
+        bot = FakeBot()
+        update = make_update(bot, text="câu hỏi")
+        init_msg = await update.message.reply_text("Đang suy nghĩ...")
+        responder = StreamResponder(update, init_msg, conversations, 7, "câu hỏi")
+        task = asyncio.create_task(responder.stream(chunks(["đang ", "viết ", "dở"] + ["..."] * 100, delay=0.05)))
+        await asyncio.sleep(0.13)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        return init_msg
+
+    message = asyncio.run(main())
+    assert message.text.startswith("đang viết")
+    assert conversations.get_history(7) == []
+
+
+def test_long_reply_continues_in_new_messages():
+    reply = model_reply(120, code_every=3)
+    texts = [reply[i:i + 200] for i in range(0, len(reply), 200)]
+
+    async def main():
+        bot = FakeBot()
+        _, message, streamed = await respond(bot, texts)
+        return bot, message, streamed
+
+    bot, message, streamed = asyncio.run(main())
+    assert streamed == reply
+    sent = [m for m in bot.messages.values() if m.from_bot]
+    assert len(sent) >= len(format_message(reply)) // TELEGRAM_MSG_CHAR_LIMIT + 1
+    # FakeBot rejects texts over the limit; finished parts are kept, not resent.
+    assert bot.count("delete_message") == 0
+    assert all(len(m.text) <= TELEGRAM_MSG_CHAR_LIMIT for m in sent)
+    words = lambda html: re.sub(r"<[^>]*>|`", "", html).split()
+    assert [w for m in sent for w in words(m.text)] == words(format_message(reply))
+
+
+async def failing(texts, error):
+    for text in texts:
+        await asyncio.sleep(0.02)
+        yield text
+    raise error
+
+
+def test_failed_stream_leaves_nothing_in_the_edit_scheduler(monkeypatch):
+    scheduler = EditScheduler(chat_rate=50, chat_burst=1)
+    monkeypatch.setattr(stream_responder, "edit_scheduler", scheduler)
+    conversations = ConversationManager(MemoryConversationStore())
+
+    async def main():
+        bot = FakeBot()
+        messages = []
+        for chat_id in range(1, 6):
+            update = make_update(bot, chat_id=chat_id, text="câu hỏi")
+            init_msg = await update.message.reply_text("Đang suy nghĩ...")
+            messages.append(init_msg)
+            responder = StreamResponder(update, init_msg, conversations, chat_id, "câu hỏi")
+            with pytest.raises(RuntimeError):
+                await responder.stream(failing(["một ", "hai ", "ba"], RuntimeError("Gemini error")))
+        # Let the chat buckets refill, as they would before the next sweep.
+        await asyncio.sleep(0.1)
+        scheduler._sweep()
+        return messages
+
+    messages = asyncio.run(main())
+    assert scheduler._states == {} and scheduler._chat_buckets == {}
+    # The partial answer stays visible but is not saved.
+    assert all(message.text.startswith("một") for message in messages)
+    assert all(conversations.get_history(chat_id) == [] for chat_id in range(1, 6))
+
+
+def test_empty_reply_replaces_the_placeholder():
+    conversations = ConversationManager(MemoryConversationStore())
+
+    async def main():
+        bot = FakeBot()
+        _, message, reply = await respond(bot, [], conversation_manager=conversations, user_id=7,
+                                          user_message="câu hỏi")
+        return message, reply
+
+    message, reply = asyncio.run(main())
+    assert reply == ""
+    assert message.text == EMPTY_REPLY
+    assert conversations.get_history(7) == []
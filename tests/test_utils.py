@@ -0,0 +1,79 @@
+import asyncio
+import threading
+import time
+import pytest
+from utils import iterate_in_thread, split_text
+
+
+async def collect(stream):
+    return [item async for item in stream]
+
+
+def test_iterate_in_thread_yields_items_in_order():
+    assert asyncio.run(collect(iterate_in_thread(lambda: iter(range(100)), max_buffered=3))) == list(range(100))
+
+
+def test_iterate_in_thread_raises_the_iterator_error():
+    def failing():
+        yield 1
+        raise ValueError("boom")
+
+    with pytest.raises(ValueError, match="boom"):
+        asyncio.run(collect(iterate_in_thread(failing)))
+
+
+def test_iterate_in_thread_keeps_the_event_loop_free():
+    def slow():
+        for i in range(3):
+            time.sleep(0.05)
+            yield i
+
+    async def main():
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                ticks += 1
+                await asyncio.sleep(0.01)
+
+        task = asyncio.create_task(ticker())
+        items = await collect(iterate_in_thread(slow))
+        task.cancel()
+        return items, ticks
+
+    items, ticks = asyncio.run(main())
+    assert items == [0, 1, 2]
+    assert ticks >= 5
+
+
+def test_iterate_in_thread_stops_the_producer_when_the_consumer_stops():
+    produced = []
+    closed = threading.Event()
+
+    def endless():
+        try:
+            i = 0
+            while True:
+                produced.append(i)
+                yield i
+                i += 1
+        finally:
+            closed.set()
+
+    async def main():
+        stream = iterate_in_thread(endless, max_buffered=2)
+        async for item in stream:
+            if item == 5:
+                break
+        await stream.aclose()
+
+    asyncio.run(main())
+    assert closed.wait(2)
+    assert len(produced) <= 5 + 1 + 2 + 1
+
+
+def test_split_text_prefers_line_breaks():
+    text = "a" * 6 + "\n" + "b" * 6
+    assert split_text(text, 10) == ["a" * 6 + "\n", "b" * 6]
+    assert "".join(split_text("x" * 25, 10)) == "x" * 25
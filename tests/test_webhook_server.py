@@ -0,0 +1,53 @@
+import asyncio
+import json
+from aiohttp.test_utils import TestClient, TestServer
+from config import WEBHOOK_PATH
+from webhook_server import SECRET_HEADER, chat_id_of, create_web_app
+
+SECRET = "bi-mat_123"
+
+
+def update(update_id, chat_id=42):
+    return {"update_id": update_id, "message": {"message_id": update_id, "date": 0, "text": "xin chào",
+                                                 "chat": {"id": chat_id, "type": "private"}}}
+
+
+async def post_all(requests):
+    received = []
+
+    async def dispatch(data):
+        received.append(data)
+
+    async with TestClient(TestServer(create_web_app(SECRET, dispatch))) as client:
+        statuses = []
+        for headers, body in requests:
+            response = await client.post(WEBHOOK_PATH, data=body, headers=headers)
+            statuses.append(response.status)
+    return statuses, received
+
+
+def test_updates_need_the_secret_token():
+    body = json.dumps(update(1))
+    statuses, received = asyncio.run(post_all([
+        ({}, body),
+        ({SECRET_HEADER: "sai"}, body),
+        ({SECRET_HEADER: SECRET}, "không phải json"),
+        ({SECRET_HEADER: SECRET, "Content-Type": "application/json"}, body),
+    ]))
+    assert statuses == [403, 403, 400, 200]
+    assert received == [update(1)]
+
+
+def test_non_ascii_secret_token_is_rejected():
+    body = json.dumps(update(1))
+    statuses, received = asyncio.run(post_all([
+        ({SECRET_HEADER: "bí-mật_123"}, body),
+        ({SECRET_HEADER: SECRET + "é"}, body),
+    ]))
+    assert statuses == [403, 403]
+    assert received == []
+
+
+def test_chat_id_of():
+    assert chat_id_of(update(1, chat_id=-100)) == -100
+    assert chat_id_of({"update_id": 1, "edited_message": {}}) == 0
@@ -1,3 +1,95 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from config import GEMINI_MAX_WORKERS, GEMINI_SPARE_WORKERS, STREAM_QUEUE_SIZE
+from config_service import config_service
+
+# A stream that lost a hedge or was cancelled keeps its thread until its
+# current read returns, so the pool has room for as many of those as there
+# are active streams.
+_stream_executor = ThreadPoolExecutor(max_workers=2 * GEMINI_MAX_WORKERS, thread_name_prefix="gemini-stream")
+# Fallback and hedged streams get their own threads, so they are never
+# queued behind the primary streams they are meant to rescue.
+_spare_executor = ThreadPoolExecutor(max_workers=GEMINI_SPARE_WORKERS, thread_name_prefix="gemini-spare")
+_DONE = object()
+
+
 def is_user_allowed(username):
-    from config import ALLOWED_USERS
-    return username in ALLOWED_USERS or not ALLOWED_USERS
\ No newline at end of file
+    return config_service.is_user_allowed(username)
+
+
+def split_text(text, max_chars):
+    """Split text into chunks of at most ``max_chars``, preferring line breaks."""
+    chunks = []
+    start = 0
+    while start < len(text):
+        end = min(start + max_chars, len(text))
+        if end < len(text):
+            cut = text.rfind("\n", start + max_chars // 2, end)
+            if cut != -1:
+                end = cut + 1
+        chunks.append(text[start:end])
+        start = end
+    return chunks
+
+
+async def iterate_in_thread(make_iterator, max_buffered=STREAM_QUEUE_SIZE, spare=False):
+    """Run a blocking iterator on the worker pool and yield its items asynchronously.
+
+    The iterator is created and consumed entirely on a worker thread, so slow
+    network reads never block the event loop. At most ``max_buffered`` items
+    are held between the producer and the consumer; if the consumer stops
+    early the producer is told to stop at its next item.
+
+    Args:
+        make_iterator: Zero-argument callable returning the blocking iterator.
+        max_buffered (int): Maximum number of items waiting to be consumed.
+        spare (bool): Run on the pool kept for fallback and hedged streams.
+
+    Yields:
+        The items produced by the iterator, in order.
+    """
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+    slots = threading.Semaphore(max_buffered)
+    cancelled = threading.Event()
+
+    def push(item, error=None):
+        try:
+            loop.call_soon_threadsafe(queue.put_nowait, (item, error))
+        except RuntimeError:
+            # The event loop is gone, nobody is listening any more.
+            cancelled.set()
+
+    def produce():
+        iterator = None
+        try:
+            iterator = iter(make_iterator())
+            for item in iterator:
+                slots.acquire()
+                if cancelled.is_set():
+                    return
+                push(item)
+        except BaseException as e:
+            push(_DONE, e)
+        else:
+            push(_DONE)
+        finally:
+            close = getattr(iterator, "close", None)
+            if cancelled.is_set() and close is not None:
+                close()
+
+    loop.run_in_executor(_spare_executor if spare else _stream_executor, produce)
+    try:
+        while True:
+            item, error = await queue.get()
+            if item is _DONE:
+                if error is not None:
+                    raise error
+                break
+            slots.release()
+            yield item
+    finally:
+        cancelled.set()
+        slots.release()
\ No newline at end of file
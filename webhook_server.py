@@ -0,0 +1,148 @@
+import asyncio
+import hmac
+import logging
+import multiprocessing
+import secrets
+import signal
+from contextlib import asynccontextmanager
+from aiohttp import web
+from telegram import Bot, Update
+from config import (TELEGRAM_BOT_TOKEN, WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_LISTEN, WEBHOOK_PORT, WEBHOOK_SECRET,
+                    WEBHOOK_WORKERS, CONVERSATION_BACKEND, STATE_BACKEND, METRICS_PORT)
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+def create_web_app(secret_token, dispatch):
+    """Return the aiohttp app receiving the webhook requests.
+
+    Requests without the secret token registered with Telegram are
+    rejected. Accepted updates are handed to ``await dispatch(data)`` as
+    decoded JSON, which only queues them, so Telegram gets its answer
+    immediately and the handlers run in the background.
+    """
+    async def handle_update(request):
+        # Compared as bytes: compare_digest raises TypeError for non-ASCII strings.
+        received = request.headers.get(SECRET_HEADER, "").encode("utf-8", "replace")
+        if not hmac.compare_digest(received, secret_token.encode("utf-8")):
+            return web.Response(status=403)
+        try:
+            data = await request.json()
+        except ValueError:
+            return web.Response(status=400)
+        await dispatch(data)
+        return web.Response()
+
+    web_app = web.Application()
+    web_app.router.add_post(WEBHOOK_PATH, handle_update)
+    return web_app
+
+async def _serve(web_app, bot, allowed_updates, secret_token):
+    """Register the webhook and serve ``web_app`` until SIGINT or SIGTERM."""
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    await bot.set_webhook(
+        url=WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH,
+        secret_token=secret_token,
+        allowed_updates=allowed_updates,
+    )
+    runner = web.AppRunner(web_app, access_log=None)
+    await runner.setup()
+    try:
+        await web.TCPSite(runner, WEBHOOK_LISTEN, WEBHOOK_PORT).start()
+        logger.info(f"Webhook server listening on {WEBHOOK_LISTEN}:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+        await stop.wait()
+    finally:
+        await runner.cleanup()
+
+def _secret_token():
+    if not WEBHOOK_URL:
+        raise ValueError("WEBHOOK_URL must be set to run in webhook mode")
+    # Without a configured secret a random one is registered on each start.
+    return WEBHOOK_SECRET or secrets.token_urlsafe(32)
+
+async def run_webhook(application, allowed_updates):
+    """Serve ``application`` through a webhook in this process."""
+    secret_token = _secret_token()
+
+    async def dispatch(data):
+        await application.update_queue.put(Update.de_json(data, application.bot))
+
+    async with _running(application):
+        await _serve(create_web_app(secret_token, dispatch), application.bot, allowed_updates, secret_token)
+
+@asynccontextmanager
+async def _running(application):
+    """Start ``application`` with the hooks run_polling would call."""
+    async with application:
+        if application.post_init:
+            await application.post_init(application)
+        await application.start()
+        try:
+            yield
+        finally:
+            await application.stop()
+            if application.post_shutdown:
+                await application.post_shutdown(application)
+
+def chat_id_of(data):
+    message = data.get("message") or {}
+    return (message.get("chat") or {}).get("id", 0)
+
+async def run_router(allowed_updates, workers=WEBHOOK_WORKERS):
+    """Serve the webhook and spread the updates over worker processes.
+
+    All updates of a chat go to the same worker, whose request queue
+    answers them in order. Workers share the conversation history and the
+    per-chat locks through CONVERSATION_BACKEND and STATE_BACKEND. History
+    is kept per user, so only the order within a chat is guaranteed; see
+    SharedSQLiteConversationStore.
+    """
+    secret_token = _secret_token()
+    if CONVERSATION_BACKEND != "shared" or STATE_BACKEND == "local":
+        logger.warning("Several workers are running without shared conversation history or locks")
+
+    context = multiprocessing.get_context("spawn")
+    queues = [context.Queue() for _ in range(workers)]
+    processes = [
+        context.Process(target=run_worker, args=(index, queue), name=f"bot-worker-{index}")
+        for index, queue in enumerate(queues)
+    ]
+    for process in processes:
+        process.start()
+
+    async def dispatch(data):
+        queues[chat_id_of(data) % workers].put(data)
+
+    try:
+        async with Bot(TELEGRAM_BOT_TOKEN) as bot:
+            await _serve(create_web_app(secret_token, dispatch), bot, allowed_updates, secret_token)
+    finally:
+        for queue in queues:
+            queue.put(None)
+        loop = asyncio.get_running_loop()
+        for process in processes:
+            await loop.run_in_executor(None, process.join)
+
+def run_worker(index, updates):
+    """Entry point of a worker process: handle the updates sent by the router."""
+    # Shutdown is driven by the router, not by Ctrl+C reaching the whole group.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    from main import build_application
+    from telegram_handler import conversation_manager
+    metrics_port = METRICS_PORT + 1 + index if METRICS_PORT else 0
+    asyncio.run(_work(build_application(metrics_port), updates))
+    conversation_manager.close()
+
+async def _work(application, updates):
+    loop = asyncio.get_running_loop()
+    async with _running(application):
+        while True:
+            data = await loop.run_in_executor(None, updates.get)
+            if data is None:
+                break
+            await application.update_queue.put(Update.de_json(data, application.bot))